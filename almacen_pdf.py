@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Directorio de salida de los PDFs generados
+
+Los PDFs se escriben en un directorio configurable con nombres que no
+chocan entre sí (número de factura, fecha y un sufijo aleatorio), primero
+en un archivo temporal que luego se renombra, así que nunca queda un PDF a
+medio escribir ni dos peticiones se sobrescriben. Un hilo en segundo plano
+borra los PDFs más viejos que la retención configurada y, si el directorio
+supera el tamaño máximo, los más antiguos hasta volver al límite.
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Configuración por variables de entorno
+DIRECTORIO = os.environ.get('PDF_SALIDA_DIR', 'facturas_generadas')
+RETENCION_DIAS = float(os.environ.get('PDF_RETENCION_DIAS', '30'))
+MAX_BYTES = int(float(os.environ.get('PDF_SALIDA_MAX_MB', '1024')) * 1024 * 1024)
+INTERVALO_LIMPIEZA = float(os.environ.get('PDF_LIMPIEZA_SEGUNDOS', '300'))
+
+_lock = threading.Lock()
+_hilo = []
+_metricas = {
+    'archivos': 0,
+    'bytes_en_uso': 0,
+    'escritos': 0,
+    'eliminados_por_edad': 0,
+    'eliminados_por_tamano': 0,
+    'ultima_limpieza': None,
+}
+
+
+def nombre_archivo(factura_no):
+    """Nombre único para el PDF: factura_<no>_<fecha>_<sufijo>.pdf"""
+    base = re.sub(r'[^\w.-]', '_', factura_no) if factura_no else 'sin_numero'
+    return f"factura_{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.pdf"
+
+
+def escribir_atomico(ruta, datos):
+    """Escribe el archivo en un temporal del mismo directorio y lo renombra"""
+    directorio = os.path.dirname(ruta) or '.'
+    fd, temporal = tempfile.mkstemp(dir=directorio, prefix='.tmp_', suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+
+
+def guardar_pdf(pdf_bytes, factura_no=''):
+    """
+    Guarda un PDF en el directorio de salida
+
+    Returns:
+        La ruta del archivo escrito
+    """
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    ruta = os.path.join(DIRECTORIO, nombre_archivo(factura_no))
+    escribir_atomico(ruta, pdf_bytes)
+    with _lock:
+        _metricas['archivos'] += 1
+        _metricas['bytes_en_uso'] += len(pdf_bytes)
+        _metricas['escritos'] += 1
+    iniciar_limpieza()
+    return ruta
+
+
+def limpiar():
+    """Borra los PDFs vencidos y, si hace falta, los más antiguos hasta respetar el tamaño máximo"""
+    try:
+        archivos = [(info.st_mtime, info.st_size, entrada.path)
+                    for entrada in os.scandir(DIRECTORIO)
+                    if entrada.name.endswith('.pdf') and not entrada.name.startswith('.tmp_')
+                    for info in (entrada.stat(),)]
+    except OSError:
+        archivos = []
+    archivos.sort()
+
+    limite_edad = time.time() - RETENCION_DIAS * 86400 if RETENCION_DIAS > 0 else None
+    total = sum(tamano for _, tamano, _ in archivos)
+    restantes = len(archivos)
+    por_edad = por_tamano = 0
+    for modificado, tamano, ruta in archivos:
+        vencido = limite_edad is not None and modificado < limite_edad
+        if not vencido and (MAX_BYTES <= 0 or total <= MAX_BYTES):
+            break
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tamano
+        restantes -= 1
+        if vencido:
+            por_edad += 1
+        else:
+            por_tamano += 1
+
+    with _lock:
+        _metricas['archivos'] = restantes
+        _metricas['bytes_en_uso'] = total
+        _metricas['eliminados_por_edad'] += por_edad
+        _metricas['eliminados_por_tamano'] += por_tamano
+        _metricas['ultima_limpieza'] = time.time()
+
+
+def _bucle_limpieza():
+    while True:
+        try:
+            limpiar()
+        except Exception as e:
+            print(f"Error al limpiar el directorio de PDFs: {e}")
+        time.sleep(INTERVALO_LIMPIEZA)
+
+
+def iniciar_limpieza():
+    """Arranca el hilo de limpieza una sola vez por proceso"""
+    if _hilo:
+        return
+    with _lock:
+        if _hilo:
+            return
+        hilo = threading.Thread(target=_bucle_limpieza, name='limpieza-pdf', daemon=True)
+        hilo.start()
+        _hilo.append(hilo)
+
+
+def estadisticas():
+    """Archivos y bytes en uso, y cuántos PDFs se han borrado por edad y por tamaño"""
+    with _lock:
+        datos = dict(_metricas)
+    datos['directorio'] = DIRECTORIO
+    datos['max_bytes'] = MAX_BYTES
+    datos['retencion_dias'] = RETENCION_DIAS
+    return datos
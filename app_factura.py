@@ -3,142 +3,261 @@
 Aplicación web para generar facturas de ANCLAJE SOLAR ENERGY
 """
 
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Response, render_template, request, send_file, jsonify, stream_with_context
 from datetime import datetime
+import io
 import os
 import sys
-import requests
-import base64
 
-# Importar la función de generación de facturas
-from generar_factura import generar_factura
+# generar_factura (ReportLab) no se importa aquí: se carga al generar la primera
+# factura o al precalentar (ver arranque), para que el servidor arranque rápido
+import arranque
+from totales import calcular_totales
+import almacen_pdf
+import cache_pdf
+import metricas
+import perfiles_pdf
+from metricas import medir
+from archivo_facturas import archivar_factura, buscar_facturas, obtener_factura, obtener_pdf
+from envios_n8n import encolar_envio, contar_pendientes, listar_fallidos, reintentar_fallido
+from envios_n8n import reanudar_pendientes as reanudar_envios
+import lote_zip
+import numeracion
+import perfilador
+import trabajos_render
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'anclaje-solar-energy-2025'
 
+@app.before_request
+def iniciar_metricas():
+    metricas.iniciar_peticion()
+
+def _generador():
+    """Módulo generar_factura; ReportLab se importa la primera vez que se pide"""
+    return arranque.importar('generar_factura')
+
+def reanudar_colas():
+    """Retoma los envíos a n8n y los trabajos de render que quedaron en cola (se llama al arrancar cada proceso)"""
+    try:
+        pendientes = reanudar_envios()
+        if pendientes:
+            print(f"Reanudando {pendientes} envíos pendientes a n8n")
+    except Exception as e:
+        print(f"Error al reanudar los envíos a n8n: {e}")
+    try:
+        sin_terminar = trabajos_render.reanudar_pendientes()
+        if sin_terminar:
+            print(f"Reanudando {sin_terminar} trabajos de render sin terminar")
+    except Exception as e:
+        print(f"Error al reanudar los trabajos de render: {e}")
+
+def _libro():
+    """Módulo libro_ventas; NumPy se importa la primera vez que se pide"""
+    return arranque.importar('libro_ventas')
+
+@app.after_request
+def agregar_server_timing(respuesta):
+    """Agrega el encabezado Server-Timing con las etapas de la petición"""
+    ruta = request.url_rule.rule if request.url_rule else 'otra'
+    server_timing = metricas.terminar_peticion(ruta)
+    if server_timing:
+        respuesta.headers['Server-Timing'] = server_timing
+    arranque.registrar_respuesta()
+    return respuesta
+
 @app.route('/')
 def index():
     """Página principal con el formulario"""
     return render_template('formulario_factura.html')
 
+def leer_formulario(form):
+    """
+    Lee los datos de la factura enviados por formulario_factura.html
+
+    Returns:
+        Tupla (datos_factura, email_cliente, telefono_cliente, descargar_pdf)
+    """
+    # Obtener datos del formulario
+    nit = form.get('nit', '')
+    telefono = form.get('telefono', '')
+    correo = form.get('correo', '')
+    cliente = form.get('cliente', '')
+    documento = form.get('documento', '')
+    direccion = form.get('direccion', '')
+    email_cliente = form.get('email_cliente', '')
+    telefono_cliente = form.get('telefono_cliente', '')
+    descargar_pdf = form.get('descargar_pdf', '') == '1'
+    fecha_input = form.get('fecha', '')
+    
+    # Convertir fecha de YYYY-MM-DD a DD/MM/YYYY
+    if fecha_input:
+        try:
+            fecha_obj = datetime.strptime(fecha_input, '%Y-%m-%d')
+            fecha = fecha_obj.strftime('%d/%m/%Y')
+        except:
+            fecha = fecha_input
+    else:
+        fecha = datetime.now().strftime("%d/%m/%Y")
+    
+    # Sin número, el servidor asigna el siguiente al generar el PDF (ver
+    # numeracion); uno escrito a mano no puede caer en la serie automática
+    factura_no = form.get('factura_no', '').strip()
+    if factura_no:
+        numeracion.validar_numero_manual(factura_no)
+    
+    # Perfil de salida del PDF (tamaño contra fidelidad, ver perfiles_pdf);
+    # forma parte de los datos para que la caché distinga cada versión
+    perfil = form.get('perfil', '') or perfiles_pdf.PERFIL
+    perfiles_pdf.obtener_perfil(perfil)
+    
+    # Obtener items de la factura
+    items = []
+    descripcion_items = form.getlist('descripcion[]')
+    cantidad_items = form.getlist('cantidad[]')
+    valor_items = form.getlist('valor_unitario[]')
+    tiene_iva_items = form.getlist('tiene_iva[]')
+    
+    for i, (desc, cant, valor) in enumerate(zip(descripcion_items, cantidad_items, valor_items)):
+        if desc and cant and valor:
+            # Verificar si este item tiene IVA (el checkbox envía "1" si está marcado)
+            tiene_iva = str(i) in tiene_iva_items or (i < len(tiene_iva_items) and tiene_iva_items[i] == '1')
+            items.append({
+                'descripcion': desc,
+                'cantidad': int(cant),
+                'valor_unitario': float(valor),
+                'tiene_iva': tiene_iva
+            })
+    
+    # Calcular totales considerando IVA por item
+    with medir('totales'):
+        totales = calcular_totales(items)
+    
+    datos_factura = {
+        'nit': nit,
+        'telefono': telefono,
+        'correo': correo,
+        'cliente': cliente,
+        'documento': documento,
+        'direccion': direccion,
+        'fecha': fecha,
+        'factura_no': factura_no,
+        'items': items,
+        'subtotal': totales['subtotal'],
+        'iva': totales['iva'],
+        'total': totales['total'],
+        'perfil': perfil
+    }
+    return datos_factura, email_cliente, telefono_cliente, descargar_pdf
+
+def datos_envio_n8n(datos_factura, email_cliente, telefono_cliente):
+    """
+    Datos para el webhook de n8n (el PDF se agrega al enviar)
+
+    Returns:
+        Tupla (url, datos), o None si n8n no está configurado o no hay a quién enviar
+    """
+    n8n_webhook_url = os.environ.get('N8N_WEBHOOK_URL')
+    if not n8n_webhook_url or not (email_cliente or telefono_cliente):
+        return None
+    return n8n_webhook_url, {
+        'factura_no': datos_factura['factura_no'],
+        'cliente': datos_factura['cliente'],
+        'email_cliente': email_cliente,
+        'telefono_cliente': telefono_cliente,
+        'fecha': datos_factura['fecha'],
+        'total': datos_factura['total'],
+        'subtotal': datos_factura['subtotal'],
+        'iva': datos_factura['iva'],
+        'items': datos_factura['items']
+    }
+
+def no_modificado(clave):
+    """Respuesta 304 para un cliente que ya tiene el PDF con ese ETag"""
+    respuesta = Response(status=304)
+    respuesta.set_etag(clave)
+    return respuesta
+
 @app.route('/generar', methods=['POST'])
 def generar():
     """Procesar el formulario y generar la factura"""
     try:
-        # Obtener datos del formulario
-        nit = request.form.get('nit', '')
-        telefono = request.form.get('telefono', '')
-        correo = request.form.get('correo', '')
-        cliente = request.form.get('cliente', '')
-        documento = request.form.get('documento', '')
-        direccion = request.form.get('direccion', '')
-        email_cliente = request.form.get('email_cliente', '')
-        telefono_cliente = request.form.get('telefono_cliente', '')
-        descargar_pdf = request.form.get('descargar_pdf', '') == '1'
-        fecha_input = request.form.get('fecha', '')
-        
-        # Convertir fecha de YYYY-MM-DD a DD/MM/YYYY
-        if fecha_input:
-            try:
-                fecha_obj = datetime.strptime(fecha_input, '%Y-%m-%d')
-                fecha = fecha_obj.strftime('%d/%m/%Y')
-            except:
-                fecha = fecha_input
-        else:
-            fecha = datetime.now().strftime("%d/%m/%Y")
-        
-        factura_no = request.form.get('factura_no', '')
-        
-        # Obtener items de la factura
-        items = []
-        descripcion_items = request.form.getlist('descripcion[]')
-        cantidad_items = request.form.getlist('cantidad[]')
-        valor_items = request.form.getlist('valor_unitario[]')
-        tiene_iva_items = request.form.getlist('tiene_iva[]')
+        with medir('formulario'):
+            datos_factura, email_cliente, telefono_cliente, descargar_pdf = leer_formulario(request.form)
+        factura_no = datos_factura['factura_no']
+        with medir('logo'):
+            logo_path = _generador().buscar_logo()
         
-        for i, (desc, cant, valor) in enumerate(zip(descripcion_items, cantidad_items, valor_items)):
-            if desc and cant and valor:
-                # Verificar si este item tiene IVA (el checkbox envía "1" si está marcado)
-                tiene_iva = str(i) in tiene_iva_items or (i < len(tiene_iva_items) and tiene_iva_items[i] == '1')
-                items.append({
-                    'descripcion': desc,
-                    'cantidad': int(cant),
-                    'valor_unitario': float(valor),
-                    'tiene_iva': tiene_iva
-                })
+        # Una factura con número nuevo nunca está en la caché ni en el cliente
+        clave = pdf_bytes = None
+        ya_descargado = False
+        if factura_no:
+            with medir('clave_cache'):
+                clave = cache_pdf.clave_factura(datos_factura, logo_path)
+            
+            # Si el cliente ya tiene este mismo PDF (ETag) no se le vuelve a
+            # mandar; si además no hay envío a n8n, no hay nada que hacer
+            ya_descargado = descargar_pdf and clave in request.if_none_match
+            if ya_descargado and not datos_envio_n8n(datos_factura, email_cliente, telefono_cliente):
+                return no_modificado(clave)
+            
+            # Reutilizar el PDF si la misma factura ya se generó antes
+            with medir('cache'):
+                pdf_bytes = cache_pdf.obtener(clave)
         
-        # Calcular totales considerando IVA por item
-        subtotal = sum(item['cantidad'] * item['valor_unitario'] for item in items)
-        iva = sum(item['cantidad'] * item['valor_unitario'] * 0.19 for item in items if item.get('tiene_iva', False))
-        total = subtotal + iva
-        
-        # Ruta del logo - usar ruta relativa para Deta
-        posibles_logos = [
-            'logo_anclaje.jpeg',
-            'logo.png', 
-            'logo_anclaje.png', 
-            'anclaje_logo.png',
-            '/home/apenagos/Escritorio/papa/logo_anclaje.jpeg'  # Fallback local
-        ]
-        logo_path = None
-        for logo in posibles_logos:
-            if os.path.exists(logo):
-                logo_path = logo
-                break
-        
-        # Generar factura
-        archivo_pdf = generar_factura(
-            logo_path=logo_path,
-            nit=nit,
-            telefono=telefono,
-            correo=correo,
-            cliente=cliente,
-            documento=documento,
-            direccion=direccion,
-            fecha=fecha,
-            factura_no=factura_no,
-            items=items,
-            subtotal=subtotal,
-            iva=iva,
-            total=total
-        )
+        if pdf_bytes is None:
+            # El número automático se asigna justo antes de generar, para que un
+            # error previo no deje huecos en la serie; si falla el PDF se devuelve
+            numero_asignado = not factura_no
+            if numero_asignado:
+                with medir('numeracion'):
+                    factura_no = datos_factura['factura_no'] = numeracion.siguiente_numero()
+                with medir('clave_cache'):
+                    clave = cache_pdf.clave_factura(datos_factura, logo_path)
+            # Generar factura en memoria (sin escribir ni releer el archivo en disco)
+            try:
+                pdf_bytes = _generador().generar_factura(logo_path=logo_path, en_memoria=True, **datos_factura)
+            except Exception:
+                if numero_asignado:
+                    numeracion.devolver_numero(factura_no)
+                raise
+            with medir('cache'):
+                cache_pdf.guardar(clave, pdf_bytes)
+            
+            # Guardar en el archivo de facturas para poder consultarla después
+            if factura_no:
+                try:
+                    with medir('archivo'):
+                        archivar_factura(datos_factura, pdf_bytes)
+                except Exception as e:
+                    print(f"Error al archivar factura {factura_no}: {e}")
+                try:
+                    with medir('libro_ventas'):
+                        _libro().registrar_venta(datos_factura)
+                except Exception as e:
+                    print(f"Error al registrar la venta {factura_no}: {e}")
+        pdf_filename = f'factura_{factura_no}.pdf'
         
-        # Enviar a n8n webhook (si está configurado)
-        n8n_webhook_url = os.environ.get('N8N_WEBHOOK_URL')
-        if n8n_webhook_url and (email_cliente or telefono_cliente):
+        # Encolar el envío a n8n (si está configurado); lo entregan workers en segundo plano
+        envio = datos_envio_n8n(datos_factura, email_cliente, telefono_cliente)
+        if envio:
             try:
-                # Leer el PDF y convertirlo a base64
-                with open(archivo_pdf, 'rb') as pdf_file:
-                    pdf_base64 = base64.b64encode(pdf_file.read()).decode('utf-8')
-                
-                # Preparar datos para n8n
-                webhook_data = {
-                    'factura_no': factura_no,
-                    'cliente': cliente,
-                    'email_cliente': email_cliente,
-                    'telefono_cliente': telefono_cliente,
-                    'fecha': fecha,
-                    'total': total,
-                    'subtotal': subtotal,
-                    'iva': iva,
-                    'items': items,
-                    'pdf_filename': f'factura_{factura_no}.pdf',
-                    'pdf_base64': pdf_base64
-                }
-                
-                # Enviar a n8n
-                requests.post(n8n_webhook_url, json=webhook_data, timeout=10)
+                with medir('encolar_n8n'):
+                    encolar_envio(envio[0], envio[1], pdf_bytes, pdf_filename)
             except Exception as e:
-                print(f"Error al enviar a n8n: {e}")
+                print(f"Error al encolar envío a n8n: {e}")
                 # No fallar si n8n falla, solo continuar
         
         # Si se marcó descarga, enviar el archivo PDF
+        if ya_descargado:
+            return no_modificado(clave)
         if descargar_pdf:
             return send_file(
-                archivo_pdf,
+                io.BytesIO(pdf_bytes),
                 as_attachment=True,
-                download_name=f'factura_{factura_no}.pdf',
-                mimetype='application/pdf'
+                download_name=pdf_filename,
+                mimetype='application/pdf',
+                etag=clave
             )
         else:
             # Si no se descarga, solo confirmar que se envió
@@ -151,6 +270,77 @@ def generar():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/trabajos', methods=['POST'])
+def crear_trabajo():
+    """Recibe el mismo formulario que /generar y encola la generación del PDF"""
+    try:
+        datos_factura, email_cliente, telefono_cliente, _ = leer_formulario(request.form)
+        logo_path = _generador().buscar_logo()
+        envio = datos_envio_n8n(datos_factura, email_cliente, telefono_cliente)
+        # Sin número, se asigna una vez admitido el trabajo: un 503 no deja huecos
+        trabajo_id = trabajos_render.encolar_trabajo(
+            datos_factura, logo_path, envio={'url': envio[0], 'datos': envio[1]} if envio else None,
+            asignar_numero=numeracion.siguiente_numero
+        )
+    except trabajos_render.ColaLlena as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'trabajo_id': trabajo_id,
+        'estado': 'pendiente',
+        'url_estado': f'/trabajos/{trabajo_id}',
+        'url_pdf': f'/trabajos/{trabajo_id}/pdf'
+    }), 202, {'Location': f'/trabajos/{trabajo_id}'}
+
+@app.route('/trabajos/<trabajo_id>', methods=['GET'])
+def estado_trabajo(trabajo_id):
+    """Estado de un trabajo: pendiente, procesando, listo o error"""
+    trabajo = trabajos_render.obtener_trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({'error': f'Trabajo {trabajo_id} no encontrado'}), 404
+    return jsonify(trabajo)
+
+@app.route('/trabajos/<trabajo_id>/pdf', methods=['GET'])
+def pdf_trabajo(trabajo_id):
+    """PDF de un trabajo terminado; 202 mientras se está generando"""
+    estado, pdf_bytes, factura_no = trabajos_render.obtener_pdf_trabajo(trabajo_id)
+    if estado is None:
+        return jsonify({'error': f'Trabajo {trabajo_id} no encontrado'}), 404
+    if estado == 'error':
+        return jsonify({'error': f'El trabajo {trabajo_id} falló', 'estado': estado}), 500
+    if estado != 'listo':
+        return jsonify({'estado': estado}), 202, {'Retry-After': '1'}
+    return send_file(
+        io.BytesIO(pdf_bytes),
+        as_attachment=True,
+        download_name=f'factura_{factura_no}.pdf',
+        mimetype='application/pdf'
+    )
+
+@app.route('/trabajos/estadisticas', methods=['GET'])
+def trabajos_estadisticas():
+    """Trabajos de generación por estado"""
+    return jsonify(trabajos_render.estadisticas())
+
+@app.route('/lote', methods=['POST'])
+def lote():
+    """
+    Recibe facturas en NDJSON (una por línea) y responde un ZIP con los PDFs,
+    que se va enviando a medida que se generan
+
+    Los parámetros nit, telefono y correo de la URL son los valores por
+    defecto de las facturas que no los traen.
+    """
+    logo_path = _generador().buscar_logo()
+    empresa = {campo: request.args.get(campo, '') for campo in ('nit', 'telefono', 'correo')}
+    partes = lote_zip.zip_facturas(lote_zip.leer_ndjson(request.stream), logo_path, empresa)
+    return Response(
+        stream_with_context(partes),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=facturas.zip'}
+    )
+
 @app.route('/calcular_total', methods=['POST'])
 def calcular_total():
     """Endpoint para calcular totales en tiempo real"""
@@ -158,18 +348,162 @@ def calcular_total():
         data = request.json
         items = data.get('items', [])
         
-        subtotal = sum(item['cantidad'] * item['valor_unitario'] for item in items)
-        iva = subtotal * 0.19
-        total = subtotal + iva
-        
-        return jsonify({
-            'subtotal': subtotal,
-            'iva': iva,
-            'total': total
-        })
+        # Los items sin 'tiene_iva' se consideran gravados
+        return jsonify(calcular_totales(items, iva_por_defecto=True))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Histogramas de tiempos por etapa y por ruta en formato Prometheus"""
+    return Response(metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/salud', methods=['GET'])
+def salud():
+    """Liveness: el proceso está vivo y responde"""
+    return jsonify({'estado': 'ok'})
+
+@app.route('/listo', methods=['GET'])
+def listo():
+    """Readiness: el generador está precalentado y la cola de envíos responde"""
+    # No se importa el generador sólo para responder: si no está cargado, no está precalentado
+    precalentado = 'generar_factura' in sys.modules and _generador().esta_precalentado()
+    verificaciones = {
+        'precalentado': precalentado,
+        'logo': precalentado and _generador().buscar_logo() is not None,
+    }
+    try:
+        contar_pendientes()
+        verificaciones['cola_envios'] = True
+    except Exception:
+        verificaciones['cola_envios'] = False
+    preparado = verificaciones['precalentado'] and verificaciones['cola_envios']
+    return jsonify({'listo': preparado, 'verificaciones': verificaciones}), 200 if preparado else 503
+
+@app.route('/arranque', methods=['GET'])
+def reporte_arranque():
+    """Tiempos de importación, precalentamiento y primera respuesta de este worker"""
+    return jsonify(arranque.reporte())
+
+@app.route('/facturas', methods=['GET'])
+def facturas():
+    """Busca facturas archivadas por cliente, documento y rango de fechas (YYYY-MM-DD)"""
+    try:
+        return jsonify(buscar_facturas(
+            cliente=request.args.get('cliente'),
+            documento=request.args.get('documento'),
+            desde=request.args.get('desde'),
+            hasta=request.args.get('hasta'),
+            pagina=request.args.get('pagina', 1, type=int),
+            por_pagina=request.args.get('por_pagina', 50, type=int)
+        ))
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/facturas/<factura_no>', methods=['GET'])
+def factura(factura_no):
+    """Datos e items de una factura archivada"""
+    datos = obtener_factura(factura_no)
+    if datos is None:
+        return jsonify({'error': f'Factura {factura_no} no encontrada'}), 404
+    return jsonify(datos)
+
+@app.route('/facturas/<factura_no>/pdf', methods=['GET'])
+def factura_pdf(factura_no):
+    """PDF de una factura archivada"""
+    pdf_bytes = obtener_pdf(factura_no)
+    if pdf_bytes is None:
+        return jsonify({'error': f'PDF de la factura {factura_no} no encontrado'}), 404
+    return send_file(
+        io.BytesIO(pdf_bytes),
+        as_attachment=True,
+        download_name=f'factura_{factura_no}.pdf',
+        mimetype='application/pdf'
+    )
+
+@app.route('/ventas', methods=['GET'])
+def ventas():
+    """Totales de ventas por día, mes, producto o estado de IVA (libro de ventas)"""
+    try:
+        return jsonify(_libro().resumen_ventas(
+            agrupar=request.args.get('agrupar', 'mes'),
+            desde=request.args.get('desde'),
+            hasta=request.args.get('hasta'),
+            limite=request.args.get('limite', 100, type=int)
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/ventas/estadisticas', methods=['GET'])
+def ventas_estadisticas():
+    """Facturas, items y tamaño en disco del libro de ventas"""
+    return jsonify(_libro().estadisticas())
+
+@app.route('/perfilador', methods=['GET'])
+def perfilador_estado():
+    """Pedido de perfilado vigente y perfiles guardados"""
+    return jsonify(perfilador.estado())
+
+@app.route('/perfilador', methods=['POST'])
+def perfilador_pedir():
+    """Perfila las siguientes 'llamadas' a generar_factura o una de cada 'muestreo'"""
+    datos = request.get_json(silent=True) or {}
+    try:
+        return jsonify(perfilador.pedir(datos.get('llamadas'), datos.get('muestreo')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/perfilador/resumen', methods=['GET'])
+def perfilador_resumen():
+    """Funciones con más tiempo y líneas con más memoria en los perfiles guardados"""
+    try:
+        return jsonify(perfilador.resumen(
+            limite=request.args.get('limite', 20, type=int),
+            ultimos=request.args.get('ultimos', type=int),
+            orden=request.args.get('orden', 'acumulado')
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/perfilador/<archivo>', methods=['GET'])
+def perfilador_archivo(archivo):
+    """Descarga un perfil de cProfile guardado (.prof)"""
+    ruta = perfilador.ruta_perfil(archivo)
+    if ruta is None:
+        return jsonify({'error': f'Perfil {archivo} no encontrado'}), 404
+    return send_file(ruta, as_attachment=True, download_name=archivo, mimetype='application/octet-stream')
+
+@app.route('/almacen/estadisticas', methods=['GET'])
+def almacen_estadisticas():
+    """Uso del directorio de salida de PDFs y PDFs borrados por retención"""
+    return jsonify(almacen_pdf.estadisticas())
+
+@app.route('/cache/estadisticas', methods=['GET'])
+def cache_estadisticas():
+    """Aciertos, fallos y uso de la caché de PDFs"""
+    return jsonify(cache_pdf.estadisticas())
+
+@app.route('/numeracion/estadisticas', methods=['GET'])
+def numeracion_estadisticas():
+    """Siguiente número de cada prefijo y bloque reservado por este worker"""
+    return jsonify(numeracion.estadisticas())
+
+@app.route('/envios/fallidos', methods=['GET'])
+def envios_fallidos():
+    """Lista los envíos a n8n que agotaron sus reintentos"""
+    limite = request.args.get('limite', 100, type=int)
+    return jsonify({
+        'pendientes': contar_pendientes(),
+        'fallidos': listar_fallidos(limite)
+    })
+
+@app.route('/envios/fallidos/<int:envio_id>/reintentar', methods=['POST'])
+def reintentar_envio(envio_id):
+    """Vuelve a encolar un envío fallido"""
+    if not reintentar_fallido(envio_id):
+        return jsonify({'error': f'Envío {envio_id} no encontrado'}), 404
+    return jsonify({'success': True, 'id': envio_id})
+
 if __name__ == '__main__':
     # Crear directorio de templates si no existe
     if not os.path.exists('templates'):
@@ -181,4 +515,10 @@ if __name__ == '__main__':
     print("\nServidor iniciado en: http://localhost:5000")
     print("Presiona Ctrl+C para detener el servidor\n")
     
+    # Cargar logo y ReportLab según PRECALENTAR (por defecto, en segundo plano)
+    segundos = arranque.precalentar()
+    if segundos is not None:
+        print(f"Precalentamiento completado en {segundos:.2f} s")
+    reanudar_colas()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Archivo de facturas generadas
+
+Guarda los datos de cada factura, sus items y el PDF en una base SQLite con
+índices por número de factura, cliente, documento y fecha, para encontrar
+facturas anteriores sin recorrer archivos ni volver a generarlas. El PDF se
+guarda en una tabla aparte para que las búsquedas no tengan que leerlo.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Configuración por variables de entorno
+ARCHIVO_DB = os.environ.get('ARCHIVO_DB', 'facturas.db')
+GUARDAR_PDF = os.environ.get('ARCHIVO_GUARDAR_PDF', '1') == '1'
+POR_PAGINA_MAX = 200
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS facturas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    factura_no TEXT NOT NULL UNIQUE,
+    cliente TEXT COLLATE NOCASE,
+    documento TEXT,
+    direccion TEXT,
+    nit TEXT,
+    telefono TEXT,
+    correo TEXT,
+    fecha TEXT,
+    fecha_iso TEXT,
+    subtotal REAL,
+    iva REAL,
+    total REAL,
+    pdf_ruta TEXT,
+    creado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_facturas_cliente ON facturas (cliente, fecha_iso);
+CREATE INDEX IF NOT EXISTS idx_facturas_documento ON facturas (documento, fecha_iso);
+CREATE INDEX IF NOT EXISTS idx_facturas_fecha ON facturas (fecha_iso);
+CREATE TABLE IF NOT EXISTS facturas_items (
+    factura_id INTEGER NOT NULL REFERENCES facturas (id) ON DELETE CASCADE,
+    posicion INTEGER NOT NULL,
+    descripcion TEXT,
+    cantidad INTEGER,
+    valor_unitario REAL,
+    tiene_iva INTEGER,
+    PRIMARY KEY (factura_id, posicion)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS facturas_pdf (
+    factura_id INTEGER PRIMARY KEY REFERENCES facturas (id) ON DELETE CASCADE,
+    pdf BLOB NOT NULL
+);
+"""
+
+_CAMPOS = ['id', 'factura_no', 'cliente', 'documento', 'direccion', 'nit', 'telefono', 'correo',
+           'fecha', 'fecha_iso', 'subtotal', 'iva', 'total', 'pdf_ruta', 'creado']
+
+_local = threading.local()
+
+
+def _conexion():
+    """Retorna la conexión del hilo actual, creándola si no existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(ARCHIVO_DB, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.executescript(_ESQUEMA)
+        _local.conn = conn
+    return conn
+
+
+def _fecha_iso(fecha):
+    """Convierte DD/MM/YYYY (formato de la factura) a YYYY-MM-DD para poder ordenar"""
+    for formato in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(fecha, formato).strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def archivar_factura(datos, pdf_bytes=None, pdf_ruta=None):
+    """
+    Guarda una factura en el archivo; si ya existe ese número, la reemplaza
+
+    Args:
+        datos: Diccionario con los argumentos que recibió generar_factura
+        pdf_bytes: Contenido del PDF (se guarda si ARCHIVO_GUARDAR_PDF=1)
+        pdf_ruta: Ruta del PDF en disco, si se guardó como archivo
+
+    Returns:
+        El id de la factura en el archivo
+    """
+    factura_no = datos.get('factura_no')
+    if not factura_no:
+        raise ValueError("No se puede archivar una factura sin número")
+
+    conn = _conexion()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM facturas WHERE factura_no = ?', (factura_no,))
+        cursor = conn.execute(
+            'INSERT INTO facturas (factura_no, cliente, documento, direccion, nit, telefono, correo, '
+            'fecha, fecha_iso, subtotal, iva, total, pdf_ruta, creado) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (factura_no, datos.get('cliente'), datos.get('documento'), datos.get('direccion'),
+             datos.get('nit'), datos.get('telefono'), datos.get('correo'),
+             datos.get('fecha'), _fecha_iso(datos.get('fecha')),
+             datos.get('subtotal'), datos.get('iva'), datos.get('total'), pdf_ruta, time.time())
+        )
+        factura_id = cursor.lastrowid
+        conn.executemany(
+            'INSERT INTO facturas_items (factura_id, posicion, descripcion, cantidad, valor_unitario, tiene_iva) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(factura_id, i, item.get('descripcion'), item.get('cantidad'), item.get('valor_unitario'),
+              int(bool(item.get('tiene_iva')))) for i, item in enumerate(datos.get('items', []))]
+        )
+        if pdf_bytes is not None and GUARDAR_PDF:
+            conn.execute('INSERT INTO facturas_pdf (factura_id, pdf) VALUES (?, ?)', (factura_id, pdf_bytes))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return factura_id
+
+
+def _fila_a_dict(fila):
+    return dict(zip(_CAMPOS, fila))
+
+
+def obtener_factura(factura_no):
+    """Retorna los datos y los items de una factura, o None si no está archivada"""
+    conn = _conexion()
+    fila = conn.execute(
+        f'SELECT {", ".join(_CAMPOS)} FROM facturas WHERE factura_no = ?', (factura_no,)
+    ).fetchone()
+    if fila is None:
+        return None
+    factura = _fila_a_dict(fila)
+    factura['items'] = [
+        {'descripcion': descripcion, 'cantidad': cantidad, 'valor_unitario': valor_unitario,
+         'tiene_iva': bool(tiene_iva)}
+        for descripcion, cantidad, valor_unitario, tiene_iva in conn.execute(
+            'SELECT descripcion, cantidad, valor_unitario, tiene_iva FROM facturas_items '
+            'WHERE factura_id = ? ORDER BY posicion', (factura['id'],)
+        )
+    ]
+    factura['tiene_pdf'] = conn.execute(
+        'SELECT 1 FROM facturas_pdf WHERE factura_id = ?', (factura['id'],)
+    ).fetchone() is not None
+    return factura
+
+
+def obtener_pdf(factura_no):
+    """Retorna los bytes del PDF archivado, o None si no hay"""
+    fila = _conexion().execute(
+        'SELECT p.pdf, f.pdf_ruta FROM facturas f LEFT JOIN facturas_pdf p ON p.factura_id = f.id '
+        'WHERE f.factura_no = ?', (factura_no,)
+    ).fetchone()
+    if fila is None:
+        return None
+    pdf, pdf_ruta = fila
+    if pdf is None and pdf_ruta and os.path.exists(pdf_ruta):
+        with open(pdf_ruta, 'rb') as f:
+            pdf = f.read()
+    return pdf
+
+
+def buscar_facturas(cliente=None, documento=None, desde=None, hasta=None, pagina=1, por_pagina=50):
+    """
+    Busca facturas por cliente (prefijo, sin distinguir mayúsculas), documento
+    y rango de fechas (YYYY-MM-DD), de la más reciente a la más antigua
+
+    Returns:
+        Diccionario con 'facturas', 'pagina', 'por_pagina' y 'total'
+    """
+    condiciones, parametros = [], []
+    if cliente:
+        # Escapar comodines para que el prefijo se busque literalmente
+        prefijo = cliente.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condiciones.append("cliente LIKE ? ESCAPE '\\'")
+        parametros.append(prefijo + '%')
+    if documento:
+        condiciones.append('documento = ?')
+        parametros.append(documento)
+    if desde:
+        condiciones.append('fecha_iso >= ?')
+        parametros.append(desde)
+    if hasta:
+        condiciones.append('fecha_iso <= ?')
+        parametros.append(hasta)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+    pagina = max(1, int(pagina))
+    por_pagina = min(max(1, int(por_pagina)), POR_PAGINA_MAX)
+    conn = _conexion()
+    total = conn.execute(f'SELECT COUNT(*) FROM facturas {where}', parametros).fetchone()[0]
+    filas = conn.execute(
+        f'SELECT {", ".join(_CAMPOS)} FROM facturas {where} '
+        f'ORDER BY fecha_iso DESC, id DESC LIMIT ? OFFSET ?',
+        parametros + [por_pagina, (pagina - 1) * por_pagina]
+    ).fetchall()
+    return {
+        'facturas': [_fila_a_dict(fila) for fila in filas],
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+        'total': total
+    }
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Arranque rápido del servidor
+
+La app no importa ReportLab ni requests al cargarse: '/' y '/calcular_total'
+responden sin ellos. Se cargan la primera vez que se necesitan o, según
+PRECALENTAR, en un hilo en segundo plano apenas arranca el proceso:
+
+    segundo_plano  hilo que importa el generador y genera una factura de prueba (por defecto)
+    inicio         lo mismo, pero antes de aceptar peticiones (arranque lento, primera factura rápida)
+    no             nada; se carga con la primera factura
+
+GET /arranque reporta cuánto tardó cada importación, el precalentamiento y
+la primera respuesta. Para ver el detalle por módulo de un arranque en frío:
+    python arranque.py
+"""
+
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PRECALENTAR = os.environ.get('PRECALENTAR', 'segundo_plano')
+MODOS = ('segundo_plano', 'inicio', 'no')
+
+# Módulos pesados que se cargan por adelantado al precalentar
+MODULOS_DIFERIDOS = ('generar_factura', 'requests', 'libro_ventas')
+
+_inicio = time.perf_counter()
+_lock = threading.Lock()
+_importaciones = {}
+_estado = {'precalentamiento': None, 'primera_respuesta': None, 'hilo': None}
+
+
+def importar(nombre):
+    """
+    Importa un módulo y registra cuánto tardó si es la primera vez
+
+    Returns:
+        El módulo importado
+    """
+    modulo = sys.modules.get(nombre)
+    # Mientras otro hilo lo importa, el módulo ya está en sys.modules pero a
+    # medio ejecutar: en ese caso import_module espera a que termine
+    if modulo is not None and not getattr(getattr(modulo, '__spec__', None), '_initializing', False):
+        return modulo
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nombre)
+    with _lock:
+        _importaciones.setdefault(nombre, time.perf_counter() - inicio)
+    return modulo
+
+
+def registrar_importacion(nombre, segundos):
+    """Registra una importación medida fuera de importar() (por ejemplo la de app_factura)"""
+    with _lock:
+        _importaciones.setdefault(nombre, segundos)
+
+
+def registrar_respuesta():
+    """Anota el momento de la primera respuesta del proceso"""
+    if _estado['primera_respuesta'] is None:
+        _estado['primera_respuesta'] = time.perf_counter() - _inicio
+
+
+def _precalentar():
+    inicio = time.perf_counter()
+    for nombre in MODULOS_DIFERIDOS:
+        importar(nombre)
+    importar('generar_factura').precalentar()
+    _estado['precalentamiento'] = time.perf_counter() - inicio
+
+
+def precalentar(modo=None):
+    """
+    Precalienta el generador según PRECALENTAR
+
+    Returns:
+        Segundos que tomó si se precalentó antes de retornar, o None
+    """
+    modo = modo or PRECALENTAR
+    if modo not in MODOS:
+        raise ValueError(f"PRECALENTAR desconocido: {modo} (opciones: {', '.join(MODOS)})")
+    if modo == 'inicio':
+        _precalentar()
+        return _estado['precalentamiento']
+    if modo == 'segundo_plano' and _estado['hilo'] is None:
+        with _lock:
+            if _estado['hilo'] is None:
+                _estado['hilo'] = threading.Thread(target=_precalentar, name='precalentar', daemon=True)
+                _estado['hilo'].start()
+    return None
+
+
+def _reiniciar_en_hijo():
+    """El hilo de precalentamiento no sobrevive al fork: cada worker lanza el suyo"""
+    _estado['hilo'] = None
+    _estado['primera_respuesta'] = None
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def reporte():
+    """Tiempos de arranque de este proceso (en segundos)"""
+    with _lock:
+        importaciones = dict(sorted(_importaciones.items(), key=lambda item: item[1], reverse=True))
+    return {
+        'pid': os.getpid(),
+        'modo': PRECALENTAR,
+        'segundos_desde_inicio': time.perf_counter() - _inicio,
+        'importaciones': importaciones,
+        'diferidos_cargados': [nombre for nombre in MODULOS_DIFERIDOS if nombre in sys.modules],
+        'precalentamiento': _estado['precalentamiento'],
+        'primera_respuesta': _estado['primera_respuesta']
+    }
+
+
+def perfil_importaciones(modulo='app_factura', limite=20):
+    """
+    Importa el módulo en un intérprete nuevo con -X importtime
+
+    Returns:
+        Lista de (módulo, segundos acumulados) de las importaciones más lentas
+    """
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    tiempos = []
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        # "import time:  propio |  acumulado | módulo" (microsegundos)
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        tiempos.append((nombre.strip(), int(acumulado) / 1e6))
+    tiempos.sort(key=lambda item: item[1], reverse=True)
+    return tiempos[:limite]
+
+
+if __name__ == '__main__':
+    for modulo in ('app_factura', 'generar_factura'):
+        print(f"Importaciones más lentas de {modulo} (arranque en frío):")
+        for nombre, segundos in perfil_importaciones(modulo, 10):
+            print(f"  {segundos * 1000:8.1f} ms  {nombre}")
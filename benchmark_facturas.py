@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+Benchmarks del generador de facturas y de los endpoints de la app
+
+Uso:
+    python benchmark_facturas.py                    # medir y comparar con la base
+    python benchmark_facturas.py --guardar-base     # medir y guardar como nueva base
+    python benchmark_facturas.py --umbral-tiempo 0.3 --umbral-memoria 0.5
+
+Antes de medir verifica que los dos motores de generar_factura (platypus y
+canvas) produzcan el mismo PDF visual y que las facturas de varias páginas se
+paginen bien (encabezado en cada página, cada item una vez, totales al final).
+Mide generar_factura con 1, 10, 100, 1000 y 10000 items, los dos motores y los
+tres perfiles de salida con una factura típica, el cálculo de totales de
+100.000 líneas (por item y vectorizado), /generar y /calcular_total con el
+cliente de pruebas de Flask, y el envío a n8n contra un servidor HTTP local.
+Los escenarios de /generar usan un número de factura distinto en cada
+repetición para medir el render y no la caché de PDFs;
+endpoint_generar_10_items_cache mide aparte un acierto. Por cada escenario
+registra el tiempo (mediana de las repeticiones), el pico de memoria de
+tracemalloc, el RSS máximo del proceso y el tamaño del PDF. Si el tiempo o la
+memoria superan la base en más del umbral indicado, el comando termina con
+código 1.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ARCHIVO_BASE = 'benchmark_base.json'
+TAMANOS_ITEMS = [1, 10, 100, 1000, 10000]
+
+
+def _items(cantidad):
+    """Items de prueba con IVA alternado"""
+    return [
+        {
+            'descripcion': f'Panel Solar 450W lote {i}',
+            'cantidad': (i % 5) + 1,
+            'valor_unitario': 850000.0,
+            'tiene_iva': i % 2 == 0
+        }
+        for i in range(cantidad)
+    ]
+
+
+def _formulario(cantidad, **extra):
+    """Datos de formulario como los que envía formulario_factura.html"""
+    items = _items(cantidad)
+    datos = {
+        'nit': '901.234.567-8',
+        'telefono': '+57 300 123 4567',
+        'correo': 'ventas@anclajesolar.com',
+        'cliente': 'Juan Pérez García',
+        'documento': 'CC 1234567890',
+        'direccion': 'Calle 123 #45-67, Bogotá',
+        'fecha': '2025-01-15',
+        'factura_no': 'BENCH-001',
+        'descripcion[]': [item['descripcion'] for item in items],
+        'cantidad[]': [str(item['cantidad']) for item in items],
+        'valor_unitario[]': [str(item['valor_unitario']) for item in items],
+        'tiene_iva[]': [str(i) for i, item in enumerate(items) if item['tiene_iva']],
+    }
+    datos.update(extra)
+    return datos
+
+
+def _rss_maximo_kb():
+    """RSS máximo del proceso hasta ahora, en KB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def medir(funcion, repeticiones):
+    """
+    Ejecuta la función varias veces y retorna sus métricas
+
+    La primera ejecución se mide con tracemalloc activo (sólo para la memoria)
+    y las siguientes sin él, para que no afecte a los tiempos.
+    """
+    tracemalloc.start()
+    resultado = funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    metricas = {
+        'tiempo_s': statistics.median(tiempos),
+        'tiempo_min_s': min(tiempos),
+        'memoria_pico_kb': pico // 1024,
+        'rss_maximo_kb': _rss_maximo_kb(),
+    }
+    if isinstance(resultado, (bytes, bytearray)):
+        metricas['pdf_bytes'] = len(resultado)
+    return metricas
+
+
+def _repeticiones_para(cantidad, repeticiones):
+    """Menos repeticiones para las facturas más grandes"""
+    if cantidad >= 10000:
+        return 1
+    if cantidad >= 1000:
+        return max(1, repeticiones // 5)
+    return repeticiones
+
+
+def bench_render(repeticiones, max_items):
+    """generar_factura en memoria con distinta cantidad de items"""
+    from generar_factura import generar_factura, buscar_logo
+    from totales import calcular_totales
+    logo_path = buscar_logo()
+    resultados = {}
+    for cantidad in TAMANOS_ITEMS:
+        if cantidad > max_items:
+            continue
+        items = _items(cantidad)
+        totales = calcular_totales(items)
+
+        def render():
+            return generar_factura(
+                logo_path=logo_path, cliente='Juan Pérez García', factura_no='BENCH-001',
+                items=items, en_memoria=True, **totales
+            )
+
+        resultados[f'render_{cantidad}_items'] = medir(render, _repeticiones_para(cantidad, repeticiones))
+    return resultados
+
+
+def _casos_equivalencia():
+    """Facturas que el motor canvas debe dibujar igual que platypus"""
+    largos = {
+        'cliente': 'María Fernanda de los Ángeles Rodríguez Castañeda',
+        'direccion': 'Carrera 7 # 123-45 Torre 3 Apartamento 1502 Conjunto Residencial Los Pinos, Bogotá D.C.',
+        'factura_no': 'FAC-2025-000123456789',
+    }
+    return {
+        'tipica': {},
+        'sin_logo': {'logo_path': None},
+        'sin_datos': {'items': [], 'nit': '', 'telefono': '', 'correo': '', 'cliente': '',
+                      'documento': '', 'direccion': '', 'fecha': '', 'factura_no': ''},
+        'textos_largos': largos,
+        'descripcion_multilinea': {'items': [{'descripcion': 'Panel\nSolar', 'cantidad': 2,
+                                              'valor_unitario': 5.0, 'tiene_iva': True}]},
+        'segunda_pagina': {'items': _items(10)},
+        'segunda_pagina_textos_largos': dict(largos, items=_items(16)),
+        'paginas_numeradas': {'items': _items(10), 'numerar_paginas': True},
+    }
+
+
+def verificar_motores():
+    """
+    Compara el PDF de los dos motores en los casos de equivalencia
+
+    Returns:
+        0 si todos coinciden visualmente, 1 si alguno difiere
+    """
+    from factura_canvas import diferencias_visuales, dibujar_factura
+    from generar_factura import generar_factura, buscar_logo
+    from totales import calcular_totales
+    fallidos = 0
+    for nombre, extra in _casos_equivalencia().items():
+        datos = {
+            'logo_path': buscar_logo(), 'nit': '901.234.567-8', 'telefono': '+57 300 123 4567',
+            'correo': 'ventas@anclajesolar.com', 'cliente': 'Juan Pérez García',
+            'documento': 'CC 1234567890', 'direccion': 'Calle 123 #45-67, Bogotá',
+            'fecha': '2025-01-15', 'factura_no': 'BENCH-001', 'items': _items(2),
+        }
+        datos.update(extra)
+        datos.update(calcular_totales(datos['items']))
+        platypus = generar_factura(en_memoria=True, motor='platypus', **datos)
+        canvas = dibujar_factura(**datos)
+        if canvas is None:
+            diferencias = ["el motor canvas no dibujó la factura (usaría platypus)"]
+        else:
+            diferencias = diferencias_visuales(platypus, canvas)
+        if diferencias:
+            fallidos += 1
+            print(f"  ✗ {nombre}")
+            for diferencia in diferencias[:10]:
+                print(f"      {diferencia}")
+        else:
+            print(f"  ✓ {nombre}")
+    return 1 if fallidos else 0
+
+
+def _items_multilinea(cantidad, lineas):
+    """Items cuya descripción ocupa varias líneas; la primera identifica al item"""
+    return [
+        {
+            'descripcion': '\n'.join([f'item{i:03d}'] + [f'Detalle {j}' for j in range(1, lineas)]),
+            'cantidad': 1,
+            'valor_unitario': 1000.0,
+            'tiene_iva': False
+        }
+        for i in range(cantidad)
+    ]
+
+
+def _casos_paginacion():
+    """Facturas de varias páginas: (items, líneas por descripción)"""
+    return {
+        '25_items': (25, 1),
+        '100_items': (100, 1),
+        # Las últimas filas con los totales no caben ni en una página nueva
+        '4_items_15_lineas': (4, 15),
+        '5_items_14_lineas': (5, 14),
+        '6_items_16_lineas': (6, 16),
+    }
+
+
+def verificar_paginacion():
+    """
+    Genera facturas de varias páginas con los dos motores y revisa cada página
+
+    Cada item debe aparecer una sola vez, toda página con items debe llevar
+    el encabezado de la tabla y los totales deben quedar en la última página.
+
+    Returns:
+        0 si todas las facturas cumplen, 1 si alguna falla
+    """
+    from factura_canvas import operaciones_pdf
+    from generar_factura import generar_factura
+    from totales import calcular_totales
+    fallidos = 0
+    for nombre, (cantidad, lineas) in _casos_paginacion().items():
+        items = _items_multilinea(cantidad, lineas)
+        for motor in ('platypus', 'canvas'):
+            problemas = []
+            try:
+                paginas = operaciones_pdf(generar_factura(
+                    en_memoria=True, motor=motor, factura_no='BENCH-001', items=items, **calcular_totales(items)
+                ))
+            except Exception as e:
+                problemas.append(f"no se generó: {type(e).__name__}: {e}")
+                paginas = []
+            vistos = []
+            for numero, pagina in enumerate(paginas, 1):
+                textos = [op[1] for op in pagina if op[0] == 'texto']
+                marcas = [texto for texto in textos if texto.startswith(b'item')]
+                vistos.extend(marcas)
+                if marcas and b'Cantidad' not in textos:
+                    problemas.append(f"la página {numero} tiene items sin encabezado")
+                if b'PAGAR:' in textos and numero != len(paginas):
+                    problemas.append(f"los totales quedaron en la página {numero} de {len(paginas)}")
+            if paginas and sorted(vistos) != [f'item{i:03d}'.encode() for i in range(cantidad)]:
+                problemas.append(f"se dibujaron {len(vistos)} items de {cantidad}")
+            if paginas and not any(op[0] == 'texto' and op[1] == b'PAGAR:' for op in paginas[-1]):
+                problemas.append("faltan los totales")
+            if problemas:
+                fallidos += 1
+                print(f"  ✗ {nombre} ({motor})")
+                for problema in problemas[:10]:
+                    print(f"      {problema}")
+            else:
+                print(f"  ✓ {nombre} ({motor}, {len(paginas)} páginas)")
+    return 1 if fallidos else 0
+
+
+def bench_motores(repeticiones):
+    """generar_factura con una factura típica en cada motor"""
+    from generar_factura import generar_factura, buscar_logo
+    from totales import calcular_totales
+    logo_path = buscar_logo()
+    items = _items(10)
+    totales = calcular_totales(items)
+    resultados = {}
+    for motor in ('platypus', 'canvas'):
+        def render():
+            return generar_factura(
+                logo_path=logo_path, cliente='Juan Pérez García', factura_no='BENCH-001',
+                items=items, en_memoria=True, motor=motor, **totales
+            )
+
+        resultados[f'motor_{motor}_10_items'] = medir(render, repeticiones)
+    return resultados
+
+
+def bench_perfiles(repeticiones):
+    """generar_factura con una factura típica en cada perfil de salida (ver perfiles_pdf)"""
+    from generar_factura import generar_factura, buscar_logo
+    from perfiles_pdf import PERFILES
+    from totales import calcular_totales
+    logo_path = buscar_logo()
+    items = _items(10)
+    totales = calcular_totales(items)
+    resultados = {}
+    for perfil in PERFILES:
+        def render():
+            return generar_factura(
+                logo_path=logo_path, cliente='Juan Pérez García', factura_no='BENCH-001',
+                items=items, en_memoria=True, perfil=perfil, **totales
+            )
+
+        resultados[f'perfil_{perfil}_10_items'] = medir(render, repeticiones)
+    return resultados
+
+
+def bench_totales(repeticiones, lineas=100000, items_por_factura=10):
+    """Totales de muchas facturas: bucle por item contra la versión vectorizada"""
+    from totales import arreglos_desde_facturas, calcular_totales, calcular_totales_lote
+    facturas = [{'items': _items(items_por_factura)} for _ in range(lineas // items_por_factura)]
+    arreglos = arreglos_desde_facturas(facturas)
+
+    def bucle():
+        return [calcular_totales(factura['items']) for factura in facturas]
+
+    def lote():
+        return calcular_totales_lote(*arreglos, num_facturas=len(facturas))
+
+    # Las dos versiones deben dar exactamente lo mismo
+    subtotal, iva, total = lote()
+    esperado = bucle()
+    assert all(
+        (subtotal[i] / 100, iva[i] / 100, total[i] / 100) == (t['subtotal'], t['iva'], t['total'])
+        for i, t in enumerate(esperado)
+    )
+
+    return {
+        f'totales_bucle_{lineas}_lineas': medir(bucle, max(1, repeticiones // 5)),
+        f'totales_lote_{lineas}_lineas': medir(lote, repeticiones),
+    }
+
+
+def _numerados(datos, prefijo):
+    """
+    Retorna una función que da los datos con un número de factura nuevo cada vez
+
+    La caché de PDFs usa como clave el contenido de la factura: repetir el
+    mismo número mediría aciertos de caché en lugar del render.
+    """
+    numeros = itertools.count(1)
+    return lambda: dict(datos, factura_no=f'{prefijo}-{os.getpid()}-{next(numeros):06d}')
+
+
+def bench_endpoints(repeticiones):
+    """/generar (descarga, sin y con acierto de caché) y /calcular_total con el cliente de pruebas de Flask"""
+    from app_factura import app
+    cliente = app.test_client()
+    datos = _formulario(10, descargar_pdf='1')
+    siguiente = _numerados(datos, 'BENCH')
+    items_json = {'items': _items(100)}
+
+    def generar(datos_factura=None):
+        respuesta = cliente.post('/generar', data=datos_factura or siguiente())
+        assert respuesta.status_code == 200, respuesta.data
+        return respuesta.data
+
+    def generar_repetida():
+        # La misma factura siempre: desde la segunda vez sale de la caché
+        return generar(datos)
+
+    def calcular_total():
+        respuesta = cliente.post('/calcular_total', json=items_json)
+        assert respuesta.status_code == 200, respuesta.data
+
+    return {
+        'endpoint_generar_10_items': medir(generar, repeticiones),
+        'endpoint_generar_10_items_cache': medir(generar_repetida, repeticiones),
+        'endpoint_calcular_total_100_items': medir(calcular_total, repeticiones * 10),
+    }
+
+
+class _ServidorStub(BaseHTTPRequestHandler):
+    """Servidor que hace de webhook de n8n y avisa cada vez que recibe un envío"""
+    protocol_version = 'HTTP/1.1'
+    recibido = threading.Event()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        _ServidorStub.recibido.set()
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_webhook(repeticiones):
+    """Tiempo desde /generar hasta que el webhook local recibe la factura"""
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), _ServidorStub)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    os.environ['N8N_WEBHOOK_URL'] = f'http://127.0.0.1:{servidor.server_port}/webhook/factura-generada'
+
+    from app_factura import app
+    cliente = app.test_client()
+    siguiente = _numerados(_formulario(10, email_cliente='cliente@example.com'), 'BENCH-N8N')
+
+    def generar_y_entregar():
+        _ServidorStub.recibido.clear()
+        respuesta = cliente.post('/generar', data=siguiente())
+        assert respuesta.status_code == 200, respuesta.data
+        if not _ServidorStub.recibido.wait(timeout=30):
+            raise RuntimeError("El webhook local no recibió la factura")
+
+    try:
+        return {'webhook_generar_y_entregar': medir(generar_y_entregar, repeticiones)}
+    finally:
+        servidor.shutdown()
+        del os.environ['N8N_WEBHOOK_URL']
+
+
+def comparar(resultados, base, umbral_tiempo, umbral_memoria):
+    """
+    Compara los resultados con la base
+
+    Returns:
+        Lista de mensajes, uno por cada métrica que empeoró más del umbral
+    """
+    regresiones = []
+    for escenario, metricas in resultados.items():
+        anterior = base.get(escenario)
+        if not anterior:
+            continue
+        for metrica, umbral in (('tiempo_s', umbral_tiempo), ('memoria_pico_kb', umbral_memoria)):
+            if metrica not in anterior or not anterior[metrica]:
+                continue
+            cambio = metricas[metrica] / anterior[metrica] - 1
+            if cambio > umbral:
+                regresiones.append(
+                    f"{escenario}: {metrica} {anterior[metrica]:.4g} -> {metricas[metrica]:.4g} "
+                    f"(+{cambio:.0%}, umbral {umbral:.0%})"
+                )
+    return regresiones
+
+
+def imprimir(resultados, base):
+    """Tabla con los resultados y la variación respecto a la base"""
+    print(f"{'Escenario':40} {'Tiempo (ms)':>12} {'vs base':>8} {'Memoria (KB)':>13} {'RSS (KB)':>10} {'PDF (bytes)':>12}")
+    for escenario, metricas in resultados.items():
+        anterior = base.get(escenario, {})
+        variacion = ''
+        if anterior.get('tiempo_s'):
+            variacion = f"{metricas['tiempo_s'] / anterior['tiempo_s'] - 1:+.0%}"
+        print(f"{escenario:40} {metricas['tiempo_s'] * 1000:12.2f} {variacion:>8} "
+              f"{metricas['memoria_pico_kb']:13d} {metricas['rss_maximo_kb']:10d} "
+              f"{metricas.get('pdf_bytes', ''):>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del generador de facturas")
+    parser.add_argument('--base', default=ARCHIVO_BASE, help="Archivo JSON con la base de comparación")
+    parser.add_argument('--guardar-base', action='store_true', help="Guardar los resultados como nueva base")
+    parser.add_argument('--umbral-tiempo', type=float, default=0.25,
+                        help="Aumento de tiempo permitido respecto a la base (0.25 = 25%%)")
+    parser.add_argument('--umbral-memoria', type=float, default=0.25,
+                        help="Aumento de memoria permitido respecto a la base (0.25 = 25%%)")
+    parser.add_argument('--repeticiones', type=int, default=10, help="Repeticiones por escenario")
+    parser.add_argument('--max-items', type=int, default=max(TAMANOS_ITEMS),
+                        help="Tamaño máximo de factura a medir")
+    parser.add_argument('--salida', help="Guardar también los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    # Las facturas del benchmark no deben mezclarse con las reales: las bases,
+    # el libro de ventas, la caché y los PDFs van a un directorio temporal
+    # (se leen al importar cada módulo, así que se fijan antes de medir)
+    directorio = tempfile.mkdtemp(prefix='benchmark_facturas_')
+    for variable, nombre in (
+        ('N8N_SPOOL_DB', 'envios_n8n.db'),
+        ('ARCHIVO_DB', 'facturas.db'),
+        ('TRABAJOS_DB', 'trabajos_render.db'),
+        ('NUMERACION_DB', 'numeracion.db'),
+        ('PDF_CACHE_DIR', 'cache_pdf'),
+        ('PDF_SALIDA_DIR', 'salida'),
+        ('METRICAS_DIR', 'metricas'),
+        ('LIBRO_VENTAS_DIR', 'libro_ventas'),
+        ('PERFILADOR_DIR', 'perfiles'),
+    ):
+        os.environ.setdefault(variable, os.path.join(directorio, nombre))
+
+    print("Equivalencia de los motores platypus y canvas:")
+    if verificar_motores():
+        print("\nEl motor canvas no produce el mismo PDF que platypus")
+        return 1
+    print()
+
+    print("Paginación de facturas largas:")
+    if verificar_paginacion():
+        print("\nAlguna factura larga no se paginó bien")
+        return 1
+    print()
+
+    resultados = {}
+    resultados.update(bench_render(args.repeticiones, args.max_items))
+    resultados.update(bench_motores(args.repeticiones))
+    resultados.update(bench_perfiles(args.repeticiones))
+    resultados.update(bench_totales(args.repeticiones))
+    resultados.update(bench_endpoints(args.repeticiones))
+    resultados.update(bench_webhook(args.repeticiones))
+
+    base = {}
+    if os.path.exists(args.base):
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+
+    imprimir(resultados, base)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+
+    if args.guardar_base:
+        with open(args.base, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+        print(f"\nBase guardada en {args.base}")
+        return 0
+
+    if not base:
+        print(f"\nNo hay base en {args.base}; usa --guardar-base para crearla")
+        return 0
+
+    regresiones = comparar(resultados, base, args.umbral_tiempo, args.umbral_memoria)
+    if regresiones:
+        print("\nRegresiones detectadas:")
+        for mensaje in regresiones:
+            print(f"  ✗ {mensaje}")
+        return 1
+    print("\n✓ Sin regresiones respecto a la base")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Caché de PDFs generados, direccionada por contenido
+
+La clave de cada PDF es un hash SHA-256 de los datos normalizados de la
+factura (más el logo usado), así que una factura idéntica se sirve sin
+volver a pasar por ReportLab. Hay dos niveles: un LRU en memoria acotado
+por bytes y, al salir de memoria, un directorio en disco también acotado
+por tamaño que descarta primero los archivos usados hace más tiempo.
+
+La misma clave se usa como ETag en las descargas de /generar.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Configuración por variables de entorno
+MEMORIA_MAX_BYTES = int(float(os.environ.get('PDF_CACHE_MEMORIA_MB', '64')) * 1024 * 1024)
+DIRECTORIO = os.environ.get('PDF_CACHE_DIR', 'cache_pdf')
+DISCO_MAX_BYTES = int(float(os.environ.get('PDF_CACHE_DISCO_MB', '512')) * 1024 * 1024)
+
+# Cambiar si cambia el diseño del PDF, para no servir PDFs con el diseño anterior
+VERSION_DISENO = '1'
+
+_lock = threading.Lock()
+_memoria = OrderedDict()
+_estado = {'bytes_memoria': 0, 'bytes_disco': None}
+_contadores = {
+    'hits_memoria': 0,
+    'hits_disco': 0,
+    'misses': 0,
+    'guardados': 0,
+    'descartados_memoria': 0,
+    'descartados_disco': 0,
+}
+
+
+def clave_factura(datos, logo_path=None):
+    """
+    Calcula la clave de caché de una factura
+
+    Args:
+        datos: Diccionario con los argumentos que recibe generar_factura
+        logo_path: Ruta del logo; su fecha de modificación forma parte de la clave
+
+    Returns:
+        Hash SHA-256 en hexadecimal
+    """
+    logo = None
+    if logo_path:
+        try:
+            info = os.stat(logo_path)
+            logo = [logo_path, info.st_mtime_ns, info.st_size]
+        except OSError:
+            pass
+    contenido = json.dumps(
+        {'version': VERSION_DISENO, 'logo': logo, 'datos': datos},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def _ruta_disco(clave):
+    return os.path.join(DIRECTORIO, f'{clave}.pdf')
+
+
+def obtener(clave):
+    """Retorna los bytes del PDF en caché, o None si no está"""
+    with _lock:
+        pdf = _memoria.get(clave)
+        if pdf is not None:
+            _memoria.move_to_end(clave)
+            _contadores['hits_memoria'] += 1
+            return pdf
+
+    if DISCO_MAX_BYTES > 0:
+        ruta = _ruta_disco(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                pdf = f.read()
+            os.utime(ruta)  # Marca de uso reciente para el descarte
+        except OSError:
+            pdf = None
+        if pdf is not None:
+            with _lock:
+                _contadores['hits_disco'] += 1
+            _guardar_memoria(clave, pdf)
+            return pdf
+
+    with _lock:
+        _contadores['misses'] += 1
+    return None
+
+
+def guardar(clave, pdf):
+    """Guarda un PDF recién generado en el nivel de memoria"""
+    with _lock:
+        _contadores['guardados'] += 1
+    _guardar_memoria(clave, pdf)
+
+
+def _guardar_memoria(clave, pdf):
+    """Inserta en el LRU de memoria y pasa a disco lo que no cabe"""
+    if len(pdf) > MEMORIA_MAX_BYTES:
+        _guardar_disco(clave, pdf)
+        return
+    desalojados = []
+    with _lock:
+        anterior = _memoria.pop(clave, None)
+        if anterior is not None:
+            _estado['bytes_memoria'] -= len(anterior)
+        _memoria[clave] = pdf
+        _estado['bytes_memoria'] += len(pdf)
+        while _estado['bytes_memoria'] > MEMORIA_MAX_BYTES:
+            clave_vieja, pdf_viejo = _memoria.popitem(last=False)
+            _estado['bytes_memoria'] -= len(pdf_viejo)
+            _contadores['descartados_memoria'] += 1
+            desalojados.append((clave_vieja, pdf_viejo))
+    for clave_vieja, pdf_viejo in desalojados:
+        _guardar_disco(clave_vieja, pdf_viejo)
+
+
+def _guardar_disco(clave, pdf):
+    """Escribe el PDF en disco (atómicamente) y respeta el tamaño máximo"""
+    if DISCO_MAX_BYTES <= 0 or len(pdf) > DISCO_MAX_BYTES:
+        return
+    ruta = _ruta_disco(clave)
+    if os.path.exists(ruta):
+        return
+    try:
+        os.makedirs(DIRECTORIO, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"Error al guardar PDF en caché de disco: {e}")
+        return
+
+    with _lock:
+        if _estado['bytes_disco'] is None:
+            _estado['bytes_disco'] = _medir_disco()
+        else:
+            _estado['bytes_disco'] += len(pdf)
+        excedido = _estado['bytes_disco'] > DISCO_MAX_BYTES
+    if excedido:
+        _recortar_disco()
+
+
+def _medir_disco():
+    """Suma el tamaño de los PDFs en el directorio de caché"""
+    try:
+        return sum(e.stat().st_size for e in os.scandir(DIRECTORIO) if e.name.endswith('.pdf'))
+    except OSError:
+        return 0
+
+
+def _recortar_disco():
+    """Borra los PDFs usados hace más tiempo hasta quedar en el 90% del máximo"""
+    try:
+        archivos = [(info.st_mtime, info.st_size, e.path)
+                    for e in os.scandir(DIRECTORIO) if e.name.endswith('.pdf')
+                    for info in (e.stat(),)]
+    except OSError:
+        return
+    archivos.sort()
+    total = sum(tamano for _, tamano, _ in archivos)
+    objetivo = DISCO_MAX_BYTES * 0.9
+    borrados = 0
+    for _, tamano, ruta in archivos:
+        if total <= objetivo:
+            break
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tamano
+        borrados += 1
+    with _lock:
+        _estado['bytes_disco'] = total
+        _contadores['descartados_disco'] += borrados
+
+
+def estadisticas():
+    """Contadores de aciertos y fallos, y uso de memoria y disco"""
+    with _lock:
+        datos = dict(_contadores)
+        datos['entradas_memoria'] = len(_memoria)
+        datos['bytes_memoria'] = _estado['bytes_memoria']
+        datos['bytes_disco'] = _estado['bytes_disco']
+    consultas = datos['hits_memoria'] + datos['hits_disco'] + datos['misses']
+    datos['tasa_aciertos'] = (datos['hits_memoria'] + datos['hits_disco']) / consultas if consultas else 0.0
+    if datos['bytes_disco'] is None:
+        datos['bytes_disco'] = _medir_disco() if DISCO_MAX_BYTES > 0 else 0
+    return datos
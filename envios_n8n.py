@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Cola de envíos al webhook de n8n en segundo plano
+
+Los envíos se guardan en una cola local en SQLite y un grupo de hilos
+los entrega reutilizando conexiones (requests.Session). Si un envío falla
+se reintenta con espera exponencial; al agotar los intentos pasa a la
+tabla de envíos fallidos, desde donde se puede consultar y reenviar.
+
+N8N_TRANSPORTE elige cómo viaja el PDF:
+    json       JSON con el PDF en 'pdf_base64' (por defecto, compatible con la guía)
+    multipart  multipart/form-data con el PDF como parte binaria 'pdf' y los
+               demás datos como campos; el PDF se envía por bloques sin copiarlo
+    gzip       el mismo JSON que 'json', comprimido con Content-Encoding: gzip
+
+Para comparar el tamaño de cada modo con un PDF real:
+    python envios_n8n.py factura.pdf
+"""
+
+import base64
+import contextlib
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from metricas import medir
+
+# Configuración por variables de entorno
+SPOOL_DB = os.environ.get('N8N_SPOOL_DB', 'envios_n8n.db')
+NUM_WORKERS = int(os.environ.get('N8N_WORKERS', '2'))
+MAX_INTENTOS = int(os.environ.get('N8N_MAX_INTENTOS', '5'))
+BACKOFF_BASE = float(os.environ.get('N8N_BACKOFF_BASE', '2'))
+BACKOFF_MAX = float(os.environ.get('N8N_BACKOFF_MAX', '300'))
+TIMEOUT = float(os.environ.get('N8N_TIMEOUT', '10'))
+TRANSPORTE = os.environ.get('N8N_TRANSPORTE', 'json')
+TRANSPORTES = ('json', 'multipart', 'gzip')
+
+# Segundos que espera un worker tras un error de la base antes de reintentar
+ESPERA_ERROR = 1.0
+
+# Tamaño de los bloques en que se envía el PDF en modo multipart
+BLOQUE_BYTES = 64 * 1024
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS envios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    pdf BLOB,
+    pdf_filename TEXT,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento REAL NOT NULL,
+    creado REAL NOT NULL,
+    ultimo_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_envios_proximo ON envios (proximo_intento);
+CREATE TABLE IF NOT EXISTS envios_fallidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    datos TEXT NOT NULL,
+    pdf BLOB,
+    pdf_filename TEXT,
+    intentos INTEGER NOT NULL,
+    creado REAL NOT NULL,
+    fallido REAL NOT NULL,
+    ultimo_error TEXT
+);
+"""
+
+_lock_inicio = threading.Lock()
+_hilos = []
+_hay_trabajo = threading.Event()
+_local = threading.local()
+
+
+def _reiniciar_en_hijo():
+    """Los hilos y las conexiones del proceso padre no pasan al hijo"""
+    global _lock_inicio, _hay_trabajo, _local
+    _lock_inicio = threading.Lock()
+    _hay_trabajo = threading.Event()
+    _local = threading.local()
+    _hilos.clear()
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _conectar():
+    """Abre una conexión a la cola (una por hilo)"""
+    conn = sqlite3.connect(SPOOL_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _conexion():
+    """Retorna la conexión del hilo actual, creándola si no existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _conectar()
+        conn.executescript(_ESQUEMA)
+        _local.conn = conn
+    return conn
+
+
+def _descartar_conexion():
+    """Cierra la conexión del hilo actual (por ejemplo, si quedó a mitad de una transacción)"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _sesion():
+    """Retorna la sesión HTTP del hilo actual (conexiones keep-alive)"""
+    sesion = getattr(_local, 'sesion', None)
+    if sesion is None:
+        # requests se importa con el primer envío, no al arrancar la app
+        import requests
+        sesion = requests.Session()
+        _local.sesion = sesion
+    return sesion
+
+
+@contextlib.contextmanager
+def _transaccion(conn):
+    """Ejecuta un bloque dentro de una transacción con bloqueo de escritura"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def encolar_envio(url, datos, pdf_bytes=None, pdf_filename=None):
+    """
+    Guarda un envío en la cola y despierta a los workers
+
+    Args:
+        url: URL del webhook de n8n
+        datos: Diccionario con los datos de la factura (serializable a JSON)
+        pdf_bytes: Contenido del PDF; se envía como 'pdf_base64'
+        pdf_filename: Nombre del archivo PDF
+
+    Returns:
+        El id del envío en la cola
+    """
+    ahora = time.time()
+    cursor = _conexion().execute(
+        'INSERT INTO envios (url, datos, pdf, pdf_filename, proximo_intento, creado) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (url, json.dumps(datos), pdf_bytes, pdf_filename, ahora, ahora)
+    )
+    iniciar_workers()
+    _hay_trabajo.set()
+    return cursor.lastrowid
+
+
+def _tomar_envio(conn):
+    """
+    Reserva el siguiente envío listo para enviarse
+
+    La reserva vence después de TIMEOUT + 30 segundos, de modo que un envío
+    que quedó a medias porque el proceso se detuvo vuelve a tomarse.
+    """
+    ahora = time.time()
+    with _transaccion(conn):
+        fila = conn.execute(
+            "SELECT id, url, datos, pdf, pdf_filename, intentos FROM envios "
+            "WHERE proximo_intento <= ? ORDER BY proximo_intento LIMIT 1",
+            (ahora,)
+        ).fetchone()
+        if fila:
+            conn.execute(
+                "UPDATE envios SET estado = 'enviando', proximo_intento = ? WHERE id = ?",
+                (ahora + TIMEOUT + 30, fila[0])
+            )
+    return fila
+
+
+class CuerpoMultipart:
+    """
+    Cuerpo multipart/form-data que se envía por partes
+
+    requests lo recorre con __iter__ y usa __len__ como Content-Length, así
+    que el PDF sale en bloques directamente desde sus bytes, sin armar una
+    copia completa del cuerpo en memoria.
+    """
+
+    def __init__(self, campos, pdf_bytes=None, pdf_filename=None):
+        self.boundary = uuid.uuid4().hex
+        separador = f'--{self.boundary}\r\n'
+        texto = []
+        for nombre, valor in campos.items():
+            if not isinstance(valor, str):
+                valor = json.dumps(valor)
+            texto.append(
+                f'{separador}Content-Disposition: form-data; name="{nombre}"\r\n\r\n{valor}\r\n'
+            )
+        self._inicio = ''.join(texto).encode('utf-8')
+        self._pdf = memoryview(pdf_bytes) if pdf_bytes is not None else None
+        if self._pdf is not None:
+            self._inicio += (
+                f'{separador}Content-Disposition: form-data; name="pdf"; filename="{pdf_filename}"\r\n'
+                f'Content-Type: application/pdf\r\n\r\n'
+            ).encode('utf-8')
+            self._fin = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        else:
+            self._fin = f'--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self._inicio) + (len(self._pdf) if self._pdf is not None else 0) + len(self._fin)
+
+    def __iter__(self):
+        yield self._inicio
+        if self._pdf is not None:
+            for i in range(0, len(self._pdf), BLOQUE_BYTES):
+                yield self._pdf[i:i + BLOQUE_BYTES]
+        yield self._fin
+
+
+def _payload_json(payload, pdf_bytes, pdf_filename):
+    """Payload JSON con el PDF en base64"""
+    if pdf_bytes is not None:
+        with medir('base64'):
+            pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
+        payload = dict(payload, pdf_filename=pdf_filename, pdf_base64=pdf_base64)
+    return payload
+
+
+def preparar_envio(payload, pdf_bytes=None, pdf_filename=None, transporte=None):
+    """
+    Arma los argumentos de requests.post según el modo de transporte
+
+    Returns:
+        Diccionario con 'json' o 'data' y 'headers'
+    """
+    transporte = transporte or TRANSPORTE
+    if transporte == 'multipart':
+        cuerpo = CuerpoMultipart(dict(payload, pdf_filename=pdf_filename), pdf_bytes, pdf_filename)
+        return {'data': cuerpo, 'headers': {'Content-Type': cuerpo.content_type}}
+    if transporte == 'gzip':
+        contenido = json.dumps(_payload_json(payload, pdf_bytes, pdf_filename)).encode('utf-8')
+        return {
+            'data': gzip.compress(contenido, compresslevel=6),
+            'headers': {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        }
+    if transporte != 'json':
+        raise ValueError(f"N8N_TRANSPORTE desconocido: {transporte} (opciones: {', '.join(TRANSPORTES)})")
+    return {'json': _payload_json(payload, pdf_bytes, pdf_filename)}
+
+
+def _enviar(url, datos, pdf_bytes, pdf_filename):
+    """Realiza el POST al webhook"""
+    argumentos = preparar_envio(json.loads(datos), pdf_bytes, pdf_filename)
+    with medir('n8n'):
+        respuesta = _sesion().post(url, timeout=TIMEOUT, **argumentos)
+    respuesta.raise_for_status()
+
+
+def comparar_transportes(payload, pdf_bytes, pdf_filename='factura.pdf'):
+    """Bytes que ocupa el cuerpo de la petición en cada modo de transporte"""
+    tamanos = {}
+    for transporte in TRANSPORTES:
+        argumentos = preparar_envio(payload, pdf_bytes, pdf_filename, transporte)
+        if 'json' in argumentos:
+            tamanos[transporte] = len(json.dumps(argumentos['json']).encode('utf-8'))
+        else:
+            tamanos[transporte] = len(argumentos['data'])
+    return tamanos
+
+
+def _registrar_fallo(conn, envio_id, intentos, error):
+    """Programa un reintento o mueve el envío a la tabla de fallidos"""
+    ahora = time.time()
+    if intentos >= MAX_INTENTOS:
+        with _transaccion(conn):
+            conn.execute(
+                'INSERT INTO envios_fallidos (url, datos, pdf, pdf_filename, intentos, creado, fallido, ultimo_error) '
+                'SELECT url, datos, pdf, pdf_filename, ?, creado, ?, ? FROM envios WHERE id = ?',
+                (intentos, ahora, error, envio_id)
+            )
+            conn.execute('DELETE FROM envios WHERE id = ?', (envio_id,))
+        print(f"Envío {envio_id} a n8n descartado tras {intentos} intentos: {error}")
+    else:
+        espera = min(BACKOFF_BASE * (2 ** (intentos - 1)), BACKOFF_MAX)
+        conn.execute(
+            "UPDATE envios SET estado = 'pendiente', intentos = ?, proximo_intento = ?, ultimo_error = ? "
+            "WHERE id = ?",
+            (intentos, ahora + espera, error, envio_id)
+        )
+
+
+def _atender(conn):
+    """Entrega el siguiente envío listo, o espera a que haya uno"""
+    fila = _tomar_envio(conn)
+    if fila is None:
+        # Dormir hasta el próximo reintento programado o hasta que llegue un envío nuevo
+        proximo = conn.execute('SELECT MIN(proximo_intento) FROM envios').fetchone()[0]
+        espera = 1 if proximo is None else min(max(proximo - time.time(), 0.01), 1)
+        _hay_trabajo.wait(timeout=espera)
+        _hay_trabajo.clear()
+        return
+
+    envio_id, url, datos, pdf_bytes, pdf_filename, intentos = fila
+    try:
+        _enviar(url, datos, pdf_bytes, pdf_filename)
+    except Exception as e:
+        _registrar_fallo(conn, envio_id, intentos + 1, str(e))
+    else:
+        conn.execute('DELETE FROM envios WHERE id = ?', (envio_id,))
+
+
+def _worker():
+    """
+    Bucle de un worker: toma envíos de la cola y los entrega
+
+    Un error de la base (por ejemplo "database is locked" con muchos workers)
+    no detiene el hilo: se descarta la conexión y se reintenta tras
+    ESPERA_ERROR segundos. Si el envío ya se había entregado, su reserva vence
+    y se vuelve a enviar (n8n puede recibirlo dos veces, pero no se pierde).
+    """
+    while True:
+        try:
+            _atender(_conexion())
+        except Exception as e:
+            print(f"Error en el worker de envíos a n8n: {e}")
+            _descartar_conexion()
+            time.sleep(ESPERA_ERROR)
+
+
+def iniciar_workers():
+    """Arranca los workers de envío y reemplaza los que hayan terminado"""
+    if len(_hilos) == NUM_WORKERS and all(hilo.is_alive() for hilo in _hilos):
+        return
+    with _lock_inicio:
+        for i in range(NUM_WORKERS):
+            if i < len(_hilos) and _hilos[i].is_alive():
+                continue
+            hilo = threading.Thread(target=_worker, name=f'envios-n8n-{i}', daemon=True)
+            hilo.start()
+            if i < len(_hilos):
+                _hilos[i] = hilo
+            else:
+                _hilos.append(hilo)
+
+
+def reanudar_pendientes():
+    """
+    Arranca los workers si en la cola quedaron envíos de una ejecución anterior
+
+    Se llama al arrancar cada proceso del servidor, para que un reinicio o un
+    despliegue no deje envíos esperando hasta que llegue una factura nueva.
+
+    Returns:
+        Cantidad de envíos pendientes
+    """
+    pendientes = contar_pendientes()
+    if pendientes:
+        iniciar_workers()
+    return pendientes
+
+
+def contar_pendientes():
+    """Número de envíos que aún están en la cola"""
+    return _conexion().execute('SELECT COUNT(*) FROM envios').fetchone()[0]
+
+
+def listar_fallidos(limite=100):
+    """Lista los envíos fallidos más recientes (sin el contenido del PDF)"""
+    filas = _conexion().execute(
+        'SELECT id, url, datos, pdf_filename, intentos, creado, fallido, ultimo_error '
+        'FROM envios_fallidos ORDER BY id DESC LIMIT ?',
+        (limite,)
+    ).fetchall()
+    fallidos = []
+    for envio_id, url, datos, pdf_filename, intentos, creado, fallido, ultimo_error in filas:
+        datos = json.loads(datos)
+        fallidos.append({
+            'id': envio_id,
+            'url': url,
+            'factura_no': datos.get('factura_no'),
+            'cliente': datos.get('cliente'),
+            'pdf_filename': pdf_filename,
+            'intentos': intentos,
+            'creado': creado,
+            'fallido': fallido,
+            'ultimo_error': ultimo_error
+        })
+    return fallidos
+
+
+def reintentar_fallido(envio_id):
+    """
+    Devuelve un envío fallido a la cola
+
+    Returns:
+        True si el envío existía y se volvió a encolar
+    """
+    conn = _conexion()
+    with _transaccion(conn):
+        cursor = conn.execute(
+            'INSERT INTO envios (url, datos, pdf, pdf_filename, proximo_intento, creado) '
+            'SELECT url, datos, pdf, pdf_filename, ?, creado FROM envios_fallidos WHERE id = ?',
+            (time.time(), envio_id)
+        )
+        conn.execute('DELETE FROM envios_fallidos WHERE id = ?', (envio_id,))
+    if cursor.rowcount:
+        iniciar_workers()
+        _hay_trabajo.set()
+    return cursor.rowcount > 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Uso: python envios_n8n.py factura.pdf")
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        pdf = f.read()
+    ejemplo = {
+        'factura_no': '001-2025', 'cliente': 'Juan Pérez García', 'email_cliente': 'cliente@example.com',
+        'telefono_cliente': '+57 300 123 4567', 'fecha': '15/01/2025',
+        'total': 1190000.0, 'subtotal': 1000000.0, 'iva': 190000.0,
+        'items': [{'descripcion': 'Panel Solar 450W', 'cantidad': 1, 'valor_unitario': 1000000.0, 'tiene_iva': True}]
+    }
+    print(f"PDF: {len(pdf):,} bytes")
+    for transporte, tamano in comparar_transportes(ejemplo, pdf, os.path.basename(sys.argv[1])).items():
+        print(f"  {transporte:10} {tamano:>12,} bytes  ({tamano / len(pdf):.0%} del PDF)")
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+Motor rápido de facturas: dibuja el diseño estándar directamente en el canvas
+
+generar_factura(motor='canvas') usa este módulo. En lugar de armar la
+historia de platypus (tablas anidadas, Paragraph con marcado, KeepTogether)
+dibuja la misma factura con coordenadas precalculadas: las
+posiciones salen de los márgenes, anchos de columna, paddings y leading de
+los estilos de generar_factura, así que el resultado es el mismo PDF visual.
+Sólo se mide el texto que puede partirse en varias líneas (los datos del
+cliente), con el mismo algoritmo de corte que Paragraph. El encabezado y los
+datos de la empresa son el mismo membrete precompilado que usa platypus
+(ver membrete.py).
+
+Como el KeepTogether de platypus, si los items y los totales no caben
+debajo del cliente pasan juntos a la segunda página. Si la factura no se
+puede dibujar igual que con platypus (los items no caben en una página, o
+los datos traen marcado como '<' o '&' que Paragraph interpretaría),
+dibujar_factura retorna None y generar_factura usa platypus.
+
+diferencias_visuales() compara dos PDFs por su lista de operaciones de
+dibujo (textos, rellenos, líneas e imágenes con su posición absoluta); la
+usan las pruebas de equivalencia de benchmark_facturas.py:
+    python factura_canvas.py
+"""
+
+import io
+import re
+import zlib
+from base64 import a85decode
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import getFont, stringWidth
+from reportlab.platypus import Paragraph
+from reportlab.platypus.paraparser import ParaFrag
+
+from generar_factura import COLOR_AZUL, COLOR_DORADO, COLOR_GRIS, COLOR_NEGRO, ESTILO_EMPRESA, FooterCanvas
+from membrete import colocar, obtener_membrete
+
+# Geometría de SimpleDocTemplate en generar_factura: márgenes de 40 (80 abajo)
+# y el padding de 6 del frame
+ANCHO_PAGINA, ALTO_PAGINA = letter
+X_FRAME = 40 + 6
+ANCHO_FRAME = ANCHO_PAGINA - 80 - 12
+Y_INICIAL = ALTO_PAGINA - 40 - 6
+Y_LIMITE = 80 + 6
+
+# Las tablas miden page_width (más que el frame) y quedan centradas en x=40
+X_TABLA = 40
+ANCHO_TABLA = ANCHO_PAGINA - 80
+
+# Todas las tablas de texto usan leading 12
+LEADING = 12
+
+# Margen con que platypus decide si un bloque cabe en el espacio que queda
+_TOLERANCIA = 1e-6
+
+# Textos del bloque del cliente
+FUENTE = ESTILO_EMPRESA.fontName
+FUENTE_NEGRITA = 'Helvetica-Bold'
+TAMANO = ESTILO_EMPRESA.fontSize
+
+# Bloque del cliente: anchos de las columnas de las tablas interiores
+ANCHO_BLOQUE = ANCHO_TABLA * 0.30
+COLUMNAS_IZQ = (ANCHO_BLOQUE * 0.35, ANCHO_BLOQUE * 0.65)
+COLUMNAS_DER = (ANCHO_BLOQUE * 0.40, ANCHO_BLOQUE * 0.60)
+X_CLIENTE_IZQ = X_TABLA + 10
+X_CLIENTE_DER = X_TABLA + ANCHO_TABLA * 0.53 + 10
+
+# Tabla de items y totales
+ENCABEZADO_ITEMS = ("Descripción", "Cantidad", "Valor Unitario", "Total")
+ANCHOS_ITEMS = tuple(ANCHO_TABLA * p for p in (0.45, 0.15, 0.20, 0.20))
+COLUMNAS_ITEMS = tuple(X_TABLA + sum(ANCHOS_ITEMS[:i]) for i in range(len(ANCHOS_ITEMS) + 1))
+ALTO_FILA_ENCABEZADO = LEADING + 20
+ANCHO_TOTALES = 3 * inch
+X_TOTALES = X_FRAME + ANCHO_FRAME - ANCHO_TOTALES
+ALTO_TOTALES = 2 * (LEADING + 16)
+ALTO_TOTAL_FINAL = LEADING + 20
+
+# Caracteres que Paragraph trataría como marcado
+_MARCADO = re.compile(r'[<&]')
+
+
+def _partir(texto, fuente, tamano, ancho):
+    """
+    Líneas en que Paragraph partiría el texto dentro del ancho indicado
+
+    Si el texto cabe entero se evita crear el Paragraph; si no, se usa su
+    breakLines (sin pasar por el parser de marcado) para cortar igual.
+    """
+    texto = ' '.join(texto.split())
+    if not texto:
+        return []
+    if stringWidth(texto, fuente, tamano) <= ancho:
+        return [texto]
+    frag = ParaFrag()
+    frag.text = texto
+    frag.fontName = fuente
+    frag.fontSize = tamano
+    frag.rise = 0
+    frag.textColor = COLOR_NEGRO
+    parrafo = Paragraph('', ESTILO_EMPRESA, frags=[frag])
+    return [' '.join(palabras) for _, palabras in parrafo.breakLines([ancho]).lines]
+
+
+# Las etiquetas del bloque del cliente no cambian: se parten una sola vez
+ETIQUETAS_IZQ = [_partir(t, FUENTE_NEGRITA, TAMANO, COLUMNAS_IZQ[0] - 12) for t in ("Cliente:", "Documento:", "Dirección:")]
+ETIQUETAS_DER = [_partir(t, FUENTE_NEGRITA, TAMANO, COLUMNAS_DER[0] - 12) for t in ("Fecha:", "Factura No:", "")]
+
+
+def _lineas_caja(canv, x, y, ancho, alto, color, grosor):
+    """Borde BOX de una tabla, en el mismo orden y estilo en que lo dibuja Table"""
+    canv.saveState()
+    canv.setLineCap(1)
+    canv.setLineJoin(1)
+    canv.setStrokeColor(color)
+    canv.setLineWidth(grosor)
+    canv.line(x, y + alto, x + ancho, y + alto)
+    canv.line(x, y, x + ancho, y)
+    canv.line(x, y, x, y + alto)
+    canv.line(x + ancho, y, x + ancho, y + alto)
+    canv.restoreState()
+
+
+def _relleno(canv, x, y, ancho, alto, color):
+    canv.setFillColor(color)
+    canv.rect(x, y, ancho, alto, stroke=0, fill=1)
+
+
+def _texto(canv, x, y, lineas, fuente, tamano, color):
+    """Dibuja las líneas de un párrafo: la primera línea a 'y' y las demás cada LEADING"""
+    canv.setFillColor(color)
+    canv.setFont(fuente, tamano)
+    for linea in lineas:
+        canv.drawString(x, y, linea)
+        y -= LEADING
+
+
+def _celdas_cliente(canv, x, y_tope, anchos, filas):
+    """
+    Dibuja una tabla interior del bloque del cliente
+
+    Args:
+        filas: Lista de (líneas de la etiqueta, líneas del valor, fuente del valor, color del valor)
+
+    Returns:
+        Alto de la tabla
+    """
+    y = y_tope
+    for etiqueta, valor, fuente_valor, color_valor in filas:
+        alto = max(len(etiqueta), len(valor)) * LEADING + 6
+        y -= alto
+        # Las celdas se alinean abajo: la última línea queda a 3 puntos del borde
+        if etiqueta:
+            _texto(canv, x + 6, y + 3 + len(etiqueta) * LEADING - TAMANO, etiqueta, FUENTE_NEGRITA, TAMANO, COLOR_NEGRO)
+        if valor:
+            _texto(canv, x + anchos[0] + 6, y + 3 + len(valor) * LEADING - TAMANO, valor, fuente_valor, TAMANO, color_valor)
+    return y_tope - y
+
+
+def _alto_celdas(filas):
+    return sum(max(len(etiqueta), len(valor)) * LEADING + 6 for etiqueta, valor, _, _ in filas)
+
+
+def _fila_items(item):
+    descripcion = item.get('descripcion', '')
+    if item.get('tiene_iva', False):
+        descripcion = f"{descripcion} (+IVA)"
+    return [
+        str(descripcion),
+        str(item.get('cantidad', '')),
+        f"${item.get('valor_unitario', 0):,.2f}",
+        f"${item.get('cantidad', 0) * item.get('valor_unitario', 0):,.2f}"
+    ]
+
+
+def _texto_celda(canv, x, ancho, y_fila, alineacion, texto, tamano, padding, padding_inferior):
+    """Texto de una celda de Table alineado abajo (VALIGN por defecto)"""
+    lineas = texto.split('\n')
+    y = y_fila + padding_inferior + len(lineas) * LEADING - tamano
+    for linea in lineas:
+        if alineacion == 'LEFT':
+            canv.drawString(x + padding, y, linea)
+        elif alineacion == 'RIGHT':
+            canv.drawRightString(x + ancho - padding, y, linea)
+        else:
+            canv.drawCentredString(x + ancho / 2, y, linea)
+        y -= LEADING
+
+
+def _dibujar_items_y_totales(canv, y_items, filas_items, altos_items, subtotal, iva, total):
+    """Tabla de items con los totales debajo, a partir de 'y_items'"""
+    alto_items = ALTO_FILA_ENCABEZADO + sum(altos_items)
+    y_encabezado = y_items - ALTO_FILA_ENCABEZADO
+    y = y_items - alto_items
+    _relleno(canv, X_TABLA, y_encabezado, ANCHO_TABLA, ALTO_FILA_ENCABEZADO, COLOR_AZUL)
+    if filas_items:
+        _relleno(canv, X_TABLA, y, ANCHO_TABLA, alto_items - ALTO_FILA_ENCABEZADO, colors.white)
+        y_fila = y_encabezado
+        for i, alto in enumerate(altos_items):
+            y_fila -= alto
+            _relleno(canv, X_TABLA, y_fila, ANCHO_TABLA, alto, colors.HexColor('#F9F9F9') if i % 2 else colors.white)
+    canv.setFillColor(colors.white)
+    canv.setFont(FUENTE_NEGRITA, 11)
+    for x, ancho, texto in zip(COLUMNAS_ITEMS, ANCHOS_ITEMS, ENCABEZADO_ITEMS):
+        _texto_celda(canv, x, ancho, y_encabezado, 'CENTER', texto, 11, 8, 10)
+    canv.setFillColor(colors.black)
+    canv.setFont(FUENTE, 10)
+    y_fila = y_encabezado
+    for fila, alto in zip(filas_items, altos_items):
+        y_fila -= alto
+        for columna, (x, ancho, texto) in enumerate(zip(COLUMNAS_ITEMS, ANCHOS_ITEMS, fila)):
+            _texto_celda(canv, x, ancho, y_fila, 'LEFT' if columna == 0 else 'CENTER', texto, 10, 8, 10)
+    _lineas_caja(canv, X_TABLA, y, ANCHO_TABLA, alto_items, COLOR_AZUL, 1.5)
+    canv.saveState()
+    canv.setLineCap(1)
+    canv.setLineJoin(1)
+    canv.setStrokeColor(COLOR_DORADO)
+    canv.setLineWidth(2)
+    canv.line(X_TABLA, y_encabezado, X_TABLA + ANCHO_TABLA, y_encabezado)
+    canv.setStrokeColor(colors.grey)
+    canv.setLineWidth(0.5)
+    y_fila = y_encabezado
+    for alto in [0] + altos_items[:-1] if filas_items else ():
+        y_fila -= alto
+        canv.line(X_TABLA, y_fila, X_TABLA + ANCHO_TABLA, y_fila)
+    for x in COLUMNAS_ITEMS[1:-1]:
+        canv.line(x, y, x, y_items)
+    canv.restoreState()
+
+    # Totales: dos filas con padding de 8
+    y -= 0.2 * inch
+    columnas = (X_TOTALES, X_TOTALES + ANCHO_TOTALES / 2)
+    _relleno(canv, X_TOTALES, y - ALTO_TOTALES, ANCHO_TOTALES, ALTO_TOTALES, colors.HexColor('#FAFAFA'))
+    canv.setFillColor(COLOR_NEGRO)
+    canv.setFont(FUENTE, 10)
+    for i, fila in enumerate((("Subtotal:", f"${subtotal:,.2f}"), ("IVA (19%):", f"${iva:,.2f}"))):
+        for x, texto in zip(columnas, fila):
+            _texto_celda(canv, x, ANCHO_TOTALES / 2, y - (i + 1) * (LEADING + 16), 'RIGHT', texto, 10, 10, 8)
+    y -= ALTO_TOTALES
+    _lineas_caja(canv, X_TOTALES, y, ANCHO_TOTALES, ALTO_TOTALES, COLOR_GRIS, 1)
+
+    # Total a pagar destacado: una fila con padding de 10
+    y -= 0.1 * inch + ALTO_TOTAL_FINAL
+    _relleno(canv, X_TOTALES, y, ANCHO_TOTALES, ALTO_TOTAL_FINAL, COLOR_AZUL)
+    canv.setFillColor(colors.white)
+    canv.setFont(FUENTE_NEGRITA, 12)
+    for x, texto in zip(columnas, ("TOTAL A PAGAR:", f"${total:,.2f}")):
+        _texto_celda(canv, x, ANCHO_TOTALES / 2, y, 'RIGHT', texto, 12, 10, 10)
+    _lineas_caja(canv, X_TOTALES, y, ANCHO_TOTALES, ALTO_TOTAL_FINAL, COLOR_DORADO, 2)
+
+
+def dibujar_factura(
+    logo_path=None, nit="", telefono="", correo="", cliente="", documento="",
+    direccion="", fecha="", factura_no="", items=(), subtotal=0, iva=0, total=0, perfil=None,
+    numerar_paginas=None
+):
+    """
+    Dibuja la factura estándar directamente en un canvas
+
+    Recibe los mismos datos que generar_factura; el perfil de PDF sólo decide
+    aquí la resolución del logo (la compresión la aplica generar_factura). Como el KeepTogether de
+    platypus, si los items y los totales no caben debajo del cliente se
+    pasan juntos al comienzo de la segunda página.
+
+    Returns:
+        Los bytes del PDF, o None si la factura no se puede dibujar igual que
+        con platypus (los items no caben en una página o hay marcado)
+    """
+    campos = (cliente, documento, direccion, fecha, factura_no)
+    if any(_MARCADO.search(str(campo)) for campo in campos):
+        return None
+    # Cada fila mide al menos una línea: si ni así caben en una página no
+    # vale la pena medirlas (generar_factura usa la tabla paginada)
+    if len(items) * (LEADING + 20) > Y_INICIAL - Y_LIMITE:
+        return None
+    membrete = obtener_membrete(logo_path, nit, telefono, correo, perfil)
+    if membrete is None:
+        return None
+
+    # Medir todo lo variable antes de dibujar, para saber dónde cae cada bloque
+    ancho_valor_izq = COLUMNAS_IZQ[1] - 12
+    ancho_valor_der = COLUMNAS_DER[1] - 12
+    filas_izq = [
+        (ETIQUETAS_IZQ[0], _partir(str(cliente), FUENTE, TAMANO, ancho_valor_izq), FUENTE, COLOR_NEGRO),
+        (ETIQUETAS_IZQ[1], _partir(str(documento), FUENTE, TAMANO, ancho_valor_izq), FUENTE, COLOR_NEGRO),
+        (ETIQUETAS_IZQ[2], _partir(str(direccion), FUENTE, TAMANO, ancho_valor_izq), FUENTE, COLOR_NEGRO),
+    ]
+    filas_der = [
+        (ETIQUETAS_DER[0], _partir(str(fecha), FUENTE, TAMANO, ancho_valor_der), FUENTE, COLOR_NEGRO),
+        (ETIQUETAS_DER[1], _partir(str(factura_no), FUENTE_NEGRITA, TAMANO, ancho_valor_der), FUENTE_NEGRITA, COLOR_DORADO),
+        (ETIQUETAS_DER[2], [], FUENTE, COLOR_NEGRO),
+    ]
+    alto_cliente = max(_alto_celdas(filas_izq), _alto_celdas(filas_der)) + 20
+
+    filas_items = [_fila_items(item) for item in items]
+    altos_items = [max(celda.count('\n') for celda in fila) * LEADING + LEADING + 20 for fila in filas_items]
+    alto_bloque = (ALTO_FILA_ENCABEZADO + sum(altos_items) + 0.2 * inch + ALTO_TOTALES
+                   + 0.1 * inch + ALTO_TOTAL_FINAL)
+
+    y_cliente = Y_INICIAL - membrete.alto - 0.25 * inch
+    y_items = y_cliente - alto_cliente - 0.25 * inch
+    if y_items < Y_LIMITE:
+        return None
+    nueva_pagina = alto_bloque > y_items - Y_LIMITE + _TOLERANCIA
+    if nueva_pagina:
+        if alto_bloque > Y_INICIAL - Y_LIMITE + _TOLERANCIA:
+            return None
+        y_items = Y_INICIAL
+
+    buffer = io.BytesIO()
+    canv = FooterCanvas(buffer, pagesize=letter, numerar_paginas=numerar_paginas)
+    colocar(canv, membrete)
+
+    # Información del cliente en dos columnas
+    y = y_cliente - alto_cliente
+    _relleno(canv, X_TABLA, y, ANCHO_TABLA, alto_cliente, colors.HexColor('#FAFAFA'))
+    _celdas_cliente(canv, X_CLIENTE_IZQ, y_cliente - 10, COLUMNAS_IZQ, filas_izq)
+    _celdas_cliente(canv, X_CLIENTE_DER, y_cliente - 10, COLUMNAS_DER, filas_der)
+    _lineas_caja(canv, X_TABLA, y, ANCHO_TABLA, alto_cliente, COLOR_DORADO, 1.5)
+
+    if nueva_pagina:
+        canv.showPage()
+    _dibujar_items_y_totales(canv, y_items, filas_items, altos_items, subtotal, iva, total)
+
+    canv.showPage()
+    canv.save()
+    return buffer.getvalue()
+
+
+# --- Comparación visual de PDFs --------------------------------------------
+
+_OBJETO = re.compile(rb'(\d+) 0 obj\b')
+_FIN_DICCIONARIO = re.compile(rb'\bstream\r?\n|\bendobj\b')
+_TOKEN = re.compile(rb'\((?:\\.|[^\\)])*\)|<<|>>|\[|\]|/[^\s/\[\]()<>]+|[-+]?(?:\d+\.?\d*|\.\d+)|[A-Za-z\'"*]+')
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def _objetos(pdf_bytes):
+    """Objetos del PDF: número -> (diccionario en bytes, contenido del stream o None)"""
+    objetos = {}
+    posicion = 0
+    while True:
+        m = _OBJETO.search(pdf_bytes, posicion)
+        if not m:
+            return objetos
+        fin = _FIN_DICCIONARIO.search(pdf_bytes, m.end())
+        diccionario, contenido = pdf_bytes[m.end():fin.start()], None
+        posicion = fin.end()
+        if fin.group(0).startswith(b'stream'):
+            largo = int(re.search(rb'/Length (\d+)', diccionario).group(1))
+            contenido = pdf_bytes[fin.end():fin.end() + largo]
+            posicion = fin.end() + largo
+            if b'/ASCII85Decode' in diccionario:
+                contenido = a85decode(contenido.strip(), adobe=True)
+            if b'/FlateDecode' in diccionario:
+                contenido = zlib.decompress(contenido)
+        objetos[int(m.group(1))] = (diccionario, contenido)
+
+
+def _cadena(token):
+    """Decodifica una cadena literal de PDF a bytes"""
+    cuerpo, resultado, i = token[1:-1], bytearray(), 0
+    while i < len(cuerpo):
+        c = cuerpo[i:i + 1]
+        if c == b'\\':
+            siguiente = cuerpo[i + 1:i + 2]
+            octal = re.match(rb'[0-7]{1,3}', cuerpo[i + 1:i + 4])
+            if octal:
+                resultado.append(int(octal.group(0), 8) & 0xff)
+                i += 1 + len(octal.group(0))
+                continue
+            resultado += _ESCAPES.get(siguiente, siguiente)
+            i += 2
+            continue
+        resultado += c
+        i += 1
+    return bytes(resultado)
+
+
+def _multiplicar(a, b):
+    return [
+        a[0] * b[0] + a[1] * b[2], a[0] * b[1] + a[1] * b[3],
+        a[2] * b[0] + a[3] * b[2], a[2] * b[1] + a[3] * b[3],
+        a[4] * b[0] + a[5] * b[2] + b[4], a[4] * b[1] + a[5] * b[3] + b[5]
+    ]
+
+
+def _punto(m, x, y):
+    return x * m[0] + y * m[2] + m[4], x * m[1] + y * m[3] + m[5]
+
+
+def _referencias(diccionario, clave, objetos):
+    """Nombres -> número de objeto de un subdiccionario de recursos (/Font, /XObject)"""
+    m = re.search(rb'/' + clave + rb'\s*(?:<<(.*?)>>|(\d+) 0 R)', diccionario, re.S)
+    if not m:
+        return {}
+    contenido = m.group(1) if m.group(1) is not None else objetos[int(m.group(2))][0]
+    return {nombre.decode(): int(num) for nombre, num in re.findall(rb'(/[^\s/<>]+)\s+(\d+) 0 R', contenido)}
+
+
+def _fuentes(diccionario, objetos):
+    """Nombres de fuente de un diccionario de recursos -> nombre de la fuente base"""
+    return {
+        nombre: re.search(rb'/BaseFont /([^\s/>]+)', objetos[num][0]).group(1).decode()
+        for nombre, num in _referencias(diccionario, rb'Font', objetos).items()
+    }
+
+
+def operaciones_pdf(pdf_bytes):
+    """
+    Lista de lo que se ve en cada página del PDF, con coordenadas absolutas
+
+    Cada texto se separa en palabras con su posición (así da igual cómo se
+    agruparon en el PDF); los rectángulos rellenos, las líneas y las imágenes
+    llevan su color, grosor y transformación. Los formularios (form XObjects)
+    se expanden en el lugar donde se dibujan.
+    """
+    objetos = _objetos(pdf_bytes)
+    paginas = []
+    for num in sorted(objetos):
+        diccionario, _ = objetos[num]
+        if not re.search(rb'/Type /Page\b(?!s)', diccionario):
+            continue
+        xobjects = _referencias(diccionario, rb'XObject', objetos)
+        contenidos = re.search(rb'/Contents (\d+) 0 R', diccionario)
+        resultado = []
+        _interpretar(objetos[int(contenidos.group(1))][1], [1, 0, 0, 1, 0, 0], objetos,
+                     _fuentes(diccionario, objetos), xobjects, resultado)
+        paginas.append(resultado)
+    return paginas
+
+
+def _interpretar(contenido, ctm, objetos, fuentes, xobjects, resultado):
+    pila, argumentos, arreglo = [], [], None
+    fuente, tamano, leading = None, 0, 0
+    relleno, trazo, grosor, cap = (0, 0, 0), (0, 0, 0), 1, 0
+    tm = lm = [1, 0, 0, 1, 0, 0]
+    trayecto, rectangulos = [], []
+    for token in _TOKEN.findall(contenido):
+        if token == b'[':
+            arreglo = []
+            continue
+        if token == b']':
+            argumentos.append(arreglo)
+            arreglo = None
+            continue
+        if arreglo is not None:
+            arreglo.append(token)
+            continue
+        if token[:1] in b'(/-+.0123456789':
+            argumentos.append(token)
+            continue
+        op, a, argumentos = token.decode(), argumentos, []
+        if op == 'q':
+            pila.append((ctm, relleno, trazo, grosor, cap))
+        elif op == 'Q':
+            ctm, relleno, trazo, grosor, cap = pila.pop()
+        elif op == 'cm':
+            ctm = _multiplicar([float(v) for v in a], ctm)
+        elif op == 'rg':
+            relleno = tuple(round(float(v), 3) for v in a)
+        elif op == 'RG':
+            trazo = tuple(round(float(v), 3) for v in a)
+        elif op == 'w':
+            grosor = float(a[0])
+        elif op == 'J':
+            cap = int(a[0])
+        elif op == 'Tf':
+            fuente, tamano = fuentes.get(a[0].decode(), a[0].decode()), float(a[1])
+        elif op == 'TL':
+            leading = float(a[0])
+        elif op == 'BT':
+            tm = lm = [1, 0, 0, 1, 0, 0]
+        elif op == 'Tm':
+            tm = lm = [float(v) for v in a]
+        elif op == 'Td':
+            tm = lm = _multiplicar([1, 0, 0, 1, float(a[0]), float(a[1])], lm)
+        elif op == 'T*':
+            tm = lm = _multiplicar([1, 0, 0, 1, 0, -leading], lm)
+        elif op in ('Tj', 'TJ', "'"):
+            if op == "'":
+                tm = lm = _multiplicar([1, 0, 0, 1, 0, -leading], lm)
+            partes = [a[0]] if op != 'TJ' else [p for p in a[0] if p.startswith(b'(')]
+            anchos = getFont(fuente).widths
+            for parte in partes:
+                texto = _cadena(parte)
+                x = 0.0
+                for palabra in texto.split(b' '):
+                    if palabra:
+                        px, py = _punto(_multiplicar(tm, ctm), x, 0)
+                        resultado.append(('texto', palabra, fuente, round(tamano * ctm[0], 2), relleno, px, py))
+                    x += sum(anchos[c] for c in palabra + b' ') * tamano / 1000
+                x -= anchos[32] * tamano / 1000
+                tm = _multiplicar([1, 0, 0, 1, x, 0], tm)
+        elif op == 're':
+            x, y, w, h = [float(v) for v in a]
+            (x1, y1), (x2, y2) = _punto(ctm, x, y), _punto(ctm, x + w, y + h)
+            rectangulos.append((min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1)))
+        elif op in ('m', 'l'):
+            trayecto.append(_punto(ctm, float(a[0]), float(a[1])))
+        elif op in ('f', 'f*', 'B', 'B*', 'b', 'b*'):
+            for rect in rectangulos:
+                # Un rectángulo sin ancho o sin alto no pinta nada
+                if rect[2] > 1e-9 and rect[3] > 1e-9:
+                    resultado.append(('relleno', relleno) + rect)
+            trayecto, rectangulos = [], []
+        elif op == 'S':
+            for inicio, fin in zip(trayecto, trayecto[1:]):
+                (x1, y1), (x2, y2) = sorted((inicio, fin))
+                resultado.append(('linea', trazo, round(grosor * ctm[0], 3), cap, x1, y1, x2, y2))
+            trayecto, rectangulos = [], []
+        elif op == 'n':
+            trayecto, rectangulos = [], []
+        elif op == 'Do':
+            num = xobjects.get(a[0].decode())
+            diccionario, datos = objetos[num]
+            if b'/Subtype /Form' in diccionario:
+                matriz = re.search(rb'/Matrix \[([^\]]*)\]', diccionario)
+                m = [float(v) for v in matriz.group(1).split()] if matriz else [1, 0, 0, 1, 0, 0]
+                # Un formulario puede traer sus propias fuentes e imágenes
+                _interpretar(datos, _multiplicar(m, ctm), objetos,
+                             dict(fuentes, **_fuentes(diccionario, objetos)),
+                             dict(xobjects, **_referencias(diccionario, rb'XObject', objetos)), resultado)
+            else:
+                resultado.append(('imagen', zlib.crc32(datos)) + tuple(ctm))
+
+
+def diferencias_visuales(pdf_a, pdf_b, tolerancia=0.01):
+    """
+    Compara lo que se ve en dos PDFs
+
+    No importa el orden de las operaciones ni cómo se agrupó el texto, sólo
+    qué se dibuja, dónde y con qué fuente, color y grosor.
+
+    Returns:
+        Lista de mensajes con las diferencias (vacía si son equivalentes)
+    """
+    paginas_a, paginas_b = operaciones_pdf(pdf_a), operaciones_pdf(pdf_b)
+    if len(paginas_a) != len(paginas_b):
+        return [f"Páginas: {len(paginas_a)} != {len(paginas_b)}"]
+    diferencias = []
+    for numero, (ops_a, ops_b) in enumerate(zip(paginas_a, paginas_b), start=1):
+        grupos = {}
+        for lado, ops in ((0, ops_a), (1, ops_b)):
+            for op in ops:
+                # Lo que no es coordenada debe coincidir exactamente
+                clave = tuple(v for v in op if not isinstance(v, float))
+                coordenadas = tuple(v for v in op if isinstance(v, float))
+                grupos.setdefault(clave, ([], []))[lado].append(coordenadas)
+        for clave, (lista_a, lista_b) in grupos.items():
+            lista_a.sort()
+            lista_b.sort()
+            if len(lista_a) != len(lista_b):
+                diferencias.append(f"Página {numero}: {clave} aparece {len(lista_a)} vs {len(lista_b)} veces")
+                continue
+            for ca, cb in zip(lista_a, lista_b):
+                if any(abs(x - y) > tolerancia for x, y in zip(ca, cb)):
+                    diferencias.append(f"Página {numero}: {clave} en {ca} vs {cb}")
+    return diferencias
+
+
+if __name__ == '__main__':
+    import sys
+    from benchmark_facturas import verificar_motores, verificar_paginacion
+    sys.exit(max(verificar_motores(), verificar_paginacion()))
@@ -6,12 +6,26 @@ Script para generar factura de ANCLAJE SOLAR ENERGY S.A.S
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, KeepTogether
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, KeepTogether, Flowable
+from reportlab.platypus.flowables import _listWrapOn
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
 from reportlab.pdfgen import canvas
 from datetime import datetime
+import copy
+import functools
+import hashlib
+import io
+import math
 import os
+import time
+
+from almacen_pdf import guardar_pdf
+from metricas import medir, registrar
+from perfilador import perfilado
+from perfiles_pdf import PERFIL, obtener_perfil, optimizar_pdf
+from totales import calcular_totales
 
 # Colores corporativos de ANCLAJE SOLAR ENERGY
 COLOR_DORADO = colors.HexColor('#F5B301')  # Amarillo/dorado del sol
@@ -19,50 +33,608 @@ COLOR_AZUL = colors.HexColor('#1E5A8E')    # Azul de los paneles
 COLOR_NEGRO = colors.HexColor('#2C2C2C')   # Negro del fondo
 COLOR_GRIS = colors.HexColor('#6B6B6B')    # Gris para detalles
 
+# Estilos personalizados (se construyen una sola vez por proceso)
+ESTILOS_BASE = getSampleStyleSheet()
+
+ESTILO_TITULO = ParagraphStyle(
+    'CustomTitle',
+    parent=ESTILOS_BASE['Heading1'],
+    fontSize=20,
+    textColor=COLOR_NEGRO,
+    spaceAfter=10,
+    alignment=TA_CENTER,
+    fontName='Helvetica-Bold'
+)
+
+ESTILO_EMPRESA = ParagraphStyle(
+    'EmpresaStyle',
+    parent=ESTILOS_BASE['Normal'],
+    fontSize=11,
+    textColor=COLOR_NEGRO,
+    alignment=TA_LEFT,
+    fontName='Helvetica'
+)
+
+ESTILO_TOTALES = ParagraphStyle(
+    'TotalesStyle',
+    parent=ESTILOS_BASE['Normal'],
+    fontSize=10,
+    textColor=COLOR_NEGRO,
+    alignment=TA_RIGHT,
+)
+
+ESTILO_TOTAL_FINAL = ParagraphStyle(
+    'TotalFinalStyle',
+    parent=ESTILOS_BASE['Normal'],
+    fontSize=12,
+    textColor=colors.white,
+    alignment=TA_RIGHT,
+    fontName='Helvetica-Bold'
+)
+
+# Estilos de las tablas (los comandos no dependen de los datos de la factura)
+ESTILO_TABLA_ENCABEZADO = TableStyle([
+    ('ALIGN', (0, 0), (0, 0), 'CENTER'),
+    ('ALIGN', (1, 0), (1, 0), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+
+ESTILO_TABLA_BARRA = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), COLOR_DORADO),
+    ('LINEBELOW', (0, 0), (-1, -1), 2, COLOR_AZUL),
+])
+
+ESTILO_TABLA_EMPRESA = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F9F9F9')),
+    ('BOX', (0, 0), (-1, -1), 1.5, COLOR_AZUL),
+    ('LEFTPADDING', (0, 0), (-1, -1), 12),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 12),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+
+ESTILO_TABLA_CLIENTE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FAFAFA')),
+    ('BOX', (0, 0), (-1, -1), 1.5, COLOR_DORADO),
+    ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+])
+
+ESTILO_TABLA_ITEMS = TableStyle([
+    # Encabezado con colores corporativos
+    ('BACKGROUND', (0, 0), (-1, 0), COLOR_AZUL),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    
+    # Cuerpo de la tabla
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+    ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    
+    # Filas alternadas
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F9F9F9')]),
+    
+    # Bordes
+    ('BOX', (0, 0), (-1, -1), 1.5, COLOR_AZUL),
+    ('LINEBELOW', (0, 0), (-1, 0), 2, COLOR_DORADO),
+    ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    
+    # Padding
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+])
+
+# Mismo estilo con las filas alternadas invertidas, para los bloques de la
+# tabla paginada que empiezan en un item impar
+ESTILO_TABLA_ITEMS_DESPLAZADO = TableStyle([
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#F9F9F9'), colors.white]),
+], parent=ESTILO_TABLA_ITEMS)
+
+ESTILO_TABLA_TOTALES = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('TEXTCOLOR', (0, 0), (-1, -1), COLOR_NEGRO),
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FAFAFA')),
+    ('BOX', (0, 0), (-1, -1), 1, COLOR_GRIS),
+    ('TOPPADDING', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+])
+
+ESTILO_TABLA_TOTAL_FINAL = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTSIZE', (0, 0), (-1, -1), 12),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
+    ('BACKGROUND', (0, 0), (-1, -1), COLOR_AZUL),
+    ('BOX', (0, 0), (-1, -1), 2, COLOR_DORADO),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+])
+
+
+# Agregar "Página X de Y" al pie de cada página
+NUMERAR_PAGINAS = os.environ.get('FACTURA_NUMERAR_PAGINAS', '0') == '1'
+
 
 class FooterCanvas(canvas.Canvas):
-    """Canvas personalizado para agregar pie de página automático"""
-    
-    def __init__(self, *args, **kwargs):
+    """
+    Canvas personalizado para agregar pie de página automático
+
+    El pie se dibuja al cerrar cada página, sin guardar copias de las páginas
+    anteriores, así que la memoria no crece con la cantidad de páginas. Con
+    numerar_paginas (por defecto FACTURA_NUMERAR_PAGINAS) se agrega "Página X
+    de Y": el total se escribe en un formulario (form XObject) que se define
+    al final, en save().
+    """
+
+    FORM_TOTAL_PAGINAS = 'total_paginas'
+
+    def __init__(self, *args, numerar_paginas=None, **kwargs):
         canvas.Canvas.__init__(self, *args, **kwargs)
-        self.pages = []
+        self.numerar_paginas = NUMERAR_PAGINAS if numerar_paginas is None else numerar_paginas
         
     def showPage(self):
-        self.pages.append(dict(self.__dict__))
-        self._startPage()
+        self.draw_footer()
+        canvas.Canvas.showPage(self)
         
     def save(self):
-        page_count = len(self.pages)
-        for page in self.pages:
-            self.__dict__.update(page)
-            self.draw_footer(page_count)
-            canvas.Canvas.showPage(self)
+        if self.numerar_paginas:
+            # _pageNumber ya apunta a la página siguiente a la última cerrada
+            page_count = self._pageNumber - 1 if not self._code else self._pageNumber
+            self.beginForm(self.FORM_TOTAL_PAGINAS)
+            self.setFont('Helvetica', 8)
+            self.setFillColor(COLOR_GRIS)
+            self.drawString(0, 0, str(page_count))
+            self.endForm()
         canvas.Canvas.save(self)
         
-    def draw_footer(self, page_count):
-        """Dibuja el pie de página en cada página"""
+    def draw_footer(self):
+        """Dibuja el pie de página en la página actual"""
         page_width = letter[0]
-        page_height = letter[1]
-        
-        # Línea decorativa dorada
-        self.setStrokeColor(COLOR_DORADO)
-        self.setLineWidth(3)
-        self.line(40, 60, page_width - 40, 60)
         
-        # Texto del pie de página
-        self.setFont('Helvetica-Bold', 9)
-        self.setFillColor(COLOR_AZUL)
-        text1 = "Gracias por confiar en ANCLAJE SOLAR ENERGY"
-        text_width1 = self.stringWidth(text1, 'Helvetica-Bold', 9)
-        self.drawString((page_width - text_width1) / 2, 45, text1)
+        # La parte fija del pie está precompilada (ver membrete.py)
+        from membrete import colocar, formulario_pie
+        colocar(self, formulario_pie())
         
-        self.setFont('Helvetica-Oblique', 8)
-        self.setFillColor(COLOR_GRIS)
-        text2 = "Energía limpia • Estabilidad • Futuro"
-        text_width2 = self.stringWidth(text2, 'Helvetica-Oblique', 8)
-        self.drawString((page_width - text_width2) / 2, 32, text2)
+        if self.numerar_paginas:
+            # El total de páginas se completa en save() mediante el formulario
+            text3 = f"Página {self._pageNumber} de "
+            x = page_width - 60
+            self.setFont('Helvetica', 8)
+            self.setFillColor(COLOR_GRIS)
+            self.drawRightString(x, 20, text3)
+            self.saveState()
+            self.translate(x, 20)
+            self.doForm(self.FORM_TOTAL_PAGINAS)
+            self.restoreState()
+
 
+def dibujar_pie_fijo(canv):
+    """Dibuja la parte del pie de página que es igual en todas las páginas"""
+    page_width = letter[0]
+    
+    # Línea decorativa dorada
+    canv.setStrokeColor(COLOR_DORADO)
+    canv.setLineWidth(3)
+    canv.line(40, 60, page_width - 40, 60)
+    
+    # Texto del pie de página
+    canv.setFont('Helvetica-Bold', 9)
+    canv.setFillColor(COLOR_AZUL)
+    text1 = "Gracias por confiar en ANCLAJE SOLAR ENERGY"
+    text_width1 = canv.stringWidth(text1, 'Helvetica-Bold', 9)
+    canv.drawString((page_width - text_width1) / 2, 45, text1)
+    
+    canv.setFont('Helvetica-Oblique', 8)
+    canv.setFillColor(COLOR_GRIS)
+    text2 = "Energía limpia • Estabilidad • Futuro"
+    text_width2 = canv.stringWidth(text2, 'Helvetica-Oblique', 8)
+    canv.drawString((page_width - text_width2) / 2, 32, text2)
 
+
+# Ruta del logo - usar ruta relativa para Deta
+POSIBLES_LOGOS = [
+    'logo_anclaje.jpeg',
+    'logo.png', 
+    'logo_anclaje.png', 
+    'anclaje_logo.png',
+    '/home/apenagos/Escritorio/papa/logo_anclaje.jpeg'  # Fallback local
+]
+
+
+# Segundos durante los que se recuerda que no hay logo antes de volver a buscarlo
+REINTENTO_BUSQUEDA_LOGO = 30
+
+_cache_logo = {'ruta': None, 'buscado': 0.0, 'xobjects': {}}
+
+
+def buscar_logo():
+    """
+    Retorna la ruta del primer logo disponible, o None si no hay ninguno
+
+    El resultado se recuerda entre llamadas: mientras el logo encontrado siga
+    existiendo no se vuelven a revisar las demás rutas.
+    """
+    ruta = _cache_logo['ruta']
+    if ruta is not None:
+        if os.path.exists(ruta):
+            return ruta
+    elif time.monotonic() - _cache_logo['buscado'] < REINTENTO_BUSQUEDA_LOGO and _cache_logo['buscado']:
+        return None
+
+    ruta = None
+    for logo in POSIBLES_LOGOS:
+        if os.path.exists(logo):
+            ruta = logo
+            break
+    _cache_logo['ruta'] = ruta
+    _cache_logo['buscado'] = time.monotonic()
+    return ruta
+
+
+def _cargar_logo(logo_path, pixeles=None, calidad=None):
+    """
+    Retorna el logo JPEG ya codificado como XObject de PDF, o None si no es un JPEG
+
+    Se guarda por ruta, fecha de modificación y tamaño, así que si el archivo
+    cambia se vuelve a cargar.
+
+    Args:
+        pixeles: (ancho, alto) máximos en píxeles; si el logo es más grande se
+            reduce y se recodifica como JPEG con la calidad indicada (también
+            los PNG sin transparencia). Por defecto se usa el archivo original
+    """
+    es_jpeg = os.path.splitext(logo_path)[1].lower() in ('.jpg', '.jpeg')
+    if not es_jpeg and pixeles is None:
+        return None
+    info = os.stat(logo_path)
+    archivo = (logo_path, info.st_mtime_ns, info.st_size)
+    clave = (archivo, pixeles, calidad)
+    xobject = _cache_logo['xobjects'].get(clave)
+    if xobject is None:
+        nombre = hashlib.md5(repr(clave if pixeles else archivo).encode('utf-8')).hexdigest()
+        if pixeles is None:
+            xobject = PDFImageXObject(nombre, logo_path)
+        else:
+            jpeg = _reducir_logo(logo_path, pixeles, calidad)
+            if jpeg is None:
+                return None
+            xobject = PDFImageXObject(nombre)
+            xobject.loadImageFromJPEG(jpeg)
+        # El contenido ya queda en bytes para no recodificarlo en cada PDF
+        if isinstance(xobject.streamContent, str):
+            xobject.streamContent = xobject.streamContent.encode('latin-1')
+        # Se conservan las versiones (una por perfil) del archivo actual
+        xobjects = {c: x for c, x in _cache_logo['xobjects'].items() if c[0] == archivo}
+        xobjects[clave] = xobject
+        _cache_logo['xobjects'] = xobjects
+    return xobject
+
+
+def _reducir_logo(logo_path, pixeles, calidad):
+    """
+    Reduce el logo a lo sumo a los píxeles indicados y lo codifica como JPEG
+
+    Returns:
+        Archivo en memoria con el JPEG, o None si el logo tiene transparencia
+    """
+    from PIL import Image as ImagenPIL
+    with ImagenPIL.open(logo_path) as imagen:
+        if imagen.mode in ('RGBA', 'LA', 'PA') or 'transparency' in imagen.info:
+            return None
+        imagen = imagen.convert('L' if imagen.mode in ('1', 'L') else 'RGB')
+        tamano = (min(imagen.width, pixeles[0]), min(imagen.height, pixeles[1]))
+        if tamano != imagen.size:
+            imagen = imagen.resize(tamano, ImagenPIL.LANCZOS)
+        jpeg = io.BytesIO()
+        imagen.save(jpeg, 'JPEG', quality=calidad or 85, optimize=True)
+    jpeg.seek(0)
+    return jpeg
+
+
+class LogoCacheado(Flowable):
+    """Flowable que dibuja el logo a partir del XObject ya cargado en memoria"""
+
+    def __init__(self, xobject, width, height):
+        Flowable.__init__(self)
+        self.xobject = xobject
+        self.width = width
+        self.height = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        dibujar_xobject(self.canv, self.xobject, 0, 0, self.width, self.height)
+
+
+def registrar_xobject(canv, xobject):
+    """
+    Agrega el XObject de imagen al documento del canvas si aún no está
+
+    Returns:
+        Nombre con que se dibuja en el documento
+    """
+    doc = canv._doc
+    nombre_registro = doc.getXObjectName(xobject.name)
+    if not doc.idToObject.get(nombre_registro):
+        img = copy.copy(xobject)
+        canv._setXObjects(img)
+        doc.Reference(img, nombre_registro)
+        doc.addForm(xobject.name, img)
+    return nombre_registro
+
+
+def dibujar_xobject(canv, xobject, x, y, width, height):
+    """Registra el XObject en el documento (una vez) y lo dibuja, como Canvas.drawImage"""
+    nombre_registro = registrar_xobject(canv, xobject)
+    canv._currentPageHasImages = 1
+    canv.saveState()
+    canv.translate(x, y)
+    canv.scale(width, height)
+    canv._code.append(f"/{nombre_registro} Do")
+    canv.restoreState()
+    canv._formsinuse.append(xobject.name)
+
+
+def limpiar_cache_recursos():
+    """Olvida el logo encontrado y los logos cargados"""
+    _cache_logo['ruta'] = None
+    _cache_logo['buscado'] = 0.0
+    _cache_logo['xobjects'] = {}
+
+
+def pixeles_logo(width, height, perfil=None):
+    """Píxeles máximos del logo dibujado en width x height puntos, según el perfil"""
+    ppp = obtener_perfil(perfil)['logo_ppp']
+    if ppp is None:
+        return None
+    return (math.ceil(width / inch * ppp), math.ceil(height / inch * ppp))
+
+
+def logo_flowable(logo_path, width, height, perfil=None):
+    """Retorna el flowable del logo usando la versión en caché cuando es posible"""
+    calidad = obtener_perfil(perfil)['calidad_jpeg']
+    xobject = _cargar_logo(logo_path, pixeles_logo(width, height, perfil), calidad)
+    if xobject is None:
+        return Image(logo_path, width=width, height=height)
+    return LogoCacheado(xobject, width, height)
+
+
+# Márgenes de la página (abajo queda espacio para el pie)
+MARGENES = {'rightMargin': 40, 'leftMargin': 40, 'topMargin': 40, 'bottomMargin': 80}
+
+
+def flowables_membrete(logo_path=None, nit="", telefono="", correo="", perfil=None):
+    """
+    Flowables del encabezado con logo y título, la barra decorativa y la caja
+    de la empresa, en el orden en que van al comienzo de la factura
+
+    El perfil (ver perfiles_pdf) decide la resolución del logo.
+    """
+    story = []
+    
+    # Encabezado con logo y título
+    header_data = []
+    
+    if logo_path and os.path.exists(logo_path):
+        try:
+            img = logo_flowable(logo_path, 1.5*inch, 1.5*inch, perfil)
+            title_para = Paragraph("<b>FACTURA DE VENTA</b>", ESTILO_TITULO)
+            header_data = [[img, title_para]]
+            header_table = Table(header_data, colWidths=[2*inch, 4.5*inch])
+            header_table.setStyle(ESTILO_TABLA_ENCABEZADO)
+            story.append(header_table)
+            story.append(Spacer(1, 0.2*inch))
+        except Exception as e:
+            story.append(Paragraph("<b>FACTURA DE VENTA</b>", ESTILO_TITULO))
+    else:
+        story.append(Paragraph("<b>FACTURA DE VENTA</b>", ESTILO_TITULO))
+        story.append(Spacer(1, 0.1*inch))
+    
+    # Barra decorativa con colores corporativos  
+    page_width = letter[0] - 80  # Ancho de página menos márgenes
+    barra_data = [[""]]
+    barra_table = Table(barra_data, colWidths=[page_width], rowHeights=[0.15*inch])
+    barra_table.setStyle(ESTILO_TABLA_BARRA)
+    story.append(barra_table)
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Información de la empresa en caja con fondo
+    empresa_data = [
+        [Paragraph("<b><font size=12 color='#1E5A8E'>ANCLAJE SOLAR ENERGY S.A.S</font></b>", ESTILO_EMPRESA)],
+        [Paragraph("<i>Energía Solar Fotovoltaica</i>", ESTILO_EMPRESA)],
+        [Paragraph(f"<b>NIT:</b> {nit}", ESTILO_EMPRESA)],
+        [Paragraph(f"<b>Teléfono:</b> {telefono}", ESTILO_EMPRESA)],
+        [Paragraph(f"<b>Correo:</b> {correo}", ESTILO_EMPRESA)]
+    ]
+    
+    empresa_table = Table(empresa_data, colWidths=[page_width])
+    empresa_table.setStyle(ESTILO_TABLA_EMPRESA)
+    story.append(empresa_table)
+    return story
+
+
+# Relleno del Frame de SimpleDocTemplate a cada lado (el espacio útil de la
+# página es doc.width/doc.height menos dos veces este valor)
+RELLENO_FRAME = 6
+
+# Motor de dibujo por defecto: 'platypus' o 'canvas' (ver factura_canvas)
+MOTOR = os.environ.get('FACTURA_MOTOR', 'platypus')
+MOTORES = ('platypus', 'canvas')
+
+# Items que siempre acompañan a los totales en la última página
+ITEMS_MINIMOS_CON_TOTALES = 3
+
+
+class TablaItemsPaginada(Flowable):
+    """
+    Tabla de items para facturas largas
+
+    En lugar de una sola Table que ReportLab vuelve a partir y medir en cada
+    página, arma una Table pequeña por página con el encabezado repetido. Al
+    partirse sólo mide las filas que caben en la página, así que el tiempo
+    crece de forma lineal con la cantidad de items. Los flowables de 'pie'
+    (los totales) se mantienen en la misma página que los últimos items.
+    """
+
+    def __init__(self, encabezado, filas, col_widths, pie=None, inicio=0):
+        Flowable.__init__(self)
+        self.encabezado = encabezado
+        self.filas = filas
+        self.col_widths = col_widths
+        self.pie = pie or []
+        self.inicio = inicio  # Índice del primer item, para alternar los colores de fila
+        self._alto_fila = None
+
+    def _tabla(self, filas, inicio):
+        tabla = Table([self.encabezado] + filas, colWidths=self.col_widths)
+        tabla.setStyle(ESTILO_TABLA_ITEMS_DESPLAZADO if inicio % 2 else ESTILO_TABLA_ITEMS)
+        return tabla
+
+    def wrap(self, availWidth, availHeight):
+        # Como KeepTogether: se reporta una altura enorme para forzar split()
+        return availWidth, 0xffffff
+
+    def split(self, availWidth, availHeight):
+        if self._alto_fila is None:
+            muestra = self._tabla(self.filas[:1], 0)
+            muestra.wrap(availWidth, availHeight)
+            self._alto_encabezado = muestra._rowHeights[0]
+            self._alto_fila = muestra._rowHeights[-1]
+        alto_pie = _listWrapOn(self.pie, availWidth, self.canv)[1] if self.pie else 0
+        total_filas = len(self.filas)
+        alto_disponible = availHeight - self._alto_encabezado
+
+        # ¿Caben todas las filas restantes junto con los totales?
+        if self._alto_fila * total_filas + alto_pie <= alto_disponible:
+            tabla = self._tabla(self.filas, self.inicio)
+            _, alto = tabla.wrap(availWidth, availHeight)
+            if alto + alto_pie <= availHeight:
+                return [tabla] + self.pie
+
+        # Llenar la página dejando algunas filas para acompañar a los totales
+        caben = int(alto_disponible // self._alto_fila)
+        cantidad = min(caben, total_filas - ITEMS_MINIMOS_CON_TOTALES)
+        if cantidad <= 0:
+            if not self._al_comienzo():
+                return []
+            # Ni en una página nueva caben las últimas filas con los totales
+            # (filas de muchas líneas): van las filas que quepan y los totales
+            # pasan a la página siguiente
+            cantidad = min(caben, total_filas)
+            if cantidad <= 0:
+                return []
+        tabla = self._tabla(self.filas[:cantidad], self.inicio)
+        _, alto = tabla.wrap(availWidth, availHeight)
+        if alto > availHeight:
+            # Hay filas de varias líneas: quedarse con las que sí caben
+            acumulado = self._alto_encabezado
+            cantidad = 0
+            for alto_fila in tabla._rowHeights[1:]:
+                acumulado += alto_fila
+                if acumulado > availHeight:
+                    break
+                cantidad += 1
+            if cantidad <= 0:
+                return []
+            tabla = self._tabla(self.filas[:cantidad], self.inicio)
+        if cantidad >= total_filas:
+            return [tabla] + self.pie
+        resto = TablaItemsPaginada(
+            self.encabezado, self.filas[cantidad:], self.col_widths, self.pie, self.inicio + cantidad
+        )
+        resto._alto_fila = self._alto_fila
+        resto._alto_encabezado = self._alto_encabezado
+        return [tabla, resto]
+
+    def _al_comienzo(self):
+        """True si el Frame está vacío (se está en el comienzo de una página)"""
+        return bool(getattr(getattr(self, '_frame', None), '_atTop', False))
+
+    def draw(self):
+        # Nunca se dibuja directamente: siempre se reemplaza por sus partes
+        pass
+
+
+def _tabla_si_cabe(items_data, col_widths, totales, doc):
+    """
+    Tabla de items, si cabe junto con los totales en una página
+
+    KeepTogether sólo puede mantener el bloque unido si cabe en una página
+    entera; si no, parte la tabla sin repetir el encabezado. Por eso el
+    modo paginado se elige midiendo el bloque contra el Frame y no por la
+    cantidad de items (las descripciones de varias líneas ocupan más).
+
+    Returns:
+        La Table con su estilo, o None si hay que usar TablaItemsPaginada
+    """
+    ancho = doc.width - 2 * RELLENO_FRAME
+    alto = doc.height - 2 * RELLENO_FRAME
+    # Ninguna fila es más baja que una de una sola línea: con muchos items se
+    # descarta sin armar la tabla completa
+    muestra = Table(items_data[:1] + [['', '', '', '']], colWidths=col_widths)
+    muestra.setStyle(ESTILO_TABLA_ITEMS)
+    muestra.wrap(ancho, alto)
+    alto_minimo = muestra._rowHeights[0] + muestra._rowHeights[1] * (len(items_data) - 1)
+    if alto_minimo > alto:
+        return None
+    tabla = Table(items_data, colWidths=col_widths)
+    tabla.setStyle(ESTILO_TABLA_ITEMS)
+    if _listWrapOn([tabla] + totales, ancho, None)[1] > alto:
+        return None
+    return tabla
+
+
+_estado = {'precalentado': False}
+
+
+def precalentar():
+    """
+    Carga por adelantado el logo y los módulos de ReportLab
+
+    Genera una factura de prueba en memoria para que la primera factura
+    real no pague el costo de inicialización.
+
+    Returns:
+        Segundos que tomó el precalentamiento
+    """
+    inicio = time.perf_counter()
+    logo_path = buscar_logo()
+    generar_factura(
+        logo_path=logo_path,
+        factura_no='precalentamiento',
+        items=[{'descripcion': 'Item', 'cantidad': 1, 'valor_unitario': 1, 'tiene_iva': True}],
+        en_memoria=True
+    )
+    _estado['precalentado'] = True
+    return time.perf_counter() - inicio
+
+
+def esta_precalentado():
+    """True si precalentar() ya se ejecutó en este proceso (o en el proceso padre)"""
+    return _estado['precalentado']
+
+
+@perfilado('generar_factura', lambda kwargs: {
+    'factura_no': kwargs.get('factura_no'), 'items': len(kwargs.get('items', ())),
+    'motor': kwargs.get('motor'), 'perfil': kwargs.get('perfil')
+})
 def generar_factura(
     logo_path=None,
     nit="",
@@ -76,7 +648,12 @@ def generar_factura(
     items=[],
     subtotal=0,
     iva=0,
-    total=0
+    total=0,
+    en_memoria=False,
+    paginar_items=None,
+    motor=None,
+    perfil=None,
+    numerar_paginas=None
 ):
     """
     Genera una factura en PDF
@@ -95,118 +672,81 @@ def generar_factura(
         subtotal: Subtotal de la factura
         iva: IVA de la factura
         total: Total a pagar
+        en_memoria: Si es True, retorna los bytes del PDF en lugar de guardarlo
+            en el directorio de salida (ver almacen_pdf)
+        paginar_items: Si es True, la tabla de items se pagina por bloques con el
+            encabezado repetido (modo para facturas largas). Por defecto se activa
+            cuando los items y los totales no caben juntos en una página;
+            soporta 10.000 items en unos pocos segundos
+        motor: 'canvas' dibuja la factura directamente sobre el canvas (más
+            rápido); si la factura no se puede dibujar igual se usa
+            'platypus'. Por defecto
+            FACTURA_MOTOR
+        perfil: Perfil de salida del PDF: 'archivo', 'mensajeria' o 'minimo'
+            (ver perfiles_pdf). Por defecto PDF_PERFIL
+        numerar_paginas: Si es True, el pie lleva "Página X de Y". Por defecto
+            FACTURA_NUMERAR_PAGINAS
+
+    Returns:
+        La ruta del archivo generado, o los bytes del PDF si en_memoria=True
     """
     
-    filename = f"factura_{factura_no or datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    doc = SimpleDocTemplate(
-        filename, 
-        pagesize=letter,
-        rightMargin=40,
-        leftMargin=40,
-        topMargin=40,
-        bottomMargin=80  # Espacio extra para el pie de página
-    )
+    motor = motor or MOTOR
+    if motor not in MOTORES:
+        raise ValueError(f"Motor desconocido: {motor} (opciones: {', '.join(MOTORES)})")
+    perfil = perfil or PERFIL
+    obtener_perfil(perfil)
+    if motor == 'canvas' and not paginar_items:
+        from factura_canvas import dibujar_factura
+        with medir('canvas'):
+            pdf_bytes = dibujar_factura(
+                logo_path, nit, telefono, correo, cliente, documento, direccion,
+                fecha, factura_no, items, subtotal, iva, total, perfil, numerar_paginas
+            )
+        if pdf_bytes is not None:
+            return _entregar(pdf_bytes, factura_no, en_memoria, perfil)
+    
+    inicio = time.perf_counter()
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, **MARGENES)
     story = []
-    styles = getSampleStyleSheet()
-    
-    # Estilos personalizados
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=20,
-        textColor=COLOR_NEGRO,
-        spaceAfter=10,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
     
-    empresa_style = ParagraphStyle(
-        'EmpresaStyle',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=COLOR_NEGRO,
-        alignment=TA_LEFT,
-        fontName='Helvetica'
-    )
-    
-    # Encabezado con logo y título
-    header_data = []
-    
-    if logo_path and os.path.exists(logo_path):
-        try:
-            img = Image(logo_path, width=1.5*inch, height=1.5*inch)
-            title_para = Paragraph("<b>FACTURA DE VENTA</b>", title_style)
-            header_data = [[img, title_para]]
-            header_table = Table(header_data, colWidths=[2*inch, 4.5*inch])
-            header_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (0, 0), 'CENTER'),
-                ('ALIGN', (1, 0), (1, 0), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
-            story.append(header_table)
-            story.append(Spacer(1, 0.2*inch))
-        except Exception as e:
-            story.append(Paragraph("<b>FACTURA DE VENTA</b>", title_style))
+    # Encabezado, barra decorativa y caja de la empresa: se dibujan una vez
+    # por perfil de empresa y se reutilizan (ver membrete.py)
+    from membrete import MembreteFlowable, obtener_membrete
+    with medir('membrete'):
+        membrete = obtener_membrete(logo_path, nit, telefono, correo, perfil)
+    if membrete is not None:
+        story.append(MembreteFlowable(membrete))
     else:
-        story.append(Paragraph("<b>FACTURA DE VENTA</b>", title_style))
-        story.append(Spacer(1, 0.1*inch))
+        story.extend(flowables_membrete(logo_path, nit, telefono, correo, perfil))
+    story.append(Spacer(1, 0.25*inch))
     
-    # Barra decorativa con colores corporativos  
     page_width = letter[0] - 80  # Ancho de página menos márgenes
-    barra_data = [[""]]
-    barra_table = Table(barra_data, colWidths=[page_width], rowHeights=[0.15*inch])
-    barra_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), COLOR_DORADO),
-        ('LINEBELOW', (0, 0), (-1, -1), 2, COLOR_AZUL),
-    ]))
-    story.append(barra_table)
-    story.append(Spacer(1, 0.2*inch))
-    
-    # Información de la empresa en caja con fondo
-    empresa_data = [
-        [Paragraph("<b><font size=12 color='#1E5A8E'>ANCLAJE SOLAR ENERGY S.A.S</font></b>", empresa_style)],
-        [Paragraph("<i>Energía Solar Fotovoltaica</i>", empresa_style)],
-        [Paragraph(f"<b>NIT:</b> {nit}", empresa_style)],
-        [Paragraph(f"<b>Teléfono:</b> {telefono}", empresa_style)],
-        [Paragraph(f"<b>Correo:</b> {correo}", empresa_style)]
-    ]
-    
-    empresa_table = Table(empresa_data, colWidths=[page_width])
-    empresa_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F9F9F9')),
-        ('BOX', (0, 0), (-1, -1), 1.5, COLOR_AZUL),
-        ('LEFTPADDING', (0, 0), (-1, -1), 12),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(empresa_table)
-    story.append(Spacer(1, 0.25*inch))
     
     # Información del cliente en dos columnas
     cliente_izq = [
-        [Paragraph("<b>Cliente:</b>", empresa_style)],
-        [Paragraph("<b>Documento:</b>", empresa_style)],
-        [Paragraph("<b>Dirección:</b>", empresa_style)],
+        [Paragraph("<b>Cliente:</b>", ESTILO_EMPRESA)],
+        [Paragraph("<b>Documento:</b>", ESTILO_EMPRESA)],
+        [Paragraph("<b>Dirección:</b>", ESTILO_EMPRESA)],
     ]
     
     cliente_der = [
-        [Paragraph("<b>Fecha:</b>", empresa_style)],
-        [Paragraph("<b>Factura No:</b>", empresa_style)],
-        [Paragraph("", empresa_style)],  # Espacio vacío
+        [Paragraph("<b>Fecha:</b>", ESTILO_EMPRESA)],
+        [Paragraph("<b>Factura No:</b>", ESTILO_EMPRESA)],
+        [Paragraph("", ESTILO_EMPRESA)],  # Espacio vacío
     ]
     
     valores_izq = [
-        [Paragraph(cliente, empresa_style)],
-        [Paragraph(documento, empresa_style)],
-        [Paragraph(direccion, empresa_style)],
+        [Paragraph(cliente, ESTILO_EMPRESA)],
+        [Paragraph(documento, ESTILO_EMPRESA)],
+        [Paragraph(direccion, ESTILO_EMPRESA)],
     ]
     
     valores_der = [
-        [Paragraph(fecha, empresa_style)],
-        [Paragraph(f"<b><font color='#F5B301'>{factura_no}</font></b>", empresa_style)],
-        [Paragraph("", empresa_style)],
+        [Paragraph(fecha, ESTILO_EMPRESA)],
+        [Paragraph(f"<b><font color='#F5B301'>{factura_no}</font></b>", ESTILO_EMPRESA)],
+        [Paragraph("", ESTILO_EMPRESA)],
     ]
     
     # Combinar las tablas - distribuir el ancho disponible
@@ -221,16 +761,7 @@ def generar_factura(
                       colWidths=[col2_width * 0.40, col2_width * 0.60])
     
     cliente_main = Table([[tabla_izq, tabla_der]], colWidths=[page_width * 0.53, page_width * 0.47])
-    cliente_main.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FAFAFA')),
-        ('BOX', (0, 0), (-1, -1), 1.5, COLOR_DORADO),
-        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    cliente_main.setStyle(ESTILO_TABLA_CLIENTE)
     story.append(cliente_main)
     story.append(Spacer(1, 0.25*inch))
     
@@ -253,109 +784,73 @@ def generar_factura(
         ])
     
     # Distribuir columnas proporcionalmente
-    items_table = Table(items_data, colWidths=[
+    items_col_widths = [
         page_width * 0.45,  # Descripción
         page_width * 0.15,  # Cantidad
         page_width * 0.20,  # Valor Unitario
         page_width * 0.20   # Total
-    ])
-    items_table.setStyle(TableStyle([
-        # Encabezado con colores corporativos
-        ('BACKGROUND', (0, 0), (-1, 0), COLOR_AZUL),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        
-        # Cuerpo de la tabla
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('ALIGN', (0, 1), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        
-        # Filas alternadas
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F9F9F9')]),
-        
-        # Bordes
-        ('BOX', (0, 0), (-1, -1), 1.5, COLOR_AZUL),
-        ('LINEBELOW', (0, 0), (-1, 0), 2, COLOR_DORADO),
-        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        
-        # Padding
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-    ]))
+    ]
     
     # Totales con diseño profesional (se agregarán juntos con la tabla)
-    totales_style = ParagraphStyle(
-        'TotalesStyle',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=COLOR_NEGRO,
-        alignment=TA_RIGHT,
-    )
-    
-    total_final_style = ParagraphStyle(
-        'TotalFinalStyle',
-        parent=styles['Normal'],
-        fontSize=12,
-        textColor=colors.white,
-        alignment=TA_RIGHT,
-        fontName='Helvetica-Bold'
-    )
-    
     totales_data = [
         ["Subtotal:", f"${subtotal:,.2f}"],
         ["IVA (19%):", f"${iva:,.2f}"],
     ]
     
     totales_table = Table(totales_data, colWidths=[1.5*inch, 1.5*inch])
-    totales_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('TEXTCOLOR', (0, 0), (-1, -1), COLOR_NEGRO),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#FAFAFA')),
-        ('BOX', (0, 0), (-1, -1), 1, COLOR_GRIS),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    totales_table.setStyle(ESTILO_TABLA_TOTALES)
     totales_table.hAlign = 'RIGHT'
     
     # Total a pagar destacado
     total_final_data = [["TOTAL A PAGAR:", f"${total:,.2f}"]]
     total_final_table = Table(total_final_data, colWidths=[1.5*inch, 1.5*inch])
-    total_final_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
-        ('BACKGROUND', (0, 0), (-1, -1), COLOR_AZUL),
-        ('BOX', (0, 0), (-1, -1), 2, COLOR_DORADO),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    total_final_table.setStyle(ESTILO_TABLA_TOTAL_FINAL)
     total_final_table.hAlign = 'RIGHT'
     
-    # Agrupar tabla de items con los totales para mantenerlos juntos
-    items_y_totales = [
-        items_table,
+    totales = [
         Spacer(1, 0.2*inch),
         totales_table,
         Spacer(1, 0.1*inch),
         total_final_table
     ]
     
-    story.append(KeepTogether(items_y_totales))
+    items_table = None
+    if paginar_items is None:
+        items_table = _tabla_si_cabe(items_data, items_col_widths, totales, doc)
+        paginar_items = items_table is None
+    
+    if paginar_items:
+        # Facturas largas: tabla por páginas con encabezado repetido y
+        # los últimos items junto a los totales
+        story.append(TablaItemsPaginada(items_data[0], items_data[1:], items_col_widths, pie=totales))
+    else:
+        # Agrupar tabla de items con los totales para mantenerlos juntos
+        if items_table is None:
+            items_table = Table(items_data, colWidths=items_col_widths)
+            items_table.setStyle(ESTILO_TABLA_ITEMS)
+        story.append(KeepTogether([items_table] + totales))
+    
+    registrar('historia', time.perf_counter() - inicio)
     
     # Generar PDF con pie de página automático
-    doc.build(story, canvasmaker=FooterCanvas)
+    with medir('build'):
+        doc.build(story, canvasmaker=functools.partial(FooterCanvas, numerar_paginas=numerar_paginas))
+    with medir('lectura'):
+        pdf_bytes = buffer.getvalue()
+    return _entregar(pdf_bytes, factura_no, en_memoria, perfil)
+
+
+def _entregar(pdf_bytes, factura_no, en_memoria, perfil):
+    """
+    Aplica la compresión del perfil y retorna los bytes del PDF o lo guarda
+    en el directorio de salida
+    """
+    if obtener_perfil(perfil)['nivel_zlib'] is not None:
+        with medir('optimizacion'):
+            pdf_bytes = optimizar_pdf(pdf_bytes, perfil)
+    if en_memoria:
+        return pdf_bytes
+    filename = guardar_pdf(pdf_bytes, factura_no)
     print(f"✓ Factura generada: {filename}")
     return filename
 
@@ -384,26 +879,10 @@ def ejemplo_uso():
         }
     ]
     
-    subtotal = sum(item['cantidad'] * item['valor_unitario'] for item in items_ejemplo)
-    iva = sum(item['cantidad'] * item['valor_unitario'] * 0.19 for item in items_ejemplo if item.get('tiene_iva', False))
-    total = subtotal + iva
-    
-    # Ruta del logo - usar ruta relativa para Deta
-    posibles_logos = [
-        'logo_anclaje.jpeg',
-        'logo.png', 
-        'logo_anclaje.png', 
-        'anclaje_logo.png',
-        '/home/apenagos/Escritorio/papa/logo_anclaje.jpeg'  # Fallback local
-    ]
-    logo_path = None
-    for logo in posibles_logos:
-        if os.path.exists(logo):
-            logo_path = logo
-            break
+    totales = calcular_totales(items_ejemplo)
     
     generar_factura(
-        logo_path=logo_path,
+        logo_path=buscar_logo(),
         nit="901.234.567-8",
         telefono="+57 300 123 4567",
         correo="ventas@anclajesolar.com",
@@ -413,9 +892,7 @@ def ejemplo_uso():
         fecha=datetime.now().strftime("%d/%m/%Y"),
         factura_no="001-2025",
         items=items_ejemplo,
-        subtotal=subtotal,
-        iva=iva,
-        total=total
+        **totales
     )
 
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Generación de facturas por lotes a partir de un archivo CSV o JSONL
+
+Uso:
+    python generar_lote.py facturas.csv --salida facturas_mes/
+    python generar_lote.py facturas.jsonl --workers 4
+
+Formato JSONL: una factura por línea, con los mismos campos que recibe
+generar_factura (cliente, documento, direccion, fecha, factura_no, nit,
+telefono, correo, y opcionalmente perfil) y una lista 'items' con
+'descripcion', 'cantidad', 'valor_unitario' y 'tiene_iva'.
+
+Formato CSV: una fila por item, con las columnas de la factura y las del
+item (descripcion, cantidad, valor_unitario, tiene_iva). Las filas con el
+mismo factura_no se agrupan en una sola factura.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from almacen_pdf import escribir_atomico
+from perfiles_pdf import PERFIL, obtener_perfil
+from totales import calcular_totales
+
+CAMPOS_FACTURA = ['nit', 'telefono', 'correo', 'cliente', 'documento', 'direccion', 'fecha', 'factura_no']
+VALORES_VERDADEROS = {'1', 'true', 'si', 'sí', 'x', 'yes'}
+
+
+def _normalizar_fecha(fecha):
+    """Convierte YYYY-MM-DD a DD/MM/YYYY, igual que el formulario web"""
+    if not fecha:
+        return datetime.now().strftime("%d/%m/%Y")
+    try:
+        return datetime.strptime(fecha, '%Y-%m-%d').strftime('%d/%m/%Y')
+    except ValueError:
+        return fecha
+
+
+def _normalizar_item(item):
+    """Convierte los campos de un item a sus tipos numéricos"""
+    tiene_iva = item.get('tiene_iva', False)
+    if isinstance(tiene_iva, str):
+        tiene_iva = tiene_iva.strip().lower() in VALORES_VERDADEROS
+    return {
+        'descripcion': item.get('descripcion', ''),
+        'cantidad': int(item['cantidad']),
+        'valor_unitario': float(item['valor_unitario']),
+        'tiene_iva': bool(tiene_iva)
+    }
+
+
+def leer_jsonl(ruta):
+    """Lee una factura por línea de un archivo JSONL"""
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                yield json.loads(linea)
+
+
+def leer_csv(ruta):
+    """Lee un CSV con una fila por item y agrupa las filas por factura_no"""
+    facturas = {}
+    with open(ruta, encoding='utf-8', newline='') as f:
+        for fila in csv.DictReader(f):
+            factura_no = fila.get('factura_no', '')
+            if factura_no not in facturas:
+                facturas[factura_no] = {campo: fila.get(campo, '') for campo in CAMPOS_FACTURA}
+                facturas[factura_no]['items'] = []
+            if fila.get('descripcion'):
+                facturas[factura_no]['items'].append(fila)
+    return list(facturas.values())
+
+
+def leer_facturas(ruta):
+    """Lee las facturas según la extensión del archivo"""
+    if ruta.lower().endswith('.csv'):
+        return leer_csv(ruta)
+    return list(leer_jsonl(ruta))
+
+
+def datos_desde_registro(registro, empresa=None, asignar_numero=None):
+    """
+    Convierte una factura del lote en los argumentos de generar_factura
+
+    Normaliza la fecha y los items y calcula los totales, igual que el
+    formulario web.
+
+    Args:
+        registro: Diccionario con los campos de la factura y sus 'items'
+        empresa: Valores por defecto para nit, telefono y correo
+        asignar_numero: Función que retorna el número para las facturas sin
+            factura_no (se llama sólo si el resto de la factura es válido)
+
+    Raises:
+        ValueError: Si la factura no tiene factura_no (y no se puede
+            asignar) o un item no es válido
+    """
+    empresa = empresa or {}
+    items = [_normalizar_item(item) for item in registro.get('items', [])]
+
+    datos = {campo: registro.get(campo) or empresa.get(campo, '') for campo in CAMPOS_FACTURA}
+    datos['fecha'] = _normalizar_fecha(datos['fecha'])
+    datos['perfil'] = registro.get('perfil') or PERFIL
+    obtener_perfil(datos['perfil'])
+    if not datos['factura_no']:
+        if asignar_numero is None:
+            raise ValueError("La factura no tiene factura_no")
+        datos['factura_no'] = asignar_numero()
+    datos['items'] = items
+    datos.update(calcular_totales(items))
+    return datos
+
+
+def generar_una(registro, salida, logo_path, empresa):
+    """
+    Genera una factura del lote (se ejecuta en un proceso del pool)
+
+    Returns:
+        Tupla (factura_no, ruta del PDF)
+    """
+    from generar_factura import generar_factura
+    datos = datos_desde_registro(registro, empresa)
+    factura_no = datos['factura_no']
+    pdf_bytes = generar_factura(logo_path=logo_path, en_memoria=True, **datos)
+    ruta_pdf = os.path.join(salida, f'factura_{factura_no}.pdf')
+    escribir_atomico(ruta_pdf, pdf_bytes)
+    return factura_no, ruta_pdf
+
+
+def generar_lote(facturas, salida='.', workers=None, empresa=None):
+    """
+    Genera todas las facturas en paralelo y reporta el progreso
+
+    Args:
+        facturas: Lista de diccionarios con los datos de cada factura
+        salida: Directorio donde se escriben los PDFs
+        workers: Número de procesos (por defecto, uno por núcleo)
+        empresa: Valores por defecto para nit, telefono y correo
+
+    Returns:
+        Tupla (generadas, errores) donde errores es una lista de (indice, factura_no, mensaje)
+    """
+    from generar_factura import buscar_logo
+    os.makedirs(salida, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    logo_path = buscar_logo()
+    empresa = empresa or {}
+    total_facturas = len(facturas)
+    generadas = 0
+    errores = []
+
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {
+            pool.submit(generar_una, registro, salida, logo_path, empresa): (i, registro.get('factura_no', ''))
+            for i, registro in enumerate(facturas)
+        }
+        for n, futuro in enumerate(as_completed(futuros), 1):
+            indice, factura_no = futuros[futuro]
+            try:
+                _, ruta_pdf = futuro.result()
+                generadas += 1
+                print(f"[{n}/{total_facturas}] ✓ {ruta_pdf}")
+            except Exception as e:
+                errores.append((indice, factura_no, str(e)))
+                print(f"[{n}/{total_facturas}] ✗ Factura {factura_no or '#' + str(indice + 1)}: {e}")
+    duracion = time.perf_counter() - inicio
+
+    print("=" * 50)
+    print(f"Facturas generadas: {generadas}/{total_facturas}  (errores: {len(errores)})")
+    print(f"Workers: {workers}  Tiempo: {duracion:.2f} s  "
+          f"Rendimiento: {generadas / duracion if duracion else 0:.1f} facturas/s")
+    return generadas, errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera facturas por lotes desde CSV o JSONL")
+    parser.add_argument('archivo', help="Archivo .csv o .jsonl con las facturas")
+    parser.add_argument('--salida', default='.', help="Directorio de salida de los PDFs")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos en paralelo (por defecto, núcleos)")
+    parser.add_argument('--nit', default='', help="NIT por defecto de la empresa")
+    parser.add_argument('--telefono', default='', help="Teléfono por defecto de la empresa")
+    parser.add_argument('--correo', default='', help="Correo por defecto de la empresa")
+    args = parser.parse_args(argv)
+
+    print("Generador de Facturas por Lotes - ANCLAJE SOLAR ENERGY")
+    print("=" * 50)
+    facturas = leer_facturas(args.archivo)
+    empresa = {'nit': args.nit, 'telefono': args.telefono, 'correo': args.correo}
+    _, errores = generar_lote(facturas, salida=args.salida, workers=args.workers, empresa=empresa)
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
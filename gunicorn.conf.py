@@ -0,0 +1,76 @@
+"""
+Configuración de Gunicorn para producción
+
+Uso (ver Procfile):
+    gunicorn -c gunicorn.conf.py main:app
+
+La app se importa en el proceso principal antes de crear los workers. El
+generador (ReportLab, estilos y logo) se precalienta según PRECALENTAR (ver
+arranque.py): por defecto en un hilo de cada worker, para que el servidor
+empiece a responder sin esperarlo. Todo se configura por variables de entorno.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Workers (procesos) e hilos por worker. cpu_count() puede reportar los
+# núcleos del host y no los del contenedor, por eso el valor por defecto se acota
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+
+# Segundos que puede tardar una petición antes de reiniciar el worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Reiniciar cada worker después de N peticiones para acotar la memoria (0 = nunca)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Importar la app en el proceso principal antes de crear los workers
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Descarta las métricas volcadas por una ejecución anterior"""
+    import metricas
+    metricas.limpiar_directorio()
+
+
+def when_ready(server):
+    """
+    Con PRECALENTAR=inicio precalienta en el proceso principal, antes del fork
+
+    Los workers comparten esa memoria, pero el servidor tarda más en arrancar.
+    """
+    import arranque
+    if arranque.PRECALENTAR == 'inicio':
+        server.log.info("Precalentamiento completado en %.2f s", arranque.precalentar())
+
+
+def post_fork(server, worker):
+    """
+    Con PRECALENTAR=segundo_plano cada worker precalienta en un hilo mientras
+    atiende. Cada worker retoma además los envíos y los trabajos de render
+    que quedaron en cola.
+    """
+    import arranque
+    from app_factura import reanudar_colas
+    if arranque.PRECALENTAR == 'segundo_plano':
+        arranque.precalentar()
+    reanudar_colas()
+
+
+def worker_exit(server, worker):
+    """
+    Al reciclarse (max_requests) o detenerse, el worker devuelve los números
+    que reservó y no entregó, para que la serie no quede con huecos.
+    """
+    import numeracion
+    numeracion.devolver_bloques()
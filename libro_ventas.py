@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Libro de ventas en columnas
+
+Cada factura generada agrega sus items a un libro de solo anexar en disco,
+guardado por columnas: un archivo de enteros por columna (NumPy los lee sin
+convertir nada), en dos tablas:
+
+    facturas/  dia, clave, subtotal, iva, total      (una fila por factura)
+    items/     factura, descripcion, cantidad, valor, iva   (una fila por item)
+
+Los montos van en centavos (int64), el día en días desde 1970, la clave es
+un hash del número de factura y cada item apunta a la fila de su factura.
+Las descripciones se guardan una vez en descripciones.txt y los items usan
+su posición en ese archivo.
+
+Los reportes por día, mes, producto y estado de IVA se calculan recorriendo
+las columnas con operaciones vectorizadas, así que años de facturas se
+resumen en milisegundos. Si una factura se vuelve a generar con el mismo
+número, cuenta sólo la última versión (igual que en archivo_facturas).
+
+Varios workers pueden anexar a la vez: cada escritura toma un bloqueo de
+archivo. Los items se escriben antes que su factura, así que si un proceso
+muere a mitad de una escritura, lo que alcanzó a escribir se ignora al leer
+y se descarta en la siguiente escritura.
+
+Uso:
+    python libro_ventas.py --importar            # cargar las facturas de archivo_facturas
+    python libro_ventas.py --prueba 1000000      # medir los reportes con items de ejemplo
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from totales import a_centavos, a_pesos, calcular_totales
+
+# Configuración por variables de entorno
+DIRECTORIO = os.environ.get('LIBRO_VENTAS_DIR', 'libro_ventas')
+ACTIVO = os.environ.get('LIBRO_VENTAS', '1') == '1'
+
+TABLAS = {
+    'facturas': {'dia': np.int32, 'clave': np.int64, 'subtotal': np.int64, 'iva': np.int64, 'total': np.int64},
+    'items': {'factura': np.int64, 'descripcion': np.int32, 'cantidad': np.int64, 'valor': np.int64,
+              'iva': np.uint8},
+}
+AGRUPACIONES = ('dia', 'mes', 'producto', 'iva')
+POR_PAGINA_MAX = 1000
+
+_DESCRIPCIONES = 'descripciones.txt'
+
+_lock = threading.Lock()
+_descripciones = {'codigos': {}, 'leido': 0}  # descripción -> código, bytes de descripciones.txt ya leídos
+
+
+def _reiniciar_en_hijo():
+    """El proceso hijo relee las descripciones en su primera escritura"""
+    global _lock, _descripciones
+    _lock = threading.Lock()
+    _descripciones = {'codigos': {}, 'leido': 0}
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _ruta(*partes):
+    return os.path.join(DIRECTORIO, *partes)
+
+
+def _filas(tabla):
+    """Filas completas de la tabla: las que tienen todas sus columnas escritas"""
+    filas = None
+    for columna, tipo in TABLAS[tabla].items():
+        try:
+            tamano = os.path.getsize(_ruta(tabla, columna))
+        except OSError:
+            tamano = 0
+        cantidad = tamano // np.dtype(tipo).itemsize
+        filas = cantidad if filas is None else min(filas, cantidad)
+    return filas
+
+
+def _filas_completas(tabla, facturas=None):
+    """
+    Filas completas de la tabla; para los items, sin los de facturas que no
+    alcanzaron a escribirse (los items van en orden de factura)
+    """
+    filas = _filas(tabla)
+    if facturas is not None and filas:
+        columna = np.memmap(_ruta(tabla, 'factura'), dtype=TABLAS[tabla]['factura'], mode='r', shape=(filas,))
+        filas = int(np.searchsorted(columna, facturas))
+        del columna
+    return filas
+
+
+@contextlib.contextmanager
+def _bloqueo():
+    """Bloqueo de escritura del libro, entre hilos y entre procesos"""
+    with _lock:
+        os.makedirs(_ruta('facturas'), exist_ok=True)
+        os.makedirs(_ruta('items'), exist_ok=True)
+        with open(_ruta('.bloqueo'), 'a') as archivo:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def _reparar(tabla, facturas=None):
+    """
+    Descarta las filas a medio escribir (de un proceso que murió escribiendo)
+
+    Para los items, también descarta los del final cuya factura no alcanzó a
+    escribirse (se anexan antes que su factura y en orden de factura).
+    """
+    filas = _filas_completas(tabla, facturas)
+    for columna, tipo in TABLAS[tabla].items():
+        ruta = _ruta(tabla, columna)
+        largo = filas * np.dtype(tipo).itemsize
+        if os.path.exists(ruta) and os.path.getsize(ruta) != largo:
+            os.truncate(ruta, largo)
+    return filas
+
+
+def _leer_descripciones():
+    """Lee las descripciones agregadas por otros procesos desde la última lectura"""
+    ruta = _ruta(_DESCRIPCIONES)
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(_descripciones['leido'])
+        nuevo = archivo.read()
+    completo = nuevo.rfind(b'\n') + 1
+    if completo < len(nuevo):
+        os.truncate(ruta, _descripciones['leido'] + completo)  # Línea a medio escribir
+    codigos = _descripciones['codigos']
+    for linea in nuevo[:completo].decode('utf-8').split('\n')[:-1]:
+        codigos.setdefault(linea, len(codigos))
+    _descripciones['leido'] += completo
+
+
+def _codigos_descripcion(descripciones):
+    """Código de cada descripción, agregando al archivo las nuevas"""
+    _leer_descripciones()
+    codigos = _descripciones['codigos']
+    nuevas = []
+    resultado = []
+    for descripcion in descripciones:
+        if descripcion not in codigos:
+            codigos[descripcion] = len(codigos)
+            nuevas.append(descripcion)
+        resultado.append(codigos[descripcion])
+    if nuevas:
+        contenido = ''.join(descripcion + '\n' for descripcion in nuevas).encode('utf-8')
+        with open(_ruta(_DESCRIPCIONES), 'ab') as archivo:
+            archivo.write(contenido)
+        _descripciones['leido'] += len(contenido)
+    return resultado
+
+
+def _normalizar(descripcion):
+    return ' '.join(str(descripcion or '').split())
+
+
+def _dia(fecha):
+    """Días desde 1970 de una fecha DD/MM/YYYY o YYYY-MM-DD (hoy si no se entiende)"""
+    for formato in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return (datetime.strptime(fecha, formato).date() - date(1970, 1, 1)).days
+        except (TypeError, ValueError):
+            continue
+    return (date.today() - date(1970, 1, 1)).days
+
+
+def _dia_consulta(fecha):
+    """Días desde 1970 de una fecha YYYY-MM-DD de una consulta"""
+    try:
+        return (datetime.strptime(fecha, '%Y-%m-%d').date() - date(1970, 1, 1)).days
+    except ValueError:
+        raise ValueError(f"Fecha inválida: {fecha} (formato YYYY-MM-DD)")
+
+
+def _clave(factura_no):
+    """Hash de 63 bits del número de factura"""
+    return int.from_bytes(hashlib.blake2b(str(factura_no).encode('utf-8'), digest_size=8).digest(), 'big') >> 1
+
+
+def _anexar(tabla, columnas):
+    for columna, tipo in TABLAS[tabla].items():
+        with open(_ruta(tabla, columna), 'ab') as archivo:
+            archivo.write(np.asarray(columnas[columna], dtype=tipo).tobytes())
+
+
+def registrar_ventas(facturas):
+    """
+    Anexa facturas al libro
+
+    Args:
+        facturas: Lista de diccionarios con los argumentos que recibió
+            generar_factura (fecha, factura_no e items)
+
+    Returns:
+        Cantidad de items anexados
+    """
+    if not facturas:
+        return 0
+    columnas = {'dia': [], 'clave': [], 'subtotal': [], 'iva': [], 'total': []}
+    items = {'factura': [], 'descripcion': [], 'cantidad': [], 'valor': [], 'iva': []}
+    for posicion, datos in enumerate(facturas):
+        columnas['dia'].append(_dia(datos.get('fecha')))
+        columnas['clave'].append(_clave(datos.get('factura_no')))
+        totales = calcular_totales(datos.get('items', []))
+        for campo in ('subtotal', 'iva', 'total'):
+            columnas[campo].append(a_centavos(totales[campo]))
+        for item in datos.get('items', []):
+            items['factura'].append(posicion)
+            items['descripcion'].append(_normalizar(item.get('descripcion')))
+            items['cantidad'].append(int(item['cantidad']))
+            items['valor'].append(a_centavos(item['valor_unitario']))
+            items['iva'].append(bool(item.get('tiene_iva')))
+
+    with _bloqueo():
+        primera = _reparar('facturas')
+        _reparar('items', primera)
+        items['factura'] = [primera + posicion for posicion in items['factura']]
+        items['descripcion'] = _codigos_descripcion(items['descripcion'])
+        # Primero los items: hasta que su factura está escrita no cuentan
+        _anexar('items', items)
+        _anexar('facturas', columnas)
+    return len(items['factura'])
+
+
+def registrar_venta(datos):
+    """Anexa una factura al libro (si LIBRO_VENTAS=1)"""
+    if ACTIVO:
+        registrar_ventas([datos])
+
+
+def _leer(tabla, facturas=None):
+    """
+    Columnas de la tabla como arreglos de NumPy (sólo las filas completas)
+
+    Args:
+        facturas: Para los items, cantidad de facturas escritas; los items de
+            facturas posteriores no se leen
+    """
+    filas = _filas_completas(tabla, facturas)
+    columnas = {}
+    for columna, tipo in TABLAS[tabla].items():
+        ruta = _ruta(tabla, columna)
+        columnas[columna] = np.fromfile(ruta, dtype=tipo, count=filas) if filas else np.zeros(0, dtype=tipo)
+    return columnas
+
+
+def _descripciones_leidas():
+    ruta = _ruta(_DESCRIPCIONES)
+    if not os.path.exists(ruta):
+        return []
+    with open(ruta, 'rb') as archivo:
+        return archivo.read().decode('utf-8').split('\n')[:-1]
+
+
+def _vigentes(claves):
+    """Máscara de las filas que son la última versión de su número de factura"""
+    if not claves.size:
+        return np.zeros(0, dtype=bool)
+    # np.unique da la primera aparición: se busca sobre el arreglo invertido
+    _, ultimas = np.unique(claves[::-1], return_index=True)
+    vigentes = np.zeros(claves.size, dtype=bool)
+    vigentes[claves.size - 1 - ultimas] = True
+    return vigentes
+
+
+def _sumar_por(grupos, *valores):
+    """
+    Suma los valores de cada grupo
+
+    Los grupos de este libro (días, meses, códigos de descripción) son enteros
+    en un rango corto: se cuentan con bincount sin ordenar. Las sumas con
+    bincount pasan por float64, que es exacto mientras el total quede bajo
+    2**53 centavos; si no, se ordena una vez y se suma por tramos.
+
+    Returns:
+        (grupos distintos, cantidad de filas por grupo, [sumas de cada arreglo])
+    """
+    valores = [np.asarray(valor, dtype=np.int64) for valor in valores]
+    if not grupos.size:
+        return grupos, np.zeros(0, dtype=np.int64), [np.zeros(0, dtype=np.int64) for _ in valores]
+    minimo, maximo = int(grupos.min()), int(grupos.max())
+    if maximo - minimo <= 4 * grupos.size + 1024 and all(
+            int(np.abs(valor).sum()) < 2 ** 53 for valor in valores):
+        posiciones = (grupos - minimo).astype(np.intp)
+        conteos = np.bincount(posiciones)
+        presentes = np.flatnonzero(conteos)
+        sumas = [np.rint(np.bincount(posiciones, weights=valor, minlength=conteos.size)).astype(np.int64)[presentes]
+                 for valor in valores]
+        return presentes + minimo, conteos[presentes], sumas
+
+    orden = np.argsort(grupos, kind='stable')
+    ordenados = grupos[orden]
+    inicios = np.flatnonzero(np.concatenate(([True], ordenados[1:] != ordenados[:-1])))
+    conteos = np.diff(np.append(inicios, ordenados.size))
+    sumas = [np.add.reduceat(valor[orden], inicios) for valor in valores]
+    return ordenados[inicios], conteos, sumas
+
+
+def resumen_ventas(agrupar='mes', desde=None, hasta=None, limite=100):
+    """
+    Totales de ventas agrupados por día, mes, producto o estado de IVA
+
+    Args:
+        agrupar: 'dia', 'mes', 'producto' (descripción del item) o 'iva'
+        desde, hasta: Rango de fechas de las facturas (YYYY-MM-DD, incluidas)
+        limite: Grupos que se retornan (para 'producto', los de más ventas)
+
+    Returns:
+        Diccionario con 'grupos' (montos en pesos) y los 'totales' del rango
+    """
+    if agrupar not in AGRUPACIONES:
+        raise ValueError(f"Agrupación desconocida: {agrupar} (opciones: {', '.join(AGRUPACIONES)})")
+    limite = min(max(1, int(limite)), POR_PAGINA_MAX)
+    facturas = _leer('facturas')
+    # Los items van en orden de factura: los que no tienen su factura escrita
+    # (escritura interrumpida) quedan al final y no se leen
+    items = _leer('items', facturas['clave'].size)
+
+    incluidas = _vigentes(facturas['clave'])
+    if desde:
+        incluidas &= facturas['dia'] >= _dia_consulta(desde)
+    if hasta:
+        incluidas &= facturas['dia'] <= _dia_consulta(hasta)
+    if not incluidas.all():
+        mascara = incluidas[items['factura']]
+        items = {columna: valores[mascara] for columna, valores in items.items()}
+        facturas = {columna: valores[incluidas] for columna, valores in facturas.items()}
+
+    totales = {
+        'facturas': int(facturas['clave'].size),
+        'items': int(items['factura'].size),
+        **{campo: a_pesos(int(facturas[campo].sum())) for campo in ('subtotal', 'iva', 'total')}
+    }
+
+    if agrupar in ('dia', 'mes'):
+        dias = facturas['dia']
+        if agrupar == 'mes':
+            claves = dias.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        else:
+            claves = dias.astype(np.int64)
+        claves, conteos, (subtotal, iva, total) = _sumar_por(
+            claves, facturas['subtotal'], facturas['iva'], facturas['total']
+        )
+        nombres = claves.astype('datetime64[M]' if agrupar == 'mes' else 'datetime64[D]').astype(str)
+        grupos = [
+            {agrupar: nombre, 'facturas': int(conteo), 'subtotal': a_pesos(int(s)), 'iva': a_pesos(int(i)),
+             'total': a_pesos(int(t))}
+            for nombre, conteo, s, i, t in zip(nombres[-limite:], conteos[-limite:], subtotal[-limite:],
+                                               iva[-limite:], total[-limite:])
+        ]
+        return {'agrupar': agrupar, 'grupos': grupos, 'totales': totales}
+
+    lineas = items['cantidad'] * items['valor']
+
+    if agrupar == 'producto':
+        codigos, conteos, (cantidad, ventas, base_gravable) = _sumar_por(
+            items['descripcion'], items['cantidad'], lineas, lineas * items['iva']
+        )
+        primeros = np.argsort(-ventas, kind='stable')[:limite]
+        descripciones = _descripciones_leidas()
+        grupos = [
+            {'producto': descripciones[codigos[i]] if codigos[i] < len(descripciones) else None,
+             'items': int(conteos[i]), 'cantidad': int(cantidad[i]), 'subtotal': a_pesos(int(ventas[i])),
+             'base_gravable': a_pesos(int(base_gravable[i]))}
+            for i in primeros
+        ]
+        return {'agrupar': agrupar, 'grupos': grupos, 'totales': totales}
+
+    # Por estado de IVA: el IVA se redondea por factura, así que el de los
+    # items gravados es el total de IVA de las facturas
+    estados, conteos, (cantidad, subtotal) = _sumar_por(items['iva'], items['cantidad'], lineas)
+    resultados = {int(estado): (int(conteo), int(c), int(s))
+                  for estado, conteo, c, s in zip(estados, conteos, cantidad, subtotal)}
+    grupos = []
+    for gravado in (1, 0):
+        conteo, cantidad_estado, subtotal_estado = resultados.get(gravado, (0, 0, 0))
+        grupos.append({
+            'iva': 'gravado' if gravado else 'exento',
+            'items': conteo,
+            'cantidad': cantidad_estado,
+            'subtotal': a_pesos(subtotal_estado),
+            'iva_generado': totales['iva'] if gravado else 0.0,
+        })
+    return {'agrupar': agrupar, 'grupos': grupos, 'totales': totales}
+
+
+def estadisticas():
+    """Filas y tamaño en disco del libro"""
+    tamano = 0
+    for raiz, _, archivos in os.walk(DIRECTORIO):
+        tamano += sum(os.path.getsize(os.path.join(raiz, nombre)) for nombre in archivos)
+    return {
+        'activo': ACTIVO,
+        'directorio': DIRECTORIO,
+        'facturas': _filas('facturas'),
+        'items': _filas('items'),
+        'descripciones': len(_descripciones_leidas()),
+        'bytes': tamano,
+    }
+
+
+def importar_archivo(ruta_db=None, por_tanda=1000):
+    """
+    Carga al libro las facturas de archivo_facturas (para empezar con el historial)
+
+    Returns:
+        Cantidad de facturas importadas
+    """
+    if ruta_db is None:
+        from archivo_facturas import ARCHIVO_DB as ruta_db
+    conn = sqlite3.connect(ruta_db)
+    importadas = 0
+    tanda = []
+    items_por_factura = {}
+    for factura_id, descripcion, cantidad, valor, tiene_iva in conn.execute(
+            'SELECT factura_id, descripcion, cantidad, valor_unitario, tiene_iva FROM facturas_items '
+            'ORDER BY factura_id, posicion'):
+        items_por_factura.setdefault(factura_id, []).append(
+            {'descripcion': descripcion, 'cantidad': cantidad, 'valor_unitario': valor, 'tiene_iva': bool(tiene_iva)}
+        )
+    for factura_id, factura_no, fecha in conn.execute('SELECT id, factura_no, fecha FROM facturas ORDER BY id'):
+        tanda.append({'factura_no': factura_no, 'fecha': fecha, 'items': items_por_factura.get(factura_id, [])})
+        if len(tanda) >= por_tanda:
+            registrar_ventas(tanda)
+            importadas += len(tanda)
+            tanda = []
+    registrar_ventas(tanda)
+    conn.close()
+    return importadas + len(tanda)
+
+
+def prueba(cantidad_items=1_000_000, items_por_factura=5):
+    """
+    Llena un libro temporal con items de ejemplo y mide cada reporte
+
+    Returns:
+        Lista de (agrupación, milisegundos)
+    """
+    global DIRECTORIO
+    anterior = DIRECTORIO
+    aleatorio = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directorio:
+        DIRECTORIO = directorio
+        try:
+            # Las columnas se escriben directamente: pasar un millón de items
+            # por calcular_totales tomaría más que la prueba
+            num_facturas = cantidad_items // items_por_factura
+            factura = np.repeat(np.arange(num_facturas), items_por_factura)
+            cantidad = aleatorio.integers(1, 10, factura.size)
+            valor = aleatorio.integers(1000, 2_000_000, factura.size) * 100
+            gravado = aleatorio.random(factura.size) < 0.5
+            lineas = cantidad * valor
+            subtotal = np.add.reduceat(lineas, np.arange(0, factura.size, items_por_factura))
+            base = np.add.reduceat(np.where(gravado, lineas, 0), np.arange(0, factura.size, items_por_factura))
+            iva = (base * 19 * 2 + 100) // 200
+            hoy = (date.today() - date(1970, 1, 1)).days
+            with _bloqueo():
+                _codigos_descripcion([f'Producto {i}' for i in range(500)])
+                _anexar('facturas', {
+                    'dia': np.sort(aleatorio.integers(hoy - 5 * 365, hoy, num_facturas)),
+                    'clave': np.arange(num_facturas), 'subtotal': subtotal, 'iva': iva, 'total': subtotal + iva,
+                })
+                _anexar('items', {
+                    'factura': factura, 'descripcion': aleatorio.integers(0, 500, factura.size),
+                    'cantidad': cantidad, 'valor': valor, 'iva': gravado,
+                })
+            tiempos = []
+            for agrupar in AGRUPACIONES:
+                inicio = time.perf_counter()
+                resumen_ventas(agrupar)
+                tiempos.append((agrupar, (time.perf_counter() - inicio) * 1000))
+            return tiempos
+        finally:
+            DIRECTORIO = anterior
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Libro de ventas en columnas")
+    parser.add_argument('--importar', action='store_true', help="Cargar las facturas de archivo_facturas")
+    parser.add_argument('--prueba', type=int, metavar='ITEMS', help="Medir los reportes con items de ejemplo")
+    args = parser.parse_args(argv)
+
+    if args.importar:
+        print(f"{importar_archivo()} facturas importadas a {DIRECTORIO}")
+    if args.prueba:
+        print(f"{args.prueba} items de ejemplo")
+        for agrupar, ms in prueba(args.prueba):
+            print(f"  {agrupar:10} {ms:8.1f} ms")
+    if not (args.importar or args.prueba):
+        print(estadisticas())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Facturas en bloque por HTTP: NDJSON de entrada, ZIP en streaming de salida
+
+POST /lote recibe una factura por línea (NDJSON) con los mismos campos que
+arma /generar (cliente, documento, direccion, fecha, factura_no, nit,
+telefono, correo, perfil y una lista 'items' con 'descripcion', 'cantidad',
+'valor_unitario' y 'tiene_iva'). Los totales se calculan aquí, igual que en
+el formulario, y las facturas sin factura_no reciben el siguiente número de
+la numeración automática.
+
+Las facturas se generan en paralelo en el ejecutor de trabajos_render y cada
+PDF se escribe en el ZIP de la respuesta apenas está listo, así que el
+cliente empieza a recibir bytes con la primera factura. El cuerpo se lee
+línea por línea y nunca hay más de LOTE_EN_VUELO facturas generándose a la
+vez: la memoria no depende del tamaño del lote. Las líneas con errores no
+detienen el lote; se listan al final del ZIP en errores.jsonl.
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+import zipfile
+
+import arranque
+import cache_pdf
+import numeracion
+import trabajos_render
+from archivo_facturas import archivar_factura
+from generar_lote import datos_desde_registro
+
+# Facturas que se generan a la vez (las demás esperan en el cuerpo de la petición)
+EN_VUELO = int(os.environ.get('LOTE_EN_VUELO', str(2 * trabajos_render.NUM_WORKERS)))
+
+# Bytes máximos de una línea del NDJSON
+MAX_LINEA = int(os.environ.get('LOTE_MAX_LINEA', str(1024 * 1024)))
+
+
+class _SalidaZip:
+    """Destino de zipfile que guarda lo escrito hasta que se entrega al cliente"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        """Retorna lo escrito desde la última llamada"""
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+def leer_ndjson(stream):
+    """
+    Lee una factura por línea sin cargar el cuerpo entero en memoria
+
+    Yields:
+        Tuplas (número de línea, registro, error); registro es None si la línea
+        no se pudo leer y error explica por qué
+    """
+    numero = 0
+    while True:
+        linea = stream.readline(MAX_LINEA + 1)
+        if not linea:
+            return
+        numero += 1
+        if len(linea) > MAX_LINEA:
+            # Se descarta el resto de la línea
+            while linea and not linea.endswith(b'\n'):
+                linea = stream.readline(MAX_LINEA + 1)
+            yield numero, None, f"La línea supera {MAX_LINEA} bytes"
+            continue
+        if not linea.strip():
+            continue
+        try:
+            registro = json.loads(linea)
+        except ValueError as e:
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(registro, dict):
+            yield numero, None, "Cada línea debe ser un objeto JSON"
+            continue
+        yield numero, registro, None
+
+
+def _nombre_entrada(factura_no, nombres):
+    """Nombre del PDF dentro del ZIP, sin repetir los ya usados"""
+    base = 'factura_' + re.sub(r'[^\w.-]', '_', str(factura_no))
+    nombre = f'{base}.pdf'
+    copia = 1
+    while nombre in nombres:
+        copia += 1
+        nombre = f'{base}_{copia}.pdf'
+    nombres.add(nombre)
+    return nombre
+
+
+def _terminar(futuro, numero, datos, clave, asignado, errores):
+    """
+    Toma el PDF generado, lo guarda en la caché, en el archivo y en el libro de ventas
+
+    Si el PDF falló y el número lo asignó el servidor, el número se devuelve
+    (ver numeracion.devolver_numero) para no dejar un hueco en la serie.
+
+    Returns:
+        Los bytes del PDF, o None si falló (el error queda en errores)
+    """
+    try:
+        pdf_bytes = futuro.result()
+    except Exception as e:
+        if asignado:
+            numeracion.devolver_numero(datos['factura_no'])
+        errores.append({'linea': numero, 'factura_no': None if asignado else datos['factura_no'], 'error': str(e)})
+        return None
+    cache_pdf.guardar(clave, pdf_bytes)
+    try:
+        archivar_factura(datos, pdf_bytes)
+    except Exception as e:
+        print(f"Error al archivar factura {datos['factura_no']}: {e}")
+    try:
+        arranque.importar('libro_ventas').registrar_venta(datos)
+    except Exception as e:
+        print(f"Error al registrar la venta {datos['factura_no']}: {e}")
+    return pdf_bytes
+
+
+def zip_facturas(registros, logo_path=None, empresa=None):
+    """
+    Genera las facturas en paralelo y produce el ZIP por partes
+
+    Args:
+        registros: Iterable de (número de línea, registro, error), como el
+            de leer_ndjson
+        logo_path: Ruta del logo a usar
+        empresa: Valores por defecto para nit, telefono y correo
+
+    Yields:
+        Bytes del ZIP: una parte por cada PDF terminado y al final el índice
+    """
+    salida = _SalidaZip()
+    nombres = set()
+    errores = []
+    en_curso = {}  # futuro -> (número de línea, datos, clave de caché, número asignado por el servidor)
+
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_STORED) as archivo_zip:
+        def escribir_listas(espera):
+            """Escribe las facturas terminadas, esperando hasta `espera` segundos a que termine alguna"""
+            listos, _ = concurrent.futures.wait(en_curso, timeout=espera,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+            for futuro in listos:
+                numero, datos, clave, asignado = en_curso.pop(futuro)
+                pdf_bytes = _terminar(futuro, numero, datos, clave, asignado, errores)
+                if pdf_bytes is not None:
+                    archivo_zip.writestr(_nombre_entrada(datos['factura_no'], nombres), pdf_bytes)
+                    yield salida.vaciar()
+
+        try:
+            for numero, registro, error in registros:
+                if error is None:
+                    try:
+                        if registro.get('factura_no'):
+                            numeracion.validar_numero_manual(registro['factura_no'])
+                        datos = datos_desde_registro(registro, empresa, numeracion.siguiente_numero)
+                    except Exception as e:
+                        error = str(e)
+                if error is not None:
+                    factura_no = registro.get('factura_no') if registro else None
+                    errores.append({'linea': numero, 'factura_no': factura_no, 'error': error})
+                    continue
+
+                clave = cache_pdf.clave_factura(datos, logo_path)
+                pdf_bytes = cache_pdf.obtener(clave)
+                if pdf_bytes is not None:
+                    archivo_zip.writestr(_nombre_entrada(datos['factura_no'], nombres), pdf_bytes)
+                    yield salida.vaciar()
+                else:
+                    asignado = not registro.get('factura_no')
+                    try:
+                        futuro = trabajos_render.enviar_render(datos, logo_path)
+                    except Exception:
+                        if asignado:
+                            numeracion.devolver_numero(datos['factura_no'])
+                        raise
+                    en_curso[futuro] = (numero, datos, clave, asignado)
+
+                # Se entregan las que ya terminaron y, con el máximo en curso,
+                # se espera a que termine alguna antes de leer otra línea
+                yield from escribir_listas(0)
+                while len(en_curso) >= EN_VUELO:
+                    yield from escribir_listas(None)
+
+            while en_curso:
+                yield from escribir_listas(None)
+        finally:
+            # Si el cliente se desconecta, no se generan las que aún no empezaron
+            # y las que no llegan al ZIP devuelven su número (las que ya están
+            # generándose, cuando terminen)
+            for futuro, (_, datos, _, asignado) in en_curso.items():
+                if futuro.cancel():
+                    if asignado:
+                        numeracion.devolver_numero(datos['factura_no'])
+                elif asignado:
+                    futuro.add_done_callback(
+                        lambda _, factura_no=datos['factura_no']: numeracion.devolver_numero(factura_no)
+                    )
+
+        if errores:
+            archivo_zip.writestr(
+                'errores.jsonl', ''.join(json.dumps(error, ensure_ascii=False) + '\n' for error in errores)
+            )
+    yield salida.vaciar()
@@ -2,9 +2,19 @@
 Main entry point para Railway
 """
 import os
-from app_factura import app
+import time
+
+import arranque
+
+_inicio = time.perf_counter()
+from app_factura import app, reanudar_colas
+arranque.registrar_importacion('app_factura', time.perf_counter() - _inicio)
 
 # Railway expone la app directamente
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    # Cargar logo y ReportLab según PRECALENTAR (por defecto, en segundo plano)
+    arranque.precalentar()
+    # Retomar los envíos que quedaron en cola antes del reinicio
+    reanudar_colas()
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Membrete precompilado de las facturas
+
+El logo, el título, la barra dorada y la caja de la empresa son iguales en
+todas las facturas de un mismo perfil de empresa (NIT, teléfono y correo), y
+la parte fija del pie de página es igual en todas las páginas. En lugar de
+armar y dibujar esas tablas en cada factura, se dibujan una sola vez en un
+canvas descartable y se guardan como un form XObject con el contenido ya
+comprimido. Cada factura sólo agrega ese objeto a su PDF y lo coloca con un
+operador Do; el pie se escribe una vez por PDF aunque tenga muchas páginas.
+
+El membrete se dibuja con los mismos flowables y el mismo frame que usa
+SimpleDocTemplate en generar_factura, así que la factura se ve exactamente
+igual. Cada proceso guarda hasta MEMBRETE_PERFILES perfiles (se descartan
+primero los usados hace más tiempo).
+"""
+
+import collections
+import copy
+import hashlib
+import io
+import os
+import re
+import threading
+import zlib
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.rl_accel import asciiBase85Decode
+from reportlab.pdfbase.pdfdoc import (
+    PDFArray, PDFDictionary, PDFName, PDFObject, PDFObjectReference, PDFStream, pdfdocEnc
+)
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, Frame
+
+from generar_factura import MARGENES, dibujar_pie_fijo, flowables_membrete, registrar_xobject
+from perfiles_pdf import obtener_perfil
+
+# Perfiles de empresa que se guardan por proceso
+PERFILES = int(os.environ.get('MEMBRETE_PERFILES', '32'))
+
+# Frame de SimpleDocTemplate con los márgenes de generar_factura
+ANCHO_PAGINA, ALTO_PAGINA = letter
+ANCHO_FRAME = ANCHO_PAGINA - MARGENES['leftMargin'] - MARGENES['rightMargin']
+ALTO_FRAME = ALTO_PAGINA - MARGENES['topMargin'] - MARGENES['bottomMargin']
+
+_FUENTE = re.compile(rb'(/F\d+) ')
+
+# Grupos q ... Q que no dibujan nada (platypus los deja por cada Spacer y celda vacía)
+_SIN_EFECTO = re.compile(rb'^q\n(?:[-.\d ]+ cm\n)?Q\n', re.M)
+
+_lock = threading.Lock()
+_membretes = collections.OrderedDict()  # clave del perfil -> FormularioPrecompilado, o None si no cabe
+_pie = {'formulario': None}
+
+
+def _reiniciar_en_hijo():
+    """Los formularios se comparten con el proceso padre, el lock no"""
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+class FormularioPrecompilado(PDFObject):
+    """
+    Form XObject con el contenido ya comprimido
+
+    No pertenece a ningún documento: sus fuentes e imágenes se resuelven al
+    escribir cada PDF, así que la misma instancia sirve para todas las
+    facturas (y para varios hilos a la vez, porque no se modifica).
+    """
+
+    def __init__(self, nombre, contenido, fuentes, imagenes, origen=(0, 0), alto=0):
+        self.nombre = nombre
+        self.contenido = zlib.compress(contenido, 9)
+        self.fuentes = fuentes        # nombre dentro del formulario ('/F1') -> fuente de ReportLab
+        self.imagenes = imagenes      # XObjects de imagen que dibuja el formulario
+        self.origen = origen          # punto de la página que queda en (0, 0) al colocarlo
+        self.alto = alto              # alto que ocupa en el frame (para el membrete)
+
+    def format(self, document):
+        recursos = PDFDictionary()
+        if self.fuentes:
+            recursos['Font'] = PDFDictionary({
+                local[1:]: PDFObjectReference(document.fontMapping[fuente][1:])
+                for local, fuente in self.fuentes.items()
+            })
+        if self.imagenes:
+            nombres = [document.getXObjectName(imagen.name) for imagen in self.imagenes]
+            recursos['XObject'] = PDFDictionary({nombre: PDFObjectReference(nombre) for nombre in nombres})
+        diccionario = PDFDictionary({
+            'Type': PDFName('XObject'),
+            'Subtype': PDFName('Form'),
+            'BBox': PDFArray([0, 0, ANCHO_PAGINA, ALTO_PAGINA]),
+            'Resources': recursos,
+            'Filter': PDFArray([PDFName('FlateDecode')]),
+        })
+        return PDFStream(diccionario, self.contenido).format(document)
+
+
+def _compilar(dibujar):
+    """
+    Dibuja en un canvas descartable y guarda lo dibujado como formulario
+
+    Args:
+        dibujar: Función que recibe el canvas; puede retornar None para
+            indicar que no se pudo dibujar
+
+    Returns:
+        (código del canvas en bytes, fuentes, imágenes, resultado de dibujar)
+    """
+    canv = canvas.Canvas(io.BytesIO(), pagesize=letter)
+    resultado = dibujar(canv)
+    doc = canv._doc
+    contenido = pdfdocEnc('\n'.join(canv._code) + '\n')
+    largo = None
+    while largo != len(contenido):
+        largo = len(contenido)
+        contenido = _SIN_EFECTO.sub(b'', contenido)
+    usadas = {nombre.decode() for nombre in _FUENTE.findall(contenido)}
+    fuentes = {interno: fuente for fuente, interno in doc.fontMapping.items() if interno in usadas}
+    imagenes = []
+    for forma in dict.fromkeys(canv._formsinuse):
+        # Se copia sin el nombre con que quedó registrada en el documento descartable
+        imagen = copy.copy(doc.idToObject[doc.getXObjectName(forma)])
+        vars(imagen).pop('__InternalName__', None)
+        imagenes.append(_en_binario(imagen))
+    return contenido, fuentes, imagenes, resultado
+
+
+def _en_binario(imagen):
+    """
+    Quita la codificación ASCII85 de una imagen
+
+    ReportLab guarda las imágenes en ASCII85, que las agranda un 25%. Como la
+    imagen del membrete se decodifica una sola vez, se guarda en binario.
+    """
+    filtros = list(getattr(imagen, '_filters', ()))
+    if filtros[:1] != ['ASCII85Decode']:
+        return imagen
+    contenido = imagen.streamContent
+    if isinstance(contenido, str):
+        contenido = contenido.encode('latin-1')
+    imagen.streamContent = asciiBase85Decode(contenido)
+    imagen._filters = tuple(filtros[1:])
+    return imagen
+
+
+def colocar(canv, formulario, x=0, y=0):
+    """Agrega el formulario al documento del canvas (una vez) y lo dibuja en (x, y)"""
+    doc = canv._doc
+    nombre_registro = doc.getXObjectName(formulario.nombre)
+    if not doc.idToObject.get(nombre_registro):
+        for fuente in formulario.fuentes.values():
+            doc.getInternalFontName(fuente)
+        for imagen in formulario.imagenes:
+            registrar_xobject(canv, imagen)
+        # ReportLab anota en el objeto el nombre con que lo registra: cada
+        # documento recibe su propia copia (el contenido comprimido se comparte)
+        doc.Reference(copy.copy(formulario), nombre_registro)
+    if formulario.imagenes:
+        canv._currentPageHasImages = 1
+    if x or y:
+        canv.saveState()
+        canv.translate(x, y)
+        canv._code.append(f"/{nombre_registro} Do")
+        canv.restoreState()
+    else:
+        canv._code.append(f"/{nombre_registro} Do")
+    canv._formsinuse.append(formulario.nombre)
+
+
+def formulario_pie():
+    """Parte fija del pie de página, compilada la primera vez que se usa"""
+    formulario = _pie['formulario']
+    if formulario is None:
+        contenido, fuentes, imagenes, _ = _compilar(dibujar_pie_fijo)
+        formulario = _pie['formulario'] = FormularioPrecompilado('PieFactura', contenido, fuentes, imagenes)
+    return formulario
+
+
+def _dibujar_membrete(logo_path, nit, telefono, correo, perfil):
+    def dibujar(canv):
+        frame = Frame(
+            MARGENES['leftMargin'], MARGENES['bottomMargin'], ANCHO_FRAME, ALTO_FRAME
+        )
+        tope = frame._y
+        flowables = flowables_membrete(logo_path, nit, telefono, correo, perfil)
+        frame.addFromList(flowables, canv)
+        if flowables:
+            return None  # No cabe en la primera página: se arma con platypus
+        return (frame._x, frame._y), tope - frame._y
+    return dibujar
+
+
+def _perfil(logo_path, nit, telefono, correo, perfil):
+    """
+    Clave del membrete: si el logo cambia en disco, cambia la clave
+
+    Los perfiles de PDF que guardan el logo igual comparten el membrete.
+    """
+    logo = None
+    if logo_path:
+        try:
+            info = os.stat(logo_path)
+            logo = (logo_path, info.st_mtime_ns, info.st_size)
+        except OSError:
+            logo = (logo_path, None, None)
+    configuracion = obtener_perfil(perfil)
+    return (logo, nit, telefono, correo, configuracion['logo_ppp'], configuracion['calidad_jpeg'])
+
+
+def obtener_membrete(logo_path=None, nit="", telefono="", correo="", perfil=None):
+    """
+    Retorna el membrete precompilado del perfil de empresa
+
+    Args:
+        perfil: Perfil de salida del PDF, que decide la resolución del logo
+            (ver perfiles_pdf)
+
+    Returns:
+        El FormularioPrecompilado, o None si el membrete no cabe en una página
+        o el logo tiene transparencia (en ese caso la factura lo arma con
+        flowables_membrete)
+    """
+    clave = _perfil(logo_path, nit, telefono, correo, perfil)
+    with _lock:
+        if clave in _membretes:
+            _membretes.move_to_end(clave)
+            return _membretes[clave]
+
+    # Se compila fuera del lock; si dos hilos compilan el mismo perfil, queda uno
+    nombre = 'Membrete' + hashlib.md5(repr(clave).encode('utf-8')).hexdigest()
+    contenido, fuentes, imagenes, resultado = _compilar(_dibujar_membrete(logo_path, nit, telefono, correo, perfil))
+    membrete = None
+    # Un logo con transparencia trae su máscara como otro objeto del documento
+    # descartable: ese membrete se sigue armando con flowables
+    if resultado is not None and not any(getattr(imagen, 'smask', None) for imagen in imagenes):
+        origen, alto = resultado
+        membrete = FormularioPrecompilado(nombre, contenido, fuentes, imagenes, origen, alto)
+
+    with _lock:
+        _membretes[clave] = membrete
+        _membretes.move_to_end(clave)
+        while len(_membretes) > PERFILES:
+            _membretes.popitem(last=False)
+    return membrete
+
+
+def limpiar_cache():
+    """Olvida los membretes y el pie compilados"""
+    with _lock:
+        _membretes.clear()
+    _pie['formulario'] = None
+
+
+class MembreteFlowable(Flowable):
+    """Coloca el membrete precompilado al comienzo de la historia de platypus"""
+
+    def __init__(self, membrete):
+        Flowable.__init__(self)
+        self.membrete = membrete
+        self.height = membrete.alto
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        return self.width, self.height
+
+    def draw(self):
+        # El membrete se compiló con coordenadas de página: se deshace la
+        # traslación de drawOn a partir del punto donde lo dejó el frame
+        x, y = self.membrete.origen
+        colocar(self.canv, self.membrete, -x, -y)
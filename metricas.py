@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Tiempos por etapa de la generación de facturas
+
+Cada etapa (lectura del formulario, totales, logo, armado de la historia,
+doc.build, lectura del PDF, base64, POST a n8n...) se mide con medir() y
+se acumula en un histograma por etapa. GET /metrics los exporta en formato
+de texto de Prometheus y cada respuesta lleva un encabezado Server-Timing
+con las etapas de esa petición.
+
+Medir una etapa cuesta un perf_counter y un lock sin contención, así que
+queda activo en producción. Con Gunicorn cada worker es un proceso: cada
+uno vuelca sus histogramas en METRICAS_DIR (a lo sumo cada
+METRICAS_INTERVALO segundos) y /metrics suma los de todos los procesos.
+"""
+
+import bisect
+import contextlib
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Configuración por variables de entorno
+DIRECTORIO = os.environ.get('METRICAS_DIR', 'metricas')
+INTERVALO = float(os.environ.get('METRICAS_INTERVALO', '5'))
+
+# Límites de los buckets de los histogramas, en segundos
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ETAPAS = 'factura_etapa_segundos'
+PETICIONES = 'factura_peticion_segundos'
+
+_lock = threading.Lock()
+_local = threading.local()
+_histogramas = {}  # (métrica, etiqueta, valor) -> [conteo por bucket..., +Inf, suma]
+_estado = {'ultimo_volcado': 0.0}
+
+
+def _reiniciar_en_hijo():
+    """Un worker creado con fork no debe volver a contar lo medido en el proceso padre"""
+    global _lock
+    _lock = threading.Lock()
+    _histogramas.clear()
+    _estado['ultimo_volcado'] = 0.0
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _observar(clave, segundos):
+    indice = bisect.bisect_left(BUCKETS, segundos)
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histograma[indice] += 1
+        histograma[-1] += segundos
+
+
+def registrar(etapa, segundos):
+    """
+    Acumula la duración de una etapa
+
+    Si el hilo está atendiendo una petición, la etapa se agrega también a su
+    encabezado Server-Timing.
+    """
+    _observar((ETAPAS, 'etapa', etapa), segundos)
+    tiempos = getattr(_local, 'tiempos', None)
+    if tiempos is not None:
+        tiempos[etapa] = tiempos.get(etapa, 0.0) + segundos
+    _volcar_si_corresponde()
+
+
+@contextlib.contextmanager
+def medir(etapa):
+    """Mide el bloque como la etapa indicada"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(etapa, time.perf_counter() - inicio)
+
+
+def iniciar_peticion():
+    """Empieza a acumular las etapas de la petición que atiende este hilo"""
+    _local.tiempos = {}
+    _local.inicio = time.perf_counter()
+
+
+def terminar_peticion(ruta):
+    """
+    Registra la duración de la petición y deja de acumular sus etapas
+
+    Args:
+        ruta: Regla de la ruta de Flask (por ejemplo '/generar')
+
+    Returns:
+        Valor del encabezado Server-Timing (duraciones en milisegundos)
+    """
+    tiempos = getattr(_local, 'tiempos', None)
+    if tiempos is None:
+        return None
+    total = time.perf_counter() - _local.inicio
+    _local.tiempos = None
+    _observar((PETICIONES, 'ruta', ruta), total)
+    _volcar_si_corresponde()
+    partes = [f'{etapa};dur={segundos * 1000:.2f}' for etapa, segundos in tiempos.items()]
+    partes.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(partes)
+
+
+def _ruta_volcado(pid=None):
+    return os.path.join(DIRECTORIO, f'metricas_{pid or os.getpid()}.json')
+
+
+def _volcar_si_corresponde():
+    if DIRECTORIO and time.monotonic() - _estado['ultimo_volcado'] >= INTERVALO:
+        volcar()
+
+
+def volcar():
+    """Escribe los histogramas de este proceso en METRICAS_DIR (de forma atómica)"""
+    _estado['ultimo_volcado'] = time.monotonic()
+    with _lock:
+        contenido = [[list(clave), valores[:]] for clave, valores in _histogramas.items()]
+    try:
+        os.makedirs(DIRECTORIO, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(contenido, f)
+        os.replace(temporal, _ruta_volcado())
+    except OSError as e:
+        print(f"Error al volcar métricas: {e}")
+
+
+def limpiar_directorio():
+    """Borra los volcados de ejecuciones anteriores (se llama al arrancar el servidor)"""
+    for ruta in glob.glob(os.path.join(DIRECTORIO, 'metricas_*.json')):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _sumar_procesos():
+    """Histogramas de este proceso más los volcados de los demás procesos"""
+    with _lock:
+        total = {clave: valores[:] for clave, valores in _histogramas.items()}
+    if not DIRECTORIO:
+        return total
+    propio = _ruta_volcado()
+    for ruta in glob.glob(os.path.join(DIRECTORIO, 'metricas_*.json')):
+        if ruta == propio:
+            continue
+        try:
+            with open(ruta) as f:
+                contenido = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for clave, valores in contenido:
+            clave = tuple(clave)
+            acumulado = total.setdefault(clave, [0] * len(valores))
+            for i, valor in enumerate(valores):
+                acumulado[i] += valor
+    return total
+
+
+def exportar_prometheus():
+    """Histogramas de todos los procesos en formato de texto de Prometheus"""
+    ayudas = {
+        ETAPAS: 'Duración de cada etapa de la generación de facturas',
+        PETICIONES: 'Duración de las peticiones HTTP por ruta',
+    }
+    histogramas = _sumar_procesos()
+    lineas = []
+    for metrica in (ETAPAS, PETICIONES):
+        lineas.append(f'# HELP {metrica} {ayudas[metrica]}')
+        lineas.append(f'# TYPE {metrica} histogram')
+        for clave in sorted(c for c in histogramas if c[0] == metrica):
+            _, etiqueta, valor = clave
+            valores = histogramas[clave]
+            acumulado = 0
+            for limite, conteo in zip(BUCKETS + ('+Inf',), valores[:-1]):
+                acumulado += conteo
+                lineas.append(f'{metrica}_bucket{{{etiqueta}="{valor}",le="{limite}"}} {acumulado}')
+            lineas.append(f'{metrica}_sum{{{etiqueta}="{valor}"}} {valores[-1]:.6f}')
+            lineas.append(f'{metrica}_count{{{etiqueta}="{valor}"}} {acumulado}')
+    return '\n'.join(lineas) + '\n'
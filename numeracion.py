@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Numeración automática de facturas
+
+Los números se asignan en el servidor desde un contador en SQLite (modo
+WAL), compartido por todos los workers de Gunicorn. Para que los workers no
+compitan por el contador en cada factura, cada proceso reserva un bloque de
+NUMERACION_BLOQUE números en una sola transacción y los reparte desde
+memoria; sólo vuelve a la base cuando se le acaba el bloque.
+
+Cada número se entrega una sola vez. Los números de un bloque no se usan en
+orden global (dos workers reparten bloques distintos a la vez). Los que no
+llegan a usarse (el PDF falló, o el proceso cerró con parte del bloque sin
+repartir) se devuelven: vuelven al contador o, si otro proceso ya reservó
+después, quedan en la tabla 'libres', de donde se toman antes que los
+números nuevos. Sólo un proceso que muere sin cerrarse (SIGKILL, o el
+timeout de Gunicorn) deja como hueco lo que le quedaba del bloque: hasta
+NUMERACION_BLOQUE - 1 números por cada worker que muera así.
+
+El formato se configura con NUMERACION_PREFIJO y NUMERACION_FORMATO (campos
+{prefijo}, {numero} y {anio}); cada prefijo lleva su propio contador y, si
+el formato incluye {anio}, cada año empieza su propia serie. Los números
+escritos a mano no pueden tener el formato de la serie automática
+(validar_numero_manual): chocarían con uno que el servidor entregue después.
+
+Prueba de estrés (varios procesos con varios hilos pidiendo y devolviendo
+números a la vez; termina con código 1 si algún número se repite o queda
+como hueco):
+    python numeracion.py --procesos 4 --hilos 8 --numeros 500
+"""
+
+import argparse
+import atexit
+import contextlib
+import functools
+import multiprocessing
+import os
+import re
+import sqlite3
+import string
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Configuración por variables de entorno
+NUMERACION_DB = os.environ.get('NUMERACION_DB', 'numeracion.db')
+PREFIJO = os.environ.get('NUMERACION_PREFIJO', 'FV-')
+FORMATO = os.environ.get('NUMERACION_FORMATO', '{prefijo}{numero:06d}')
+INICIO = int(os.environ.get('NUMERACION_INICIO', '1'))
+BLOQUE = int(os.environ.get('NUMERACION_BLOQUE', '20'))
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    prefijo TEXT PRIMARY KEY,
+    siguiente INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS libres (
+    prefijo TEXT NOT NULL,
+    desde INTEGER NOT NULL,
+    hasta INTEGER NOT NULL,
+    PRIMARY KEY (prefijo, desde)
+);
+"""
+
+# Con {anio} en el formato, cada año lleva su propio contador
+POR_ANIO = any(campo == 'anio' for _, campo, _, _ in string.Formatter().parse(FORMATO))
+
+_local = threading.local()
+_lock = threading.Lock()
+_bloques = {}  # serie -> [siguiente, fin) reservado por este proceso
+
+
+def _reiniciar_en_hijo():
+    """El proceso hijo no hereda el bloque del padre (se repetirían números)"""
+    global _local, _lock, _bloques
+    _local = threading.local()
+    _lock = threading.Lock()
+    _bloques = {}
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _conexion():
+    """Retorna la conexión del hilo actual, creándola si no existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(NUMERACION_DB, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_ESQUEMA)
+        _local.conn = conn
+    return conn
+
+
+@contextlib.contextmanager
+def _transaccion(conn):
+    """Ejecuta un bloque dentro de una transacción con bloqueo de escritura"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _serie(prefijo, anio):
+    """Clave del contador en la base: el prefijo, más el año si el formato lo usa"""
+    return f'{prefijo}{anio}' if POR_ANIO else prefijo
+
+
+def _reservar_bloque(serie, cantidad):
+    """
+    Reserva números de la serie en la base compartida
+
+    Primero toma los números devueltos (tabla libres); si no hay, los
+    siguientes del contador.
+    """
+    conn = _conexion()
+    with _transaccion(conn):
+        libre = conn.execute(
+            'SELECT desde, hasta FROM libres WHERE prefijo = ? ORDER BY desde LIMIT 1', (serie,)
+        ).fetchone()
+        if libre:
+            desde, hasta = libre
+            fin = min(hasta, desde + cantidad)
+            if fin == hasta:
+                conn.execute('DELETE FROM libres WHERE prefijo = ? AND desde = ?', (serie, desde))
+            else:
+                conn.execute('UPDATE libres SET desde = ? WHERE prefijo = ? AND desde = ?', (fin, serie, desde))
+            return [desde, fin]
+        fila = conn.execute('SELECT siguiente FROM series WHERE prefijo = ?', (serie,)).fetchone()
+        if fila is None and POR_ANIO and serie.endswith(str(datetime.now().year)):
+            # Contador de cuando la serie no se separaba por año: el año en
+            # curso sigue desde ahí para no repetir números ya entregados
+            fila = conn.execute('SELECT siguiente FROM series WHERE prefijo = ?', (serie[:-4],)).fetchone()
+        inicio = fila[0] if fila else INICIO
+        conn.execute(
+            'INSERT OR REPLACE INTO series (prefijo, siguiente) VALUES (?, ?)', (serie, inicio + cantidad)
+        )
+    return [inicio, inicio + cantidad]
+
+
+def _liberar(conn, serie, desde, hasta):
+    """Devuelve los números [desde, hasta) al contador, o a la tabla libres si otro proceso reservó después"""
+    with _transaccion(conn):
+        cursor = conn.execute(
+            'UPDATE series SET siguiente = ? WHERE prefijo = ? AND siguiente = ?', (desde, serie, hasta)
+        )
+        if cursor.rowcount == 0:
+            conn.execute('INSERT OR IGNORE INTO libres (prefijo, desde, hasta) VALUES (?, ?, ?)', (serie, desde, hasta))
+
+
+def _siguiente(serie):
+    """Siguiente número de la serie, del bloque de este proceso"""
+    with _lock:
+        bloque = _bloques.get(serie)
+        if bloque is None or bloque[0] >= bloque[1]:
+            bloque = _bloques[serie] = _reservar_bloque(serie, BLOQUE)
+        numero = bloque[0]
+        bloque[0] += 1
+    return numero
+
+
+def _devolver(serie, numero):
+    """Devuelve un número entregado que no se usó"""
+    with _lock:
+        bloque = _bloques.get(serie)
+        if bloque is not None and bloque[0] == numero + 1:
+            # Es el último que entregó este proceso: vuelve al bloque
+            bloque[0] = numero
+            return
+        _liberar(_conexion(), serie, numero, numero + 1)
+
+
+def siguiente_consecutivo(prefijo=None, anio=None):
+    """
+    Retorna el siguiente número (entero) del prefijo
+
+    Sólo la primera llamada de cada bloque consulta la base; las demás se
+    resuelven en memoria.
+    """
+    prefijo = PREFIJO if prefijo is None else prefijo
+    anio = datetime.now().year if anio is None else anio
+    return _siguiente(_serie(prefijo, anio))
+
+
+def siguiente_numero(prefijo=None):
+    """Retorna el siguiente número de factura con el formato de NUMERACION_FORMATO"""
+    prefijo = PREFIJO if prefijo is None else prefijo
+    anio = datetime.now().year
+    return FORMATO.format(prefijo=prefijo, numero=siguiente_consecutivo(prefijo, anio), anio=anio)
+
+
+def devolver_numero(factura_no, prefijo=None):
+    """
+    Devuelve un número que no llegó a usarse (por ejemplo, si falló el PDF)
+
+    Si es el último que entregó este proceso vuelve a su bloque; si no, queda
+    en la tabla libres y se entrega antes que los números nuevos. El año se
+    toma del propio número, así que uno del 31/12 se puede devolver el 01/01.
+
+    Returns:
+        True si el número vuelve a estar disponible
+    """
+    prefijo = PREFIJO if prefijo is None else prefijo
+    partes = _patron_serie(prefijo).fullmatch(str(factura_no))
+    if partes is None:
+        return False
+    anio = int(partes.group('anio')) if POR_ANIO else None
+    _devolver(_serie(prefijo, anio), int(partes.group('numero')))
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _patron_serie(prefijo):
+    """Expresión regular que reconoce los números con el formato de la serie automática"""
+    partes = []
+    grupos = set()
+    for literal, campo, _, _ in string.Formatter().parse(FORMATO):
+        partes.append(re.escape(literal))
+        if campo == 'prefijo':
+            partes.append(re.escape(prefijo))
+        elif campo == 'numero' and 'numero' not in grupos:
+            partes.append(r'(?P<numero>\d+)')
+            grupos.add(campo)
+        elif campo == 'anio' and 'anio' not in grupos:
+            partes.append(r'(?P<anio>\d{4})')
+            grupos.add(campo)
+        elif campo == 'numero':
+            partes.append(r'\d+')
+        elif campo == 'anio':
+            partes.append(r'\d{4}')
+        elif campo is not None:
+            partes.append('.*?')
+    return re.compile(''.join(partes), re.IGNORECASE)
+
+
+def validar_numero_manual(factura_no, prefijo=None):
+    """
+    Verifica que un número escrito a mano no pertenezca a la serie automática
+
+    Raises:
+        ValueError: si el número tiene el formato que asigna el servidor
+    """
+    prefijo = PREFIJO if prefijo is None else prefijo
+    if _patron_serie(prefijo).fullmatch(str(factura_no).strip()):
+        raise ValueError(
+            f"El número {factura_no} pertenece a la numeración automática ({prefijo}); "
+            f"deja el número vacío para que lo asigne el servidor"
+        )
+
+
+def devolver_bloques():
+    """
+    Devuelve los números reservados que este proceso no usó
+
+    Vuelven al contador si ningún otro proceso reservó un bloque después; si
+    no, quedan en la tabla libres. Se llama al terminar el proceso (atexit y
+    el hook worker_exit de Gunicorn).
+    """
+    with _lock:
+        if not _bloques:
+            return
+        conn = _conexion()
+        for serie, (siguiente, fin) in _bloques.items():
+            if siguiente < fin:
+                _liberar(conn, serie, siguiente, fin)
+        _bloques.clear()
+
+
+atexit.register(devolver_bloques)
+
+
+def estadisticas():
+    """Siguiente número por reservar de cada serie, números devueltos por reutilizar y bloques de este proceso"""
+    conn = _conexion()
+    series = dict(conn.execute('SELECT prefijo, siguiente FROM series').fetchall())
+    libres = dict(conn.execute('SELECT prefijo, SUM(hasta - desde) FROM libres GROUP BY prefijo').fetchall())
+    with _lock:
+        bloques = {serie: {'siguiente': siguiente, 'disponibles': fin - siguiente}
+                   for serie, (siguiente, fin) in _bloques.items()}
+    return {
+        'prefijo': PREFIJO,
+        'formato': FORMATO,
+        'bloque': BLOQUE,
+        'series': series,
+        'libres': libres,
+        'bloques_proceso': bloques
+    }
+
+
+def _estres_proceso(hilos, por_hilo, barrera, resultados):
+    """
+    Pide números desde varios hilos de un proceso de la prueba de estrés
+
+    Todos los procesos empiezan a la vez (después de la barrera) y dejan en
+    la cola de resultados una tupla (números obtenidos, segundos que
+    tardaron sus hilos). Uno de cada diez números se devuelve sin usar.
+    """
+    numeros = [[] for _ in range(hilos)]
+    serie = _serie(PREFIJO, datetime.now().year)
+
+    def pedir(lista):
+        for i in range(por_hilo):
+            numero = siguiente_consecutivo()
+            if i % 10 == 9:
+                # Como una factura cuyo PDF falló: el número se devuelve
+                _devolver(serie, numero)
+            else:
+                lista.append(numero)
+
+    trabajadores = [threading.Thread(target=pedir, args=(lista,)) for lista in numeros]
+    barrera.wait(timeout=60)
+    inicio = time.perf_counter()
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    devolver_bloques()
+    resultados.put(([numero for lista in numeros for numero in lista], duracion))
+
+
+def prueba_estres(procesos=4, hilos=8, por_hilo=500, bloque=BLOQUE):
+    """
+    Pide números desde varios procesos y hilos a la vez sobre una base nueva
+
+    Returns:
+        Diccionario con los números usados, los repetidos, los huecos (ni
+        usados ni en la tabla libres), el siguiente número que quedó en la
+        base y los segundos que tardó el proceso más lento (sin contar su
+        arranque)
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'numeracion_estres.db')
+        # Los procesos de la prueba leen la configuración al importar el módulo
+        entorno = {'NUMERACION_DB': ruta, 'NUMERACION_BLOQUE': str(bloque), 'NUMERACION_PREFIJO': PREFIJO}
+        anterior = {clave: os.environ.get(clave) for clave in entorno}
+        os.environ.update(entorno)
+        try:
+            contexto = multiprocessing.get_context('spawn')
+            barrera = contexto.Barrier(procesos)
+            cola = contexto.Queue()
+            trabajadores = [
+                contexto.Process(target=_estres_proceso, args=(hilos, por_hilo, barrera, cola))
+                for _ in range(procesos)
+            ]
+            for proceso in trabajadores:
+                proceso.start()
+            resultados = [cola.get(timeout=120) for _ in trabajadores]
+            for proceso in trabajadores:
+                proceso.join()
+        finally:
+            for clave, valor in anterior.items():
+                if valor is None:
+                    os.environ.pop(clave, None)
+                else:
+                    os.environ[clave] = valor
+        serie = _serie(PREFIJO, datetime.now().year)
+        conn = sqlite3.connect(ruta)
+        siguiente = conn.execute('SELECT siguiente FROM series WHERE prefijo = ?', (serie,)).fetchone()[0]
+        libres = {numero for desde, hasta in conn.execute('SELECT desde, hasta FROM libres WHERE prefijo = ?', (serie,))
+                  for numero in range(desde, hasta)}
+        conn.close()
+
+    numeros = [numero for resultado, _ in resultados for numero in resultado]
+    unicos = set(numeros)
+    return {
+        'pedidos': len(numeros),
+        'repetidos': len(numeros) - len(unicos),
+        'huecos': len(set(range(INICIO, siguiente)) - unicos - libres),
+        'siguiente': siguiente,
+        'segundos': max(duracion for _, duracion in resultados),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de estrés de la numeración de facturas")
+    parser.add_argument('--procesos', type=int, default=4, help="Procesos que piden números a la vez")
+    parser.add_argument('--hilos', type=int, default=8, help="Hilos por proceso")
+    parser.add_argument('--numeros', type=int, default=500, help="Números que pide cada hilo")
+    args = parser.parse_args(argv)
+
+    print(f"{args.procesos} procesos x {args.hilos} hilos x {args.numeros} números")
+    print(f"{'Bloque':>8} {'Pedidos':>9} {'Repetidos':>10} {'Huecos':>8} {'Números/s':>11}")
+    repetidos = huecos = 0
+    # Con bloque 1 cada número pasa por la base: es el contador con bloqueo, como referencia
+    for bloque in dict.fromkeys((BLOQUE, 1)):
+        resultado = prueba_estres(args.procesos, args.hilos, args.numeros, bloque)
+        repetidos += resultado['repetidos']
+        huecos += resultado['huecos']
+        print(f"{bloque:8d} {resultado['pedidos']:9d} {resultado['repetidos']:10d} {resultado['huecos']:8d} "
+              f"{resultado['pedidos'] / resultado['segundos']:11.0f}")
+    if repetidos:
+        print("\n✗ Se entregaron números repetidos")
+    if huecos:
+        print("\n✗ Quedaron números sin usar que no se devolvieron")
+    if repetidos or huecos:
+        return 1
+    print("\n✓ Ningún número se entregó dos veces ni quedó como hueco")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Perfilado bajo demanda de la generación de facturas
+
+Cuando una factura tarda de más en producción, el perfilador corre cProfile
+y tracemalloc alrededor de las siguientes llamadas a generar_factura y
+guarda lo medido en PERFILADOR_DIR: un .prof de cProfile (se abre con
+pstats o snakeviz) y un .json con la duración, el pico de memoria y las
+líneas que más memoria dejaron asignada. El directorio guarda a lo sumo
+PERFILADOR_MAX perfiles; se borran primero los más viejos.
+
+Se activa de dos formas:
+
+- PERFILADOR_LLAMADAS=N perfila las primeras N llamadas de cada proceso y
+  PERFILADOR_MUESTREO=N una de cada N llamadas.
+- POST /perfilador con {"llamadas": N} perfila las siguientes N llamadas de
+  cualquier worker (el pedido queda en PERFILADOR_DIR, compartido por todos
+  los procesos) y con {"muestreo": N} cambia el muestreo de todos los
+  workers ({"muestreo": 0} lo apaga).
+
+GET /perfilador/resumen suma los perfiles guardados y lista las funciones
+con más tiempo acumulado y las líneas con más memoria asignada. Mientras no
+hay pedido, cada llamada sólo consulta la fecha de modificación del pedido.
+
+Perfilar localmente unas facturas e imprimir el resumen:
+    python perfilador.py --facturas 10 --items 200
+"""
+
+import argparse
+import contextlib
+import cProfile
+import fcntl
+import functools
+import glob
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Configuración por variables de entorno
+DIRECTORIO = os.environ.get('PERFILADOR_DIR', 'perfiles')
+MAX_PERFILES = int(os.environ.get('PERFILADOR_MAX', '50'))
+LLAMADAS = int(os.environ.get('PERFILADOR_LLAMADAS', '0'))
+MUESTREO = int(os.environ.get('PERFILADOR_MUESTREO', '0'))
+
+# Líneas con más memoria asignada que se guardan de cada perfil
+LINEAS_MEMORIA = 50
+
+_PEDIDO = 'pedido.json'
+
+_lock = threading.Lock()
+_ocupado = threading.Lock()  # Un perfil a la vez por proceso (tracemalloc es global)
+# 'contador' numera las llamadas (para el muestreo) y 'perfiles' los archivos
+# guardados; si compartieran contador, guardar un perfil corría el muestreo
+_estado = {'llamadas': LLAMADAS, 'contador': itertools.count(1), 'perfiles': itertools.count(1),
+           'pedido': {}, 'fecha_pedido': None}
+
+
+def _reiniciar_en_hijo():
+    """Cada worker cuenta sus propias llamadas"""
+    global _lock, _ocupado
+    _lock = threading.Lock()
+    _ocupado = threading.Lock()
+    _estado.update(llamadas=LLAMADAS, contador=itertools.count(1), perfiles=itertools.count(1),
+                   pedido={}, fecha_pedido=None)
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def _ruta(nombre):
+    return os.path.join(DIRECTORIO, nombre)
+
+
+@contextlib.contextmanager
+def _bloqueo_pedido():
+    """Bloqueo del pedido compartido entre procesos"""
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    with open(_ruta('.bloqueo'), 'a') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def _leer_pedido():
+    try:
+        with open(_ruta(_PEDIDO)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _escribir_pedido(pedido):
+    fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(pedido, f)
+    os.replace(temporal, _ruta(_PEDIDO))
+
+
+def _pedido_actual():
+    """Pedido compartido; sólo se relee si el archivo cambió"""
+    try:
+        fecha = os.stat(_ruta(_PEDIDO)).st_mtime_ns
+    except OSError:
+        fecha = None
+    if fecha != _estado['fecha_pedido']:
+        _estado['pedido'] = _leer_pedido() if fecha is not None else {}
+        _estado['fecha_pedido'] = fecha
+    return _estado['pedido']
+
+
+def _tomar_llamada_pedida():
+    """Descuenta una llamada del pedido compartido; False si otro proceso ya las tomó"""
+    with _bloqueo_pedido():
+        pedido = _leer_pedido()
+        if pedido.get('llamadas', 0) <= 0:
+            return False
+        pedido['llamadas'] -= 1
+        _escribir_pedido(pedido)
+        return True
+
+
+def _corresponde():
+    """Decide si la llamada actual se perfila"""
+    numero = next(_estado['contador'])
+    with _lock:
+        if _estado['llamadas'] > 0:
+            _estado['llamadas'] -= 1
+            return True
+    pedido = _pedido_actual()
+    if pedido.get('llamadas', 0) > 0 and _tomar_llamada_pedida():
+        return True
+    muestreo = pedido.get('muestreo', MUESTREO)
+    return bool(muestreo) and numero % muestreo == 0
+
+
+def pedir(llamadas=None, muestreo=None):
+    """
+    Pide perfilar las siguientes llamadas de todos los workers
+
+    Args:
+        llamadas: Cuántas de las siguientes llamadas se perfilan (entre todos)
+        muestreo: Perfilar una de cada N llamadas en cada worker (0 lo apaga)
+
+    Returns:
+        El pedido que quedó guardado
+    """
+    for nombre, valor in (('llamadas', llamadas), ('muestreo', muestreo)):
+        if valor is not None and (not isinstance(valor, int) or valor < 0):
+            raise ValueError(f"'{nombre}' debe ser un entero mayor o igual a 0")
+    with _bloqueo_pedido():
+        pedido = _leer_pedido()
+        if llamadas is not None:
+            pedido['llamadas'] = llamadas
+        if muestreo is not None:
+            pedido['muestreo'] = muestreo
+        _escribir_pedido(pedido)
+    return pedido
+
+
+def _memoria(instantanea, limite):
+    """Líneas con más memoria asignada (sin contar la del propio perfilador)"""
+    instantanea = instantanea.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    return [
+        {'lugar': f'{_corto(estadistica.traceback[0].filename)}:{estadistica.traceback[0].lineno}',
+         'bytes': estadistica.size, 'bloques': estadistica.count}
+        for estadistica in instantanea.statistics('lineno')[:limite]
+    ]
+
+
+def _guardar(nombre, perfil, detalle):
+    """Escribe el .prof y el .json del perfil y borra los más viejos"""
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    base = _ruta(f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{nombre}-{next(_estado['perfiles'])}")
+    perfil.dump_stats(base + '.prof')
+    fd, temporal = tempfile.mkstemp(dir=DIRECTORIO, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(detalle, f, ensure_ascii=False)
+    os.replace(temporal, base + '.json')
+
+    guardados = sorted(glob.glob(_ruta('*.prof')), key=os.path.getmtime)
+    for ruta in guardados[:max(0, len(guardados) - MAX_PERFILES)]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(ruta[:-len('.prof')] + extension)
+            except OSError:
+                pass
+
+
+def perfilado(nombre, detalle=None):
+    """
+    Decorador: perfila las llamadas a la función cuando el perfilador lo pide
+
+    Args:
+        nombre: Nombre de la función en los perfiles guardados
+        detalle: Función opcional que recibe los kwargs de la llamada y
+            retorna un diccionario que se guarda con el perfil
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            # Si ya hay un perfil en curso en este proceso, la llamada no
+            # cuenta para el pedido
+            if _ocupado.locked() or not _corresponde() or not _ocupado.acquire(blocking=False):
+                return funcion(*args, **kwargs)
+            try:
+                return _perfilar(funcion, args, kwargs, nombre, detalle)
+            finally:
+                _ocupado.release()
+        return envoltura
+    return decorador
+
+
+def _perfilar(funcion, args, kwargs, nombre, detalle):
+    propio = not tracemalloc.is_tracing()
+    if propio:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    inicial = tracemalloc.get_traced_memory()[0]
+    perfil = cProfile.Profile()
+    inicio = time.perf_counter()
+    error = None
+    try:
+        perfil.enable()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            perfil.disable()
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] - inicial
+        memoria = _memoria(tracemalloc.take_snapshot(), LINEAS_MEMORIA)
+        if propio:
+            tracemalloc.stop()
+        try:
+            _guardar(nombre, perfil, {
+                'funcion': nombre,
+                'fecha': time.time(),
+                'pid': os.getpid(),
+                'segundos': segundos,
+                'pico_bytes': pico,
+                'error': error,
+                'detalle': detalle(kwargs) if detalle else None,
+                'memoria': memoria,
+            })
+        except Exception as e:
+            print(f"Error al guardar el perfil de {nombre}: {e}")
+
+
+def _corto(archivo):
+    """Ruta desde site-packages o desde el directorio de la app"""
+    for raiz in ('site-packages' + os.sep, os.path.dirname(os.path.abspath(__file__)) + os.sep):
+        if raiz in archivo:
+            return archivo.split(raiz, 1)[1]
+    return archivo
+
+
+def _lugar(archivo, linea, funcion):
+    """Función de pstats como texto (las integradas no tienen archivo ni línea)"""
+    return f'{_corto(archivo)}:{linea}({funcion})' if linea else funcion
+
+
+def listar():
+    """Perfiles guardados, del más reciente al más viejo, sin las líneas de memoria"""
+    perfiles = []
+    for ruta in sorted(glob.glob(_ruta('*.json')), key=os.path.getmtime, reverse=True):
+        if os.path.basename(ruta) == _PEDIDO:
+            continue
+        try:
+            with open(ruta) as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        datos.pop('memoria', None)
+        datos['archivo'] = os.path.basename(ruta)[:-len('.json')] + '.prof'
+        perfiles.append(datos)
+    return perfiles
+
+
+def ruta_perfil(archivo):
+    """Ruta de un .prof guardado, o None si no existe (o el nombre no es de un perfil)"""
+    if os.path.basename(archivo) != archivo or not archivo.endswith('.prof'):
+        return None
+    ruta = _ruta(archivo)
+    return os.path.abspath(ruta) if os.path.isfile(ruta) else None
+
+
+def estado():
+    """Configuración, pedido compartido y perfiles guardados"""
+    with _lock:
+        llamadas = _estado['llamadas']
+    return {
+        'directorio': DIRECTORIO,
+        'max_perfiles': MAX_PERFILES,
+        'muestreo_entorno': MUESTREO,
+        'llamadas_proceso': llamadas,
+        'pedido': _leer_pedido(),
+        'perfiles': listar(),
+    }
+
+
+def resumen(limite=20, ultimos=None, orden='acumulado'):
+    """
+    Suma los perfiles guardados
+
+    Args:
+        limite: Funciones y líneas de memoria que se listan
+        ultimos: Sumar sólo los N perfiles más recientes
+        orden: 'acumulado' (tiempo incluyendo lo que llama) o 'propio'
+
+    Returns:
+        Diccionario con 'perfiles', 'segundos' totales, 'funciones' y 'memoria'
+    """
+    import pstats
+
+    if orden not in ('acumulado', 'propio'):
+        raise ValueError("orden debe ser 'acumulado' o 'propio'")
+    rutas = sorted(glob.glob(_ruta('*.prof')), key=os.path.getmtime, reverse=True)
+    if ultimos:
+        rutas = rutas[:ultimos]
+    if not rutas:
+        return {'perfiles': 0, 'segundos': 0.0, 'funciones': [], 'memoria': []}
+
+    estadisticas = pstats.Stats(rutas[0])
+    for ruta in rutas[1:]:
+        estadisticas.add(ruta)
+    indice = 3 if orden == 'acumulado' else 2
+    funciones = sorted(estadisticas.stats.items(), key=lambda par: par[1][indice], reverse=True)[:limite]
+
+    memoria = {}
+    segundos = 0.0
+    for ruta in rutas:
+        try:
+            with open(ruta[:-len('.prof')] + '.json') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        segundos += datos['segundos']
+        for linea in datos['memoria']:
+            acumulado = memoria.setdefault(linea['lugar'], {'lugar': linea['lugar'], 'bytes': 0, 'bloques': 0})
+            acumulado['bytes'] += linea['bytes']
+            acumulado['bloques'] += linea['bloques']
+
+    return {
+        'perfiles': len(rutas),
+        'segundos': segundos,
+        'funciones': [
+            {'funcion': _lugar(*clave), 'llamadas': llamadas, 'propio_s': propio, 'acumulado_s': acumulado,
+             'acumulado_por_perfil_s': acumulado / len(rutas)}
+            for clave, (_, llamadas, propio, acumulado, _) in funciones
+        ],
+        'memoria': sorted(memoria.values(), key=lambda linea: linea['bytes'], reverse=True)[:limite],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfila facturas locales e imprime el resumen")
+    parser.add_argument('--facturas', type=int, default=5, help="Facturas que se generan y perfilan")
+    parser.add_argument('--items', type=int, default=50, help="Items por factura")
+    parser.add_argument('--motor', help="Motor de generar_factura (por defecto FACTURA_MOTOR)")
+    parser.add_argument('--limite', type=int, default=15, help="Funciones y líneas que se listan")
+    args = parser.parse_args(argv)
+
+    # generar_factura usa el módulo importado, no este __main__
+    import perfilador
+    from generar_factura import buscar_logo, generar_factura
+    from totales import calcular_totales
+
+    with tempfile.TemporaryDirectory() as directorio:
+        perfilador.DIRECTORIO = directorio
+        logo_path = buscar_logo()
+        for numero in range(args.facturas):
+            items = [
+                {'descripcion': f'Panel solar {i}', 'cantidad': i % 5 + 1, 'valor_unitario': 150000 + i,
+                 'tiene_iva': i % 2 == 0}
+                for i in range(args.items)
+            ]
+            with perfilador._lock:
+                perfilador._estado['llamadas'] += 1
+            generar_factura(logo_path=logo_path, cliente='Juan Pérez', fecha='17/10/2026',
+                            factura_no=f'PERFIL-{numero}', items=items, en_memoria=True, motor=args.motor,
+                            **calcular_totales(items))
+        datos = perfilador.resumen(args.limite)
+
+    print(f"{datos['perfiles']} perfiles, {datos['segundos'] * 1000:.1f} ms en total\n")
+    print(f"{'Acumulado (ms)':>15} {'Propio (ms)':>12} {'Llamadas':>9}  Función")
+    for funcion in datos['funciones']:
+        print(f"{funcion['acumulado_s'] * 1000:15.1f} {funcion['propio_s'] * 1000:12.1f} "
+              f"{funcion['llamadas']:9d}  {funcion['funcion']}")
+    print(f"\n{'Memoria (KB)':>15} {'Bloques':>12}  Línea")
+    for linea in datos['memoria']:
+        print(f"{linea['bytes'] / 1024:15.1f} {linea['bloques']:12d}  {linea['lugar']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Perfiles de salida de los PDFs: tamaño contra fidelidad
+
+Las facturas se envían por WhatsApp y correo a través de n8n, así que cada
+byte del PDF es tiempo de envío. Un perfil decide:
+
+- La resolución con que se guarda el logo (puntos por pulgada del tamaño con
+  que se dibuja) y la calidad JPEG con que se recodifica. El logo original
+  pesa casi todo el PDF.
+- El nivel de compresión zlib de los streams: se reescriben en binario (sin
+  ASCII85, que los agranda un 25%) con ese nivel.
+- Si se eliminan los objetos duplicados y los que nadie referencia.
+- Si se conservan los metadatos del documento (/Info).
+
+Perfiles:
+
+- archivo: el PDF tal como sale de ReportLab, con el logo original.
+- mensajeria: logo a 150 ppp, streams recomprimidos y sin duplicados.
+- minimo: logo a 96 ppp con más compresión JPEG y sin metadatos.
+
+El perfil por defecto se elige con PDF_PERFIL. Uso del reporte de tamaño y
+tiempo de cada perfil:
+    python perfiles_pdf.py
+"""
+
+import base64
+import os
+import re
+import time
+import zlib
+
+PERFILES = {
+    'archivo': {'logo_ppp': None, 'calidad_jpeg': None, 'nivel_zlib': None, 'metadatos': True},
+    'mensajeria': {'logo_ppp': 150, 'calidad_jpeg': 85, 'nivel_zlib': 9, 'metadatos': True},
+    'minimo': {'logo_ppp': 96, 'calidad_jpeg': 70, 'nivel_zlib': 9, 'metadatos': False},
+}
+
+# Perfil que se usa cuando la petición no indica uno
+PERFIL = os.environ.get('PDF_PERFIL', 'archivo')
+
+_OBJETO = re.compile(rb'(\d+) 0 obj\r?\n')
+_REFERENCIA = re.compile(rb'(\d+) 0 R\b')
+_STREAM = re.compile(rb'>>\s*stream\r?\n')
+_FILTRO = re.compile(rb'/Filter\s*(?:\[([^\]]*)\]|(/\w+))')
+_LARGO = re.compile(rb'/Length\s+(\d+)\b(?!\s+\d+\s+R)')
+_XREF = re.compile(rb'xref\s+0\s+(\d+)\s+')
+_ENTRADA_XREF = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+
+
+def obtener_perfil(nombre=None):
+    """
+    Retorna la configuración del perfil (por defecto PDF_PERFIL)
+
+    Raises:
+        ValueError: Si el perfil no existe
+    """
+    nombre = nombre or PERFIL
+    if nombre not in PERFILES:
+        raise ValueError(f"Perfil de PDF desconocido: {nombre} (opciones: {', '.join(PERFILES)})")
+    return PERFILES[nombre]
+
+
+def _decodificar(contenido, filtros):
+    """
+    Quita los filtros ASCII85 y Flate del comienzo de la cadena
+
+    Returns:
+        (contenido decodificado, filtros que quedan por aplicar)
+    """
+    while filtros and filtros[0] in (b'ASCII85Decode', b'FlateDecode'):
+        if filtros[0] == b'ASCII85Decode':
+            contenido = re.sub(rb'\s', b'', contenido)
+            if contenido.endswith(b'~>'):
+                contenido = contenido[:-2]
+            contenido = base64.a85decode(contenido)
+        else:
+            contenido = zlib.decompress(contenido)
+        filtros = filtros[1:]
+    return contenido, filtros
+
+
+def _recomprimir(diccionario, contenido, nivel):
+    """Reescribe el stream en binario comprimido con el nivel indicado, si queda más chico"""
+    filtro = _FILTRO.search(diccionario)
+    filtros = (filtro.group(1) or filtro.group(2)).replace(b'/', b' ').split() if filtro else []
+    if b'ASCII85Decode' not in filtros and b'FlateDecode' not in filtros:
+        return diccionario, contenido  # Imagen JPEG u otro stream que no se toca
+    decodificado, resto = _decodificar(contenido, filtros)
+    comprimido = zlib.compress(decodificado, nivel)
+    if len(comprimido) < len(decodificado):
+        decodificado, resto = comprimido, [b'FlateDecode'] + resto
+    nuevo = b'/Filter [ ' + b' '.join(b'/' + f for f in resto) + b' ]' if resto else b''
+    diccionario = _FILTRO.sub(nuevo, diccionario)
+    diccionario = _LARGO.sub(b'/Length %d' % len(decodificado), diccionario)
+    return diccionario, decodificado
+
+
+def _leer(pdf_bytes):
+    """
+    Separa un PDF de ReportLab en encabezado, objetos y trailer
+
+    Returns:
+        (encabezado, {número: (diccionario, stream o None)}, trailer), o None si
+        el PDF no tiene la forma esperada (tabla xref simple, sin objetos
+        comprimidos ni actualizaciones)
+    """
+    inicio_xref = pdf_bytes.rfind(b'\nxref')
+    xref = _XREF.match(pdf_bytes, inicio_xref + 1)
+    if inicio_xref < 0 or xref is None or pdf_bytes.count(b'startxref') != 1:
+        return None
+    cantidad = int(xref.group(1))
+    entradas = _ENTRADA_XREF.findall(pdf_bytes, xref.end(), xref.end() + 20 * cantidad)
+    if len(entradas) != cantidad:
+        return None
+    posiciones = {n: int(pos) for n, (pos, _, tipo) in enumerate(entradas) if tipo == b'n'}
+    if not posiciones:
+        return None
+    orden = sorted(posiciones.items(), key=lambda par: par[1])
+    limites = [pos for _, pos in orden[1:]] + [inicio_xref + 1]
+
+    objetos = {}
+    for (numero, pos), fin in zip(orden, limites):
+        cabecera = _OBJETO.match(pdf_bytes, pos)
+        if cabecera is None or int(cabecera.group(1)) != numero:
+            return None
+        cuerpo = pdf_bytes[cabecera.end():fin].rstrip()
+        if not cuerpo.endswith(b'endobj'):
+            return None
+        cuerpo = cuerpo[:-len(b'endobj')].rstrip()
+        stream = _STREAM.search(cuerpo)
+        largo = _LARGO.search(cuerpo, 0, stream.start()) if stream else None
+        if stream and largo:
+            contenido = cuerpo[stream.end():stream.end() + int(largo.group(1))]
+            objetos[numero] = (cuerpo[:stream.start() + 2] + b'\n', contenido)
+        else:
+            objetos[numero] = (cuerpo + b'\n', None)
+    return pdf_bytes[:orden[0][1]], objetos, pdf_bytes[pdf_bytes.find(b'trailer', inicio_xref):]
+
+
+def _renumerar(texto, numeros):
+    return _REFERENCIA.sub(lambda m: b'%d 0 R' % numeros.get(int(m.group(1)), int(m.group(1))), texto)
+
+
+def _sin_duplicados(objetos):
+    """Une los objetos idénticos (repitiendo mientras la unión produzca nuevos iguales)"""
+    while True:
+        vistos, duplicados = {}, {}
+        for numero in sorted(objetos):
+            igual = vistos.setdefault(objetos[numero], numero)
+            if igual != numero:
+                duplicados[numero] = igual
+        if not duplicados:
+            return objetos
+        objetos = {
+            numero: (_renumerar(diccionario, duplicados), contenido)
+            for numero, (diccionario, contenido) in objetos.items() if numero not in duplicados
+        }
+
+
+def _alcanzables(objetos, raices):
+    """Números de los objetos a los que se llega desde las raíces del trailer"""
+    pendientes, alcanzados = list(raices), set()
+    while pendientes:
+        numero = pendientes.pop()
+        if numero in alcanzados or numero not in objetos:
+            continue
+        alcanzados.add(numero)
+        pendientes.extend(int(n) for n in _REFERENCIA.findall(objetos[numero][0]))
+    return alcanzados
+
+
+def optimizar_pdf(pdf_bytes, perfil=None):
+    """
+    Reescribe el PDF con la compresión y la limpieza del perfil
+
+    Con el perfil 'archivo' (o cualquier perfil sin nivel_zlib) retorna el
+    mismo PDF. Si el PDF no tiene la estructura que produce ReportLab, también
+    lo retorna sin cambios.
+    """
+    configuracion = obtener_perfil(perfil)
+    if configuracion['nivel_zlib'] is None:
+        return pdf_bytes
+    partes = _leer(pdf_bytes)
+    if partes is None:
+        return pdf_bytes
+    encabezado, objetos, trailer = partes
+
+    objetos = {
+        numero: _recomprimir(diccionario, contenido, configuracion['nivel_zlib']) if contenido is not None
+        else (diccionario, contenido)
+        for numero, (diccionario, contenido) in objetos.items()
+    }
+    objetos = _sin_duplicados(objetos)
+
+    raiz = re.search(rb'/Root\s+(\d+) 0 R', trailer)
+    info = re.search(rb'/Info\s+(\d+) 0 R', trailer) if configuracion['metadatos'] else None
+    identificador = re.search(rb'/ID\s*(\[[^\]]*\])', trailer)
+    if raiz is None:
+        return pdf_bytes
+    raices = [int(raiz.group(1))] + ([int(info.group(1))] if info else [])
+    conservados = sorted(_alcanzables(objetos, raices))
+    numeros = {anterior: nuevo for nuevo, anterior in enumerate(conservados, 1)}
+
+    salida = [encabezado]
+    largo = len(encabezado)
+    posiciones = []
+    for anterior in conservados:
+        diccionario, contenido = objetos[anterior]
+        objeto = b'%d 0 obj\n' % numeros[anterior] + _renumerar(diccionario, numeros)
+        if contenido is not None:
+            objeto += b'stream\n' + contenido + b'\nendstream\n'
+        objeto += b'endobj\n'
+        posiciones.append(largo)
+        salida.append(objeto)
+        largo += len(objeto)
+
+    salida.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(conservados) + 1))
+    salida.extend(b'%010d 00000 n \n' % posicion for posicion in posiciones)
+    salida.append(b'trailer\n<<\n')
+    if identificador:
+        salida.append(b'/ID ' + identificador.group(1) + b'\n')
+    if info:
+        salida.append(b'/Info %d 0 R\n' % numeros[int(info.group(1))])
+    salida.append(b'/Root %d 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n'
+                  % (numeros[raices[0]], len(conservados) + 1, largo))
+    return b''.join(salida)
+
+
+def reporte(repeticiones=5, tamanos=(1, 10, 100)):
+    """
+    Tamaño y tiempo de generación de cada perfil en los dos motores
+
+    Returns:
+        Lista de diccionarios con perfil, motor, items, bytes y milisegundos
+    """
+    from generar_factura import buscar_logo, generar_factura
+    from totales import calcular_totales
+
+    logo_path = buscar_logo()
+    filas = []
+    for cantidad in tamanos:
+        items = [
+            {'descripcion': f'Panel solar {i}', 'cantidad': i % 5 + 1, 'valor_unitario': 150000 + i,
+             'tiene_iva': i % 2 == 0}
+            for i in range(cantidad)
+        ]
+        datos = dict(
+            logo_path=logo_path, nit='900.123.456-7', telefono='300 123 4567', correo='ventas@anclaje.co',
+            cliente='Juan Pérez García', fecha='17/10/2026', factura_no='REPORTE-001', items=items,
+            en_memoria=True, **calcular_totales(items)
+        )
+        for motor in ('platypus', 'canvas'):
+            for perfil in PERFILES:
+                pdf = generar_factura(motor=motor, perfil=perfil, **datos)  # Primera vez: carga el logo
+                tiempos = []
+                for _ in range(repeticiones):
+                    inicio = time.perf_counter()
+                    generar_factura(motor=motor, perfil=perfil, **datos)
+                    tiempos.append(time.perf_counter() - inicio)
+                filas.append({
+                    'perfil': perfil, 'motor': motor, 'items': cantidad, 'bytes': len(pdf),
+                    'ms': sorted(tiempos)[len(tiempos) // 2] * 1000,
+                })
+    return filas
+
+
+if __name__ == '__main__':
+    print(f"{'Perfil':12} {'Motor':10} {'Items':>6} {'PDF (bytes)':>12} {'vs archivo':>11} {'Tiempo (ms)':>12}")
+    base = {}
+    for fila in reporte():
+        clave = (fila['motor'], fila['items'])
+        base.setdefault(clave, fila['bytes'])
+        print(f"{fila['perfil']:12} {fila['motor']:10} {fila['items']:6d} {fila['bytes']:12d} "
+              f"{fila['bytes'] / base[clave] - 1:+11.0%} {fila['ms']:12.2f}")
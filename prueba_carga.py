@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de la app contra un servidor local
+
+Arranca la app con Gunicorn (la misma configuración del Procfile) en un
+puerto libre, con sus bases y directorios en una carpeta temporal, y un
+webhook local que hace de n8n con la latencia y la tasa de fallos indicadas.
+Varios clientes concurrentes envían peticiones según la mezcla:
+
+    descarga        POST /generar con descargar_pdf=1 (responde el PDF)
+    webhook         POST /generar con email_cliente (el PDF va al webhook)
+    calcular_total  POST /calcular_total
+
+Las facturas van sin número, así que cada una se genera de verdad (la
+numeración automática les da uno distinto). Al terminar imprime un resumen
+JSON con el rendimiento, los percentiles p50/p95/p99 de latencia y la tasa
+de errores de cada escenario, y lo que recibió el webhook.
+
+Uso:
+    python prueba_carga.py --duracion 30 --concurrencia 16
+    python prueba_carga.py --mezcla descarga=6,webhook=3,calcular_total=1 \\
+        --latencia-webhook 0.2 --fallos-webhook 0.05 --salida carga.json
+    python prueba_carga.py --comparar carga.json      # diferencias contra otra corrida
+    python prueba_carga.py --url http://localhost:5000  # contra una app ya arrancada
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ESCENARIOS = ('descarga', 'webhook', 'calcular_total')
+MEZCLA = 'descarga=5,webhook=3,calcular_total=2'
+PERCENTILES = (50, 95, 99)
+
+
+class WebhookStub(BaseHTTPRequestHandler):
+    """Webhook local que hace de n8n: demora cada respuesta y falla a propósito algunas"""
+    protocol_version = 'HTTP/1.1'
+    latencia = 0.0
+    fallos = 0.0
+    _lock = threading.Lock()
+    conteos = {'recibidos': 0, 'fallidos': 0, 'bytes': 0}
+
+    def do_POST(self):
+        cuerpo = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latencia:
+            time.sleep(random.uniform(0.5, 1.5) * self.latencia)
+        falla = random.random() < self.fallos
+        with self._lock:
+            self.conteos['recibidos'] += 1
+            self.conteos['bytes'] += len(cuerpo)
+            if falla:
+                self.conteos['fallidos'] += 1
+        self.send_response(500 if falla else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_webhook(latencia, fallos):
+    """Arranca el webhook local en un puerto libre y retorna el servidor"""
+    WebhookStub.latencia = latencia
+    WebhookStub.fallos = fallos
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), WebhookStub)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_app(directorio, webhook_url, workers, esperar=60):
+    """
+    Arranca la app con Gunicorn y espera a que responda /listo
+
+    Returns:
+        Tupla (proceso, url base)
+    """
+    puerto = _puerto_libre()
+    entorno = dict(
+        os.environ,
+        PORT=str(puerto),
+        WEB_CONCURRENCY=str(workers),
+        N8N_WEBHOOK_URL=webhook_url,
+        N8N_SPOOL_DB=os.path.join(directorio, 'envios_n8n.db'),
+        ARCHIVO_DB=os.path.join(directorio, 'facturas.db'),
+        TRABAJOS_DB=os.path.join(directorio, 'trabajos_render.db'),
+        NUMERACION_DB=os.path.join(directorio, 'numeracion.db'),
+        PDF_CACHE_DIR=os.path.join(directorio, 'cache_pdf'),
+        PDF_SALIDA_DIR=os.path.join(directorio, 'salida'),
+        METRICAS_DIR=os.path.join(directorio, 'metricas'),
+        LIBRO_VENTAS_DIR=os.path.join(directorio, 'libro_ventas'),
+        PERFILADOR_DIR=os.path.join(directorio, 'perfiles'),
+    )
+    registro = open(os.path.join(directorio, 'gunicorn.log'), 'wb')
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=entorno,
+        stdout=registro, stderr=subprocess.STDOUT
+    )
+    url = f'http://127.0.0.1:{puerto}'
+    limite = time.monotonic() + esperar
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"Gunicorn terminó al arrancar (ver {registro.name})")
+        try:
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=2)
+            conexion.request('GET', '/listo')
+            if conexion.getresponse().status == 200:
+                return proceso, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError(f"La app no estuvo lista en {esperar} s (ver {registro.name})")
+
+
+def _formulario(aleatorio, max_items, webhook):
+    """Formulario como el de formulario_factura.html, sin número de factura"""
+    cantidad = aleatorio.randint(1, max_items)
+    datos = {
+        'nit': '901.234.567-8',
+        'telefono': '+57 300 123 4567',
+        'correo': 'ventas@anclajesolar.com',
+        'cliente': f'Cliente {aleatorio.randint(1, 10000)}',
+        'documento': f'CC {aleatorio.randint(10 ** 9, 10 ** 10)}',
+        'direccion': 'Calle 123 #45-67, Bogotá',
+        'fecha': '2026-01-15',
+        'descripcion[]': [f'Panel solar {i}' for i in range(cantidad)],
+        'cantidad[]': [str(aleatorio.randint(1, 10)) for _ in range(cantidad)],
+        'valor_unitario[]': [str(aleatorio.randint(1000, 2000000)) for _ in range(cantidad)],
+        'tiene_iva[]': [str(i) for i in range(cantidad) if aleatorio.random() < 0.5],
+    }
+    if webhook:
+        datos['email_cliente'] = 'cliente@example.com'
+    else:
+        datos['descargar_pdf'] = '1'
+    return urllib.parse.urlencode(datos, doseq=True).encode('utf-8')
+
+
+def _peticion(escenario, aleatorio, max_items):
+    """Método, ruta, cuerpo, encabezados y tipo de respuesta esperado del escenario"""
+    if escenario == 'calcular_total':
+        items = [
+            {'cantidad': aleatorio.randint(1, 10), 'valor_unitario': aleatorio.randint(1000, 2000000),
+             'tiene_iva': aleatorio.random() < 0.5}
+            for _ in range(aleatorio.randint(1, max_items))
+        ]
+        cuerpo = json.dumps({'items': items}).encode('utf-8')
+        return '/calcular_total', cuerpo, 'application/json', 'application/json'
+    cuerpo = _formulario(aleatorio, max_items, webhook=escenario == 'webhook')
+    esperado = 'application/json' if escenario == 'webhook' else 'application/pdf'
+    return '/generar', cuerpo, 'application/x-www-form-urlencoded', esperado
+
+
+def _cliente(url, escenarios, pesos, max_items, inicio_medicion, fin, semilla, resultados):
+    """Un cliente: envía peticiones por una conexión persistente hasta el final de la prueba"""
+    aleatorio = random.Random(semilla)
+    destino = urllib.parse.urlsplit(url)
+    conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=120)
+    while time.monotonic() < fin:
+        escenario = aleatorio.choices(escenarios, pesos)[0]
+        ruta, cuerpo, tipo, esperado = _peticion(escenario, aleatorio, max_items)
+        inicio = time.monotonic()
+        error = None
+        try:
+            conexion.request('POST', ruta, body=cuerpo, headers={'Content-Type': tipo})
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            if respuesta.status != 200:
+                error = f'HTTP {respuesta.status}'
+            elif not (respuesta.getheader('Content-Type') or '').startswith(esperado):
+                error = f"Respuesta {respuesta.getheader('Content-Type')}"
+        except (OSError, http.client.HTTPException) as e:
+            error = type(e).__name__
+            conexion.close()
+        latencia = time.monotonic() - inicio
+        if inicio >= inicio_medicion:
+            resultados.append((escenario, latencia, error))
+    conexion.close()
+
+
+def _percentil(ordenados, porcentaje):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordenados:
+        return None
+    posicion = max(0, -(-len(ordenados) * porcentaje // 100) - 1)
+    return ordenados[int(posicion)]
+
+
+def resumir(resultados, duracion):
+    """Rendimiento, percentiles de latencia (ms) y errores por escenario y en total"""
+    grupos = {'total': resultados}
+    for escenario in ESCENARIOS:
+        propios = [r for r in resultados if r[0] == escenario]
+        if propios:
+            grupos[escenario] = propios
+    resumen = {}
+    for nombre, grupo in grupos.items():
+        latencias = sorted(latencia for _, latencia, _ in grupo)
+        errores = {}
+        for _, _, error in grupo:
+            if error:
+                errores[error] = errores.get(error, 0) + 1
+        resumen[nombre] = {
+            'peticiones': len(grupo),
+            'por_segundo': round(len(grupo) / duracion, 2),
+            'tasa_error': round(sum(errores.values()) / len(grupo), 4) if grupo else 0,
+            'errores': errores,
+            **{f'p{p}_ms': round(_percentil(latencias, p) * 1000, 1) if latencias else None for p in PERCENTILES},
+            'max_ms': round(latencias[-1] * 1000, 1) if latencias else None,
+        }
+    return resumen
+
+
+def _comparar(resumen, anterior):
+    """Cambio relativo de rendimiento y percentiles respecto a otra corrida"""
+    cambios = {}
+    for nombre, actual in resumen['escenarios'].items():
+        previo = anterior.get('escenarios', {}).get(nombre)
+        if not previo:
+            continue
+        cambios[nombre] = {
+            metrica: f'{actual[metrica] / previo[metrica] - 1:+.0%}'
+            for metrica in ('por_segundo', 'p50_ms', 'p95_ms', 'p99_ms')
+            if actual.get(metrica) and previo.get(metrica)
+        }
+    return cambios
+
+
+def _mezcla(texto):
+    """Convierte 'descarga=5,webhook=3' en {'descarga': 5.0, 'webhook': 3.0}"""
+    mezcla = {}
+    for parte in texto.split(','):
+        escenario, _, peso = parte.partition('=')
+        escenario = escenario.strip()
+        if escenario not in ESCENARIOS:
+            raise argparse.ArgumentTypeError(f"Escenario desconocido: {escenario} (opciones: {', '.join(ESCENARIOS)})")
+        mezcla[escenario] = float(peso or 1)
+    return mezcla
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de la app con un webhook n8n simulado")
+    parser.add_argument('--duracion', type=float, default=20, help="Segundos de medición")
+    parser.add_argument('--calentamiento', type=float, default=3, help="Segundos iniciales que no se miden")
+    parser.add_argument('--concurrencia', type=int, default=8, help="Clientes enviando peticiones a la vez")
+    parser.add_argument('--mezcla', type=_mezcla, default=_mezcla(MEZCLA), help=f"Pesos de cada escenario ({MEZCLA})")
+    parser.add_argument('--items', type=int, default=10, help="Items máximos por factura")
+    parser.add_argument('--workers', type=int, default=2, help="Workers de Gunicorn de la app local")
+    parser.add_argument('--latencia-webhook', type=float, default=0.1, help="Segundos que tarda el webhook simulado")
+    parser.add_argument('--fallos-webhook', type=float, default=0.0, help="Fracción de envíos que el webhook rechaza")
+    parser.add_argument('--url', help="Usar una app ya arrancada en lugar de arrancar una local")
+    parser.add_argument('--semilla', type=int, default=1, help="Semilla de las peticiones aleatorias")
+    parser.add_argument('--salida', help="Guardar el resumen JSON en este archivo")
+    parser.add_argument('--comparar', help="Resumen JSON de otra corrida para comparar")
+    args = parser.parse_args(argv)
+
+    webhook = iniciar_webhook(args.latencia_webhook, args.fallos_webhook)
+    webhook_url = f'http://127.0.0.1:{webhook.server_port}/webhook/factura-generada'
+    directorio = tempfile.TemporaryDirectory(prefix='prueba_carga_')
+    proceso = None
+    try:
+        url = args.url
+        if url is None:
+            proceso, url = iniciar_app(directorio.name, webhook_url, args.workers)
+        else:
+            print(f"Webhook simulado en {webhook_url} (configúralo como N8N_WEBHOOK_URL)", file=sys.stderr)
+
+        escenarios = list(args.mezcla)
+        pesos = [args.mezcla[e] for e in escenarios]
+        resultados = []
+        inicio_medicion = time.monotonic() + args.calentamiento
+        fin = inicio_medicion + args.duracion
+        clientes = [
+            threading.Thread(target=_cliente, args=(url, escenarios, pesos, args.items, inicio_medicion, fin,
+                                                    args.semilla + i, resultados))
+            for i in range(args.concurrencia)
+        ]
+        for cliente in clientes:
+            cliente.start()
+        for cliente in clientes:
+            cliente.join()
+        duracion = time.monotonic() - inicio_medicion
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+        webhook.shutdown()
+        directorio.cleanup()
+
+    resumen = {
+        'configuracion': {
+            'duracion_s': args.duracion, 'concurrencia': args.concurrencia, 'mezcla': args.mezcla,
+            'items_max': args.items, 'workers': args.workers if args.url is None else None,
+            'latencia_webhook_s': args.latencia_webhook, 'fallos_webhook': args.fallos_webhook,
+        },
+        'escenarios': resumir(resultados, duracion),
+        'webhook': dict(WebhookStub.conteos),
+    }
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            resumen['comparacion'] = _comparar(resumen, json.load(f))
+
+    texto = json.dumps(resumen, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
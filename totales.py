@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Cálculo de subtotal, IVA y total de las facturas
+
+Todos los cálculos se hacen en centavos enteros para evitar los errores de
+redondeo de float. El IVA se calcula sobre la suma de los items gravados y
+se redondea una sola vez, al centavo, con redondeo comercial (mitad hacia
+arriba).
+
+Además del cálculo por factura hay una versión por lotes sobre arreglos de
+NumPy, pensada para reportes y revalidaciones de muchas facturas a la vez.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+# Tarifa general de IVA (19%), expresada como fracción entera
+IVA_NUMERADOR = 19
+IVA_DENOMINADOR = 100
+
+
+def a_centavos(valor):
+    """Convierte un valor en pesos (int, float, str o Decimal) a centavos enteros"""
+    if isinstance(valor, int):
+        return valor * 100
+    return int((Decimal(str(valor)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def a_pesos(centavos):
+    """Convierte centavos enteros a pesos (float con dos decimales exactos)"""
+    return centavos / 100
+
+
+def iva_centavos(base_centavos):
+    """IVA de una base gravable en centavos, redondeado mitad hacia arriba"""
+    return (base_centavos * IVA_NUMERADOR * 2 + IVA_DENOMINADOR) // (IVA_DENOMINADOR * 2)
+
+
+def calcular_totales(items, iva_por_defecto=False):
+    """
+    Calcula subtotal, IVA y total de una factura
+
+    Args:
+        items: Lista de diccionarios con 'cantidad', 'valor_unitario' y opcionalmente 'tiene_iva'
+        iva_por_defecto: Valor de 'tiene_iva' para los items que no lo traen
+
+    Returns:
+        Diccionario con 'subtotal', 'iva' y 'total' en pesos
+    """
+    subtotal = 0
+    base_gravable = 0
+    for item in items:
+        linea = int(item['cantidad']) * a_centavos(item['valor_unitario'])
+        subtotal += linea
+        if item.get('tiene_iva', iva_por_defecto):
+            base_gravable += linea
+    iva = iva_centavos(base_gravable)
+    return {
+        'subtotal': a_pesos(subtotal),
+        'iva': a_pesos(iva),
+        'total': a_pesos(subtotal + iva)
+    }
+
+
+def arreglos_desde_facturas(facturas, iva_por_defecto=False):
+    """
+    Convierte una lista de facturas en los arreglos que usa calcular_totales_lote
+
+    Args:
+        facturas: Lista de facturas, cada una con su lista 'items'
+
+    Returns:
+        Tupla (indice_factura, cantidades, valores_centavos, tiene_iva) de arreglos NumPy
+    """
+    import numpy as np
+
+    indices, cantidades, valores, gravados = [], [], [], []
+    for i, factura in enumerate(facturas):
+        for item in factura.get('items', []):
+            indices.append(i)
+            cantidades.append(int(item['cantidad']))
+            valores.append(a_centavos(item['valor_unitario']))
+            gravados.append(bool(item.get('tiene_iva', iva_por_defecto)))
+    return (
+        np.array(indices, dtype=np.int64),
+        np.array(cantidades, dtype=np.int64),
+        np.array(valores, dtype=np.int64),
+        np.array(gravados, dtype=bool)
+    )
+
+
+def calcular_totales_lote(indice_factura, cantidades, valores_centavos, tiene_iva, num_facturas=None):
+    """
+    Calcula subtotal, IVA y total de muchas facturas a la vez
+
+    Cada posición de los arreglos es un item; indice_factura indica a qué
+    factura pertenece. Los cálculos son en centavos con enteros de 64 bits,
+    así que dan exactamente lo mismo que calcular_totales.
+
+    Args:
+        indice_factura: Arreglo de enteros con el índice de factura de cada item
+        cantidades: Arreglo de enteros con la cantidad de cada item
+        valores_centavos: Arreglo de enteros con el valor unitario en centavos
+        tiene_iva: Arreglo booleano, True si el item está gravado
+        num_facturas: Cantidad de facturas (por defecto, el índice máximo + 1)
+
+    Returns:
+        Tupla (subtotal, iva, total) de arreglos int64 en centavos, uno por factura
+    """
+    import numpy as np
+
+    indice_factura = np.asarray(indice_factura, dtype=np.int64)
+    lineas = np.asarray(cantidades, dtype=np.int64) * np.asarray(valores_centavos, dtype=np.int64)
+    gravadas = np.where(np.asarray(tiene_iva, dtype=bool), lineas, 0)
+    if num_facturas is None:
+        num_facturas = int(indice_factura.max()) + 1 if indice_factura.size else 0
+
+    # Agrupar los items por factura (ordenados) y sumar cada grupo con reduceat
+    if indice_factura.size and np.any(indice_factura[1:] < indice_factura[:-1]):
+        orden = np.argsort(indice_factura, kind='stable')
+        indice_factura = indice_factura[orden]
+        lineas = lineas[orden]
+        gravadas = gravadas[orden]
+    inicios = np.searchsorted(indice_factura, np.arange(num_facturas))
+    vacias = inicios == np.append(inicios[1:], indice_factura.size)
+    # Se agrega un cero al final para que los inicios de facturas vacías sean válidos
+    subtotal = np.add.reduceat(np.append(lineas, 0), inicios)
+    base_gravable = np.add.reduceat(np.append(gravadas, 0), inicios)
+    subtotal[vacias] = 0
+    base_gravable[vacias] = 0
+
+    iva = (base_gravable * IVA_NUMERADOR * 2 + IVA_DENOMINADOR) // (IVA_DENOMINADOR * 2)
+    return subtotal, iva, subtotal + iva
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Trabajos de generación de PDFs en segundo plano
+
+POST /trabajos guarda la factura como trabajo pendiente y responde enseguida
+con su id; un grupo de workers genera los PDFs fuera de la petición web, de
+modo que una ráfaga de facturas no deja esperando a los demás clientes. El
+estado y el PDF terminado se consultan con GET /trabajos/<id>.
+
+Los trabajos viven en SQLite (compartido por todos los workers de Gunicorn,
+así que cualquiera puede responder por un trabajo). Cada worker reserva un
+trabajo por un tiempo limitado: si el proceso se detiene a mitad, la reserva
+vence y otro worker lo retoma. Por defecto los PDFs se generan en procesos
+aparte, para que ReportLab no compita por el GIL con los hilos que atienden
+peticiones.
+"""
+
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import arranque
+import cache_pdf
+import numeracion
+from archivo_facturas import archivar_factura
+from envios_n8n import encolar_envio
+
+# Configuración por variables de entorno
+TRABAJOS_DB = os.environ.get('TRABAJOS_DB', 'trabajos_render.db')
+NUM_WORKERS = int(os.environ.get('TRABAJOS_WORKERS', '2'))
+MAX_COLA = int(os.environ.get('TRABAJOS_MAX_COLA', '100'))
+MODO = os.environ.get('TRABAJOS_MODO', 'procesos')  # 'procesos' o 'hilos'
+TIMEOUT = float(os.environ.get('TRABAJOS_TIMEOUT', '120'))
+RETENCION = float(os.environ.get('TRABAJOS_RETENCION_SEGUNDOS', '3600'))
+
+# Cada cuánto se borran los trabajos terminados más viejos que la retención
+INTERVALO_LIMPIEZA = 60
+
+# Segundos que espera un worker tras un error de la base antes de reintentar
+ESPERA_ERROR = 1.0
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    datos TEXT NOT NULL,
+    logo_path TEXT,
+    clave TEXT,
+    envio TEXT,
+    pdf BLOB,
+    error TEXT,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    vence REAL,
+    numero_asignado INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, creado);
+"""
+
+_local = threading.local()
+_lock_inicio = threading.Lock()
+_hilos = []
+_ejecutor = []
+_hay_trabajo = threading.Event()
+_estado = {'ultima_limpieza': 0.0}
+
+
+def _reiniciar_en_hijo():
+    """Los hilos, el ejecutor y las conexiones del proceso padre no pasan al hijo"""
+    global _lock_inicio, _hay_trabajo, _local
+    _lock_inicio = threading.Lock()
+    _hay_trabajo = threading.Event()
+    _local = threading.local()
+    _hilos.clear()
+    _ejecutor.clear()
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+class ColaLlena(Exception):
+    """La cola de trabajos alcanzó TRABAJOS_MAX_COLA"""
+
+
+def _conexion():
+    """Retorna la conexión del hilo actual, creándola si no existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(TRABAJOS_DB, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_ESQUEMA)
+        columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(trabajos)')}
+        if 'numero_asignado' not in columnas:
+            # Bases creadas antes de que la cola asignara números
+            try:
+                conn.execute('ALTER TABLE trabajos ADD COLUMN numero_asignado INTEGER NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                pass  # otro proceso la agregó al mismo tiempo
+        _local.conn = conn
+    return conn
+
+
+def _descartar_conexion():
+    """Cierra la conexión del hilo actual (por ejemplo, si quedó a mitad de una transacción)"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+@contextlib.contextmanager
+def _transaccion(conn):
+    """Ejecuta un bloque dentro de una transacción con bloqueo de escritura"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def encolar_trabajo(datos, logo_path=None, clave=None, envio=None, asignar_numero=None):
+    """
+    Agrega un trabajo de generación a la cola
+
+    Args:
+        datos: Diccionario con los argumentos de generar_factura
+        logo_path: Ruta del logo a usar
+        clave: Clave de caché del PDF; por defecto se calcula con
+            cache_pdf.clave_factura
+        envio: Diccionario {'url', 'datos'} para encolar el envío a n8n al terminar
+        asignar_numero: Función que retorna el número para una factura sin
+            factura_no (se llama sólo si la cola admite el trabajo). Si el
+            trabajo termina en error, el número se devuelve con
+            numeracion.devolver_numero
+
+    Returns:
+        El id del trabajo
+
+    Raises:
+        ColaLlena: si ya hay TRABAJOS_MAX_COLA trabajos sin terminar
+    """
+    trabajo_id = uuid.uuid4().hex
+    conn = _conexion()
+    with _transaccion(conn):
+        en_cola = conn.execute(
+            "SELECT COUNT(*) FROM trabajos WHERE estado IN ('pendiente', 'procesando')"
+        ).fetchone()[0]
+        if en_cola >= MAX_COLA:
+            raise ColaLlena(f"Hay {en_cola} trabajos en cola (máximo {MAX_COLA})")
+        asignado = asignar_numero is not None and not datos.get('factura_no')
+        if asignado:
+            datos = dict(datos, factura_no=asignar_numero())
+            if envio:
+                envio = dict(envio, datos=dict(envio['datos'], factura_no=datos['factura_no']))
+            clave = None
+        if clave is None:
+            clave = cache_pdf.clave_factura(datos, logo_path)
+        conn.execute(
+            'INSERT INTO trabajos (id, datos, logo_path, clave, envio, creado, numero_asignado) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (trabajo_id, json.dumps(datos), logo_path, clave,
+             json.dumps(envio) if envio else None, time.time(), int(asignado))
+        )
+    iniciar_workers()
+    _hay_trabajo.set()
+    return trabajo_id
+
+
+def _tomar_trabajo(conn):
+    """
+    Reserva el trabajo pendiente más antiguo (o uno cuya reserva venció)
+
+    Returns:
+        La fila del trabajo seguida del momento de la reserva, que identifica
+        al worker que la tiene (ver _terminar), o None si no hay trabajo
+    """
+    ahora = time.time()
+    with _transaccion(conn):
+        fila = conn.execute(
+            "SELECT id, datos, logo_path, clave, envio, numero_asignado FROM trabajos "
+            "WHERE estado = 'pendiente' OR (estado = 'procesando' AND vence <= ?) "
+            "ORDER BY creado LIMIT 1",
+            (ahora,)
+        ).fetchone()
+        if fila:
+            conn.execute(
+                "UPDATE trabajos SET estado = 'procesando', iniciado = ?, vence = ? WHERE id = ?",
+                (ahora, ahora + TIMEOUT, fila[0])
+            )
+            fila = tuple(fila) + (ahora,)
+    return fila
+
+
+def _renderizar(datos, logo_path):
+    """Genera el PDF en memoria (se ejecuta en el proceso del ejecutor)"""
+    from generar_factura import generar_factura
+    return generar_factura(logo_path=logo_path, en_memoria=True, **datos)
+
+
+def _iniciar_proceso():
+    """Precalienta cada proceso del ejecutor antes de su primer trabajo"""
+    from generar_factura import precalentar
+    precalentar()
+
+
+def _obtener_ejecutor():
+    """
+    Ejecutor compartido por los workers de este proceso
+
+    Con TRABAJOS_MODO=procesos es un pool de procesos; se usa 'spawn' y no
+    'fork' porque el proceso web ya tiene hilos y un fork podría heredar un
+    lock tomado por otro hilo. Con 'hilos' es un pool de hilos (los workers
+    de la cola generan en su propio hilo; este pool lo usa enviar_render).
+    """
+    if not _ejecutor:
+        with _lock_inicio:
+            if not _ejecutor:
+                if MODO == 'procesos':
+                    _ejecutor.append(concurrent.futures.ProcessPoolExecutor(
+                        max_workers=NUM_WORKERS,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_iniciar_proceso
+                    ))
+                else:
+                    _ejecutor.append(concurrent.futures.ThreadPoolExecutor(
+                        max_workers=NUM_WORKERS, thread_name_prefix='trabajos-render-pdf'
+                    ))
+    return _ejecutor[0]
+
+
+def enviar_render(datos, logo_path):
+    """
+    Genera un PDF en el ejecutor de este proceso, sin pasar por la cola
+
+    Returns:
+        Un concurrent.futures.Future con los bytes del PDF
+    """
+    return _obtener_ejecutor().submit(_renderizar, datos, logo_path)
+
+
+def _generar(datos, logo_path, clave):
+    """
+    Genera el PDF de un trabajo, o lo toma de la caché
+
+    Returns:
+        Tupla (pdf_bytes, nuevo); nuevo es False si salió de la caché
+    """
+    pdf_bytes = cache_pdf.obtener(clave) if clave else None
+    if pdf_bytes is not None:
+        return pdf_bytes, False
+    if MODO == 'procesos':
+        pdf_bytes = enviar_render(datos, logo_path).result()
+    else:
+        pdf_bytes = _renderizar(datos, logo_path)
+    if clave:
+        cache_pdf.guardar(clave, pdf_bytes)
+    return pdf_bytes, True
+
+
+def _publicar(datos, pdf_bytes, nuevo, envio):
+    """Archiva la factura, la registra en el libro de ventas y encola el envío a n8n"""
+    if nuevo and datos.get('factura_no'):
+        try:
+            archivar_factura(datos, pdf_bytes)
+        except Exception as e:
+            print(f"Error al archivar factura {datos['factura_no']}: {e}")
+        try:
+            arranque.importar('libro_ventas').registrar_venta(datos)
+        except Exception as e:
+            print(f"Error al registrar la venta {datos['factura_no']}: {e}")
+
+    if envio:
+        try:
+            encolar_envio(envio['url'], envio['datos'], pdf_bytes, f"factura_{datos.get('factura_no', '')}.pdf")
+        except Exception as e:
+            print(f"Error al encolar envío a n8n: {e}")
+
+
+def _terminar(conn, trabajo_id, reserva, estado, pdf_bytes=None, error=None):
+    """
+    Marca un trabajo como terminado, si este worker todavía tiene la reserva
+
+    Si la reserva venció y otro worker retomó el trabajo, no se toca: ese
+    worker es el que lo termina.
+
+    Returns:
+        True si se marcó el trabajo
+    """
+    cursor = conn.execute(
+        "UPDATE trabajos SET estado = ?, pdf = ?, error = ?, terminado = ? "
+        "WHERE id = ? AND estado = 'procesando' AND iniciado = ?",
+        (estado, pdf_bytes, error, time.time(), trabajo_id, reserva)
+    )
+    return cursor.rowcount == 1
+
+
+def _limpiar(conn):
+    """Borra los trabajos terminados hace más de TRABAJOS_RETENCION_SEGUNDOS"""
+    ahora = time.time()
+    if ahora - _estado['ultima_limpieza'] < INTERVALO_LIMPIEZA:
+        return
+    _estado['ultima_limpieza'] = ahora
+    conn.execute(
+        "DELETE FROM trabajos WHERE estado IN ('listo', 'error') AND terminado < ?",
+        (ahora - RETENCION,)
+    )
+
+
+def _atender(conn):
+    """Genera el siguiente trabajo de la cola, o espera a que haya uno"""
+    fila = _tomar_trabajo(conn)
+    if fila is None:
+        _limpiar(conn)
+        _hay_trabajo.wait(timeout=1)
+        _hay_trabajo.clear()
+        return
+
+    trabajo_id, datos, logo_path, clave, envio, asignado, reserva = fila
+    datos = json.loads(datos)
+    try:
+        pdf_bytes, nuevo = _generar(datos, logo_path, clave)
+    except Exception as e:
+        print(f"Error en el trabajo {trabajo_id}: {e}")
+        # El número que asignó la cola no llegó a usarse: se devuelve a la serie
+        if _terminar(conn, trabajo_id, reserva, 'error', error=str(e)) and asignado:
+            numeracion.devolver_numero(datos['factura_no'])
+        return
+    # Archivar y enviar sólo si el trabajo sigue siendo de este worker: si la
+    # reserva venció, otro worker lo está generando y lo publicará él
+    if _terminar(conn, trabajo_id, reserva, 'listo', pdf_bytes=pdf_bytes):
+        _publicar(datos, pdf_bytes, nuevo, json.loads(envio) if envio else None)
+    else:
+        print(f"El trabajo {trabajo_id} lo retomó otro worker (venció la reserva)")
+
+
+def _worker():
+    """
+    Bucle de un worker: toma trabajos de la cola y genera sus PDFs
+
+    Un error de la base no detiene el hilo: se descarta la conexión y se
+    reintenta tras ESPERA_ERROR segundos (el trabajo reservado se retoma
+    cuando vence su reserva).
+    """
+    while True:
+        try:
+            _atender(_conexion())
+        except Exception as e:
+            print(f"Error en el worker de trabajos de render: {e}")
+            _descartar_conexion()
+            time.sleep(ESPERA_ERROR)
+
+
+def iniciar_workers():
+    """Arranca los workers de generación y reemplaza los que hayan terminado"""
+    if len(_hilos) == NUM_WORKERS and all(hilo.is_alive() for hilo in _hilos):
+        return
+    with _lock_inicio:
+        for i in range(NUM_WORKERS):
+            if i < len(_hilos) and _hilos[i].is_alive():
+                continue
+            hilo = threading.Thread(target=_worker, name=f'trabajos-render-{i}', daemon=True)
+            hilo.start()
+            if i < len(_hilos):
+                _hilos[i] = hilo
+            else:
+                _hilos.append(hilo)
+
+
+def reanudar_pendientes():
+    """
+    Arranca los workers si quedaron trabajos sin terminar de una ejecución anterior
+
+    Se llama al arrancar cada proceso del servidor. Sin esto, tras un reinicio
+    los trabajos pendientes (y los que estaban procesándose cuando el proceso
+    se detuvo) esperarían hasta el próximo POST /trabajos; con los workers
+    arrancados, los que quedaron en 'procesando' se retoman cuando vence su
+    reserva.
+
+    Returns:
+        Cantidad de trabajos sin terminar
+    """
+    sin_terminar = _conexion().execute(
+        "SELECT COUNT(*) FROM trabajos WHERE estado IN ('pendiente', 'procesando')"
+    ).fetchone()[0]
+    if sin_terminar:
+        iniciar_workers()
+        _hay_trabajo.set()
+    return sin_terminar
+
+
+def obtener_trabajo(trabajo_id):
+    """Estado de un trabajo (sin el PDF), o None si no existe"""
+    conn = _conexion()
+    fila = conn.execute(
+        'SELECT estado, datos, error, creado, iniciado, terminado, length(pdf) FROM trabajos WHERE id = ?',
+        (trabajo_id,)
+    ).fetchone()
+    if fila is None:
+        return None
+    estado, datos, error, creado, iniciado, terminado, pdf_bytes = fila
+    trabajo = {
+        'id': trabajo_id,
+        'estado': estado,
+        'factura_no': json.loads(datos).get('factura_no'),
+        'creado': creado,
+        'iniciado': iniciado,
+        'terminado': terminado,
+        'error': error,
+        'pdf_bytes': pdf_bytes
+    }
+    if estado == 'pendiente':
+        # Trabajos que se atenderán antes que este
+        trabajo['adelante'] = conn.execute(
+            "SELECT COUNT(*) FROM trabajos WHERE estado = 'pendiente' AND creado < ?", (creado,)
+        ).fetchone()[0]
+    return trabajo
+
+
+def obtener_pdf_trabajo(trabajo_id):
+    """
+    PDF de un trabajo
+
+    Returns:
+        Tupla (estado, pdf_bytes, factura_no); estado es None si el trabajo no existe
+    """
+    fila = _conexion().execute(
+        'SELECT estado, pdf, datos FROM trabajos WHERE id = ?', (trabajo_id,)
+    ).fetchone()
+    if fila is None:
+        return None, None, None
+    estado, pdf_bytes, datos = fila
+    return estado, pdf_bytes, json.loads(datos).get('factura_no')
+
+
+def estadisticas():
+    """Trabajos por estado y configuración de la cola"""
+    conteos = dict(_conexion().execute('SELECT estado, COUNT(*) FROM trabajos GROUP BY estado').fetchall())
+    return {
+        'pendiente': conteos.get('pendiente', 0),
+        'procesando': conteos.get('procesando', 0),
+        'listo': conteos.get('listo', 0),
+        'error': conteos.get('error', 0),
+        'max_cola': MAX_COLA,
+        'workers': NUM_WORKERS,
+        'modo': MODO
+    }